@@ -6,8 +6,9 @@ status, data = make_request("GET", "/orders/", token_file="customer_token.txt")
 
 if status == 200:
     print("SUCCESS")
-    print(f"Found {len(data)} orders")
-    for order in data:
+    orders = data['results']
+    print(f"Found {len(orders)} orders (first page)")
+    for order in orders:
         print(f"Order #{order['id']}: Total ${order['total_amount']} ({len(order['items'])} items)")
 else:
     print("FAILED")
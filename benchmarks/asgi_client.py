@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+
+async def call(app, method, path, headers=None, body=b''):
+    """Drive one HTTP request through an ASGI app in-process. Returns (status, headers, body)."""
+    path, _, query = path.partition('?')
+    header_list = [(b'host', b'testserver')]
+    for name, value in (headers or {}).items():
+        header_list.append((name.lower().encode(), value.encode()))
+    if body:
+        header_list.append((b'content-length', str(len(body)).encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': header_list,
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Never disconnect, Django cancels this once the response is sent
+        await asyncio.Event().wait()
+
+    response = {'status': None, 'headers': {}, 'body': []}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {k.decode().lower(): v.decode() for k, v in message.get('headers', [])}
+        elif message['type'] == 'http.response.body':
+            response['body'].append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return response['status'], response['headers'], b''.join(response['body'])
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def load(app, make_request, total, concurrency):
+    """
+    Run `total` requests with `concurrency` in flight. make_request(i) returns
+    (method, path, headers, body). Returns latencies (seconds), elapsed, errors.
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, path, headers, body = make_request(i)
+            start = time.perf_counter()
+            status, _, _ = await call(app, method, path, headers, body)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, errors
@@ -0,0 +1,52 @@
+"""
+Queries and time per authenticated request through CustomAuthMiddleware +
+TenantMiddleware, cold (cache cleared before every request) vs warm.
+
+    python benchmarks/auth_cache.py [requests]
+"""
+import sys
+import time
+
+from utils import setup_django, temporary_database
+
+setup_django()
+
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from store.models import Tenant, StoreUser
+from store.authentication import create_token, principal_cache
+from store.middleware import CustomAuthMiddleware, TenantMiddleware
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+
+def run(requests, cold):
+    handler = CustomAuthMiddleware(TenantMiddleware(lambda request: HttpResponse()))
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        for request in requests:
+            if cold:
+                principal_cache.clear()
+            handler(request)
+        elapsed = time.perf_counter() - start
+    return len(ctx.captured_queries) / len(requests), elapsed
+
+
+with temporary_database():
+    tenant = Tenant.objects.create(name="Bench Shop")
+    owner = StoreUser.objects.create(username="bench_owner", email="bench@example.com",
+                                     password="!", role="OWNER", tenant=tenant)
+    token = create_token(owner)
+    factory = RequestFactory()
+    requests = [factory.get("/api/orders/", HTTP_AUTHORIZATION=f"Bearer {token}") for _ in range(N)]
+
+    print(f"--- Auth middleware, {N} requests ---")
+    for label, cold in (("cold", True), ("warm", False)):
+        principal_cache.clear()
+        principal_cache.reset_stats()
+        queries, elapsed = run(requests, cold)
+        print(f"{label}: {queries:.2f} queries/request, {N / elapsed:,.0f} requests/sec")
+    print(f"cache: {principal_cache.stats()}")
@@ -0,0 +1,45 @@
+"""
+Requests/sec and p99 latency of GET /api/products/ and /api/products/<id>/
+through the ASGI app, sync DRF viewset vs async views (ASYNC_CATALOG_VIEWS),
+and async views behind the catalog response cache (RESPONSE_CACHE_ENABLED).
+
+    python benchmarks/catalog_async.py [requests_per_run] [products]
+"""
+import sys
+import asyncio
+
+from utils import setup_django, temporary_database
+
+setup_django()
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+
+from asgi_client import load, percentile
+from store.models import Tenant, Product
+
+TOTAL = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+PRODUCTS = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+with temporary_database():
+    tenant = Tenant.objects.create(name="Bench Shop")
+    Product.objects.bulk_create(
+        Product(tenant=tenant, name=f"Product {i}", price="9.99", stock=10) for i in range(PRODUCTS)
+    )
+    ids = list(Product.objects.values_list('id', flat=True))
+    app = get_asgi_application()
+
+    def make_request(i):
+        if i % 2:
+            return 'GET', f'/api/products/{ids[i % len(ids)]}/?tenant={tenant.id}', {}, b''
+        return 'GET', f'/api/products/?tenant={tenant.id}', {}, b''
+
+    print(f"--- Catalog reads, {TOTAL} requests per run, {PRODUCTS} products ---")
+    for concurrency in (100, 1000):
+        for label, async_views, cached in (("sync  ", False, False), ("async ", True, False), ("cached", True, True)):
+            settings.ASYNC_CATALOG_VIEWS = async_views
+            settings.RESPONSE_CACHE_ENABLED = cached
+            latencies, elapsed, errors = asyncio.run(load(app, make_request, TOTAL, concurrency))
+            print(f"c={concurrency:<5} {label}: {TOTAL / elapsed:8,.0f} req/s  "
+                  f"p50={percentile(latencies, 50) * 1000:7.1f}ms  "
+                  f"p99={percentile(latencies, 99) * 1000:7.1f}ms  errors={errors}")
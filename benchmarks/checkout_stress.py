@@ -0,0 +1,134 @@
+"""
+Many threads checking out the same hot product at once. Compares the write
+phase of the old OrderViewSet.create (Order/OrderItem .create() and
+product.save() per line, stock checked in Python) with the current one
+(bulk_create + one conditional UPDATE), then runs the real endpoint, and
+last the flash-sale path: the product enrolled in store.reservations (local
+backend), each buyer holding a unit on add-to-cart and checking out with it,
+in the request or queued (`Prefer: respond-async`) for process_checkouts,
+whose drain is timed apart. Reports checkouts/sec and oversold units.
+
+    python benchmarks/checkout_stress.py [orders] [threads] [stock]
+"""
+import sys
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import setup_django, temporary_database
+
+setup_django()
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.test import Client, override_settings
+
+from store.models import Tenant, StoreUser, Product, Order, OrderItem, Checkout
+from store.authentication import create_token
+from store.checkout import deduct_stock, CheckoutError
+from store import checkout, reservations
+
+logging.getLogger("django.request").setLevel(logging.ERROR)
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+STOCK = int(sys.argv[3]) if len(sys.argv) > 3 else ORDERS // 2
+
+
+def legacy_checkout(user, product_id, quantity):
+    # The pre-change write path, kept here for comparison only
+    product = Product.all_objects.get(id=product_id)
+    if product.stock < quantity:
+        return 400
+    with transaction.atomic():
+        order = Order.objects.create(tenant_id=product.tenant_id, customer=user, status='COMPLETED',
+                                     total_amount=product.price * quantity)
+        OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price)
+        product.stock -= quantity
+        product.save()
+    return 201
+
+
+def current_checkout(user, product_id, quantity):
+    # Same statements as OrderViewSet.create's write phase
+    product = Product.all_objects.get(id=product_id)
+    if product.stock < quantity:
+        return 400
+    try:
+        with transaction.atomic():
+            order, = Order.objects.bulk_create([Order(tenant_id=product.tenant_id, customer=user, status='COMPLETED',
+                                                      total_amount=product.price * quantity)])
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity,
+                                                     price=product.price)])
+            if deduct_stock({product_id: quantity}) != 1:
+                raise CheckoutError(product.name)
+    except CheckoutError:
+        return 400
+    return 201
+
+
+def reserved_checkout(i, queued=False):
+    client = Client(HTTP_AUTHORIZATION=f"Bearer {tokens[i % THREADS]}")
+    response = client.post("/api/reservations/", {"product_id": hot.id, "quantity": 1}, content_type="application/json")
+    if response.status_code != 201:
+        return 400 if response.status_code == 409 else response.status_code
+    status = client.post("/api/orders/", {"items": [{"product_id": hot.id, "quantity": 1}], "holds": [response.json()["id"]]},
+                         content_type="application/json", HTTP_PREFER="respond-async" if queued else "").status_code
+    # Accepted with the unit held for it
+    return 201 if status == 202 else status
+
+
+def run(label, buy, engine=None):
+    Order.objects.all().delete()
+    Checkout.objects.all().delete()
+    Product.all_objects.filter(id=hot.id).update(stock=STOCK)
+    if engine:
+        engine.client.flushall()
+        engine.enroll(hot.id)
+        reservations.reconcile(engine)
+
+    def task(i):
+        try:
+            return buy(i)
+        except Exception:
+            return 500
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        statuses = list(pool.map(task, range(ORDERS)))
+    elapsed = time.perf_counter() - start
+    drained = ""
+    if Checkout.objects.exists():
+        start = time.perf_counter()
+        while checkout.process_batch(settings.CHECKOUT_BATCH_SIZE):
+            pass
+        drained = f"  worker drained in {time.perf_counter() - start:.1f}s"
+    if engine:
+        # What the sync thread would do next: apply the sold units to the column
+        reservations.sync(engine)
+
+    stock = Product.all_objects.get(id=hot.id).stock
+    sold = sum(OrderItem.objects.filter(product=hot).values_list('quantity', flat=True))
+    print(f"{label}: {ORDERS / elapsed:7,.0f} checkouts/s  accepted={statuses.count(201)}  "
+          f"errors={statuses.count(500)}  sold={sold}  stock_left={stock}  oversold={max(0, sold - STOCK)}{drained}")
+
+
+with temporary_database():
+    tenant = Tenant.objects.create(name="Bench Shop")
+    hot = Product.objects.create(tenant=tenant, name="Hot", price="5.00", stock=STOCK)
+    users = [StoreUser.objects.create(username=f"buyer{i}", email=f"buyer{i}@example.com", password="!")
+             for i in range(THREADS)]
+    tokens = [create_token(u) for u in users]
+    body = json.dumps({"items": [{"product_id": hot.id, "quantity": 1}]})
+
+    print(f"--- {ORDERS} checkouts of 1 unit, {THREADS} threads, stock {STOCK} ---")
+    run("legacy write phase ", lambda i: legacy_checkout(users[i % THREADS], hot.id, 1))
+    run("current write phase", lambda i: current_checkout(users[i % THREADS], hot.id, 1))
+    run("POST /api/orders/  ", lambda i: Client().post("/api/orders/", body, content_type="application/json",
+                                            HTTP_AUTHORIZATION=f"Bearer {tokens[i % THREADS]}").status_code)
+    with override_settings(RESERVATION_BACKEND="local", RESERVATION_SYNC_INTERVAL=0):
+        run("reserved, hold+POST", reserved_checkout, reservations.get_engine())
+        run("reserved, queued   ", lambda i: reserved_checkout(i, queued=True), reservations.get_engine())
@@ -0,0 +1,402 @@
+"""
+Mixed-scenario load test for the API. Many concurrent async clients browse,
+search, log in, refresh, check out and list owner orders, either through the
+ASGI app in-process (against a throwaway database) or against a running
+server. Reports requests/sec, p50/p95/p99 latency and, in-process, DB
+queries per request for every endpoint, and writes them to a JSON file.
+
+    python benchmarks/loadtest.py run [--scenario mixed] [--requests 5000] [--concurrency 100]
+                                      [--url http://localhost:8000] [--seed 1] [--out results.json]
+    python benchmarks/loadtest.py compare before.json after.json [--threshold 10]
+
+`compare` exits 1 when an endpoint's p95 or requests/sec got worse by more
+than --threshold percent. Scenarios: mixed, browse, search, login, refresh,
+checkout, owner_orders.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+import contextvars
+from urllib.parse import urlsplit
+
+from utils import BASE_DIR, setup_django, temporary_database
+from asgi_client import call, percentile
+
+PASSWORD = "bench-password"
+
+# name -> {endpoint: weight}; endpoints are the keys of REQUESTS below
+SCENARIOS = {
+    'mixed': {'browse': 35, 'detail': 15, 'search': 15, 'owner_orders': 10,
+              'checkout': 10, 'refresh': 10, 'login': 5},
+    'browse': {'browse': 70, 'detail': 30},
+    'search': {'search': 100},
+    'login': {'login': 100},
+    'refresh': {'refresh': 100},
+    'checkout': {'checkout': 100},
+    'owner_orders': {'owner_orders': 100},
+}
+SEARCH_TERMS = ['mug', 'coffee', 'lamp', 'desk', 'green tea', 'oak', 'kettle']
+WORDS = ['Coffee', 'Mug', 'Lamp', 'Desk', 'Kettle', 'Green', 'Tea', 'Oak', 'Chair', 'Bowl']
+
+
+# --- Transports ---------------------------------------------------------------
+
+class InProcess:
+    def __init__(self, app):
+        self.app = app
+
+    async def send(self, method, path, headers, body):
+        return await call(self.app, method, path, headers, body)
+
+
+class Remote:
+    """Minimal HTTP/1.1 client over asyncio streams, one connection per request."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.host_header = parts.netloc
+
+    async def send(self, method, path, headers, body):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host_header}', 'Connection: close',
+                 f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+        raw = await reader.read()
+        writer.close()
+        head, _, payload = raw.partition(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        response_headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get('transfer-encoding') == 'chunked':
+            payload = dechunk(payload)
+        return int(status_line.split()[1]), response_headers, payload
+
+
+def dechunk(data):
+    body = b''
+    while data:
+        size_line, _, data = data.partition(b'\r\n')
+        size = int(size_line.split(b';')[0], 16)
+        if size == 0:
+            break
+        body, data = body + data[:size], data[size + 2:]
+    return body
+
+
+# --- Query counting (in-process only) ----------------------------------------
+
+current_endpoint = contextvars.ContextVar('current_endpoint', default=None)
+query_counts = {}
+_query_lock = threading.Lock()
+
+
+def count_queries(execute, sql, params, many, context):
+    # The context var follows each request into the threads sync_to_async uses
+    endpoint = current_endpoint.get()
+    if endpoint is not None:
+        with _query_lock:
+            query_counts[endpoint] = query_counts.get(endpoint, 0) + 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter():
+    from django.db.backends.signals import connection_created
+
+    def attach(sender, connection, **kwargs):
+        if count_queries not in connection.execute_wrappers:
+            connection.execute_wrappers.append(count_queries)
+    connection_created.connect(attach, weak=False)
+
+
+# --- Fixture data through the API --------------------------------------------
+
+class Client:
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def request(self, method, path, data=None, token=None, expect=None):
+        headers = {'content-type': 'application/json'} if data is not None else {}
+        if token:
+            headers['authorization'] = f'Bearer {token}'
+        body = json.dumps(data).encode() if data is not None else b''
+        status, _, payload = await self.transport.send(method, '/api' + path, headers, body)
+        if expect and status != expect:
+            raise RuntimeError(f'{method} {path}: {status} {payload[:200]!r}')
+        return status, json.loads(payload) if payload.startswith((b'{', b'[')) else None
+
+
+async def setup_fixtures(client, products, customers, sessions, rng):
+    run_id = f'{int(time.time())}{rng.randrange(10**6)}'
+    owner = f'bench_owner_{run_id}'
+    await client.request('POST', '/auth/register/', {
+        'username': owner, 'password': PASSWORD, 'email': f'{owner}@example.com', 'role': 'OWNER',
+    }, expect=201)
+    _, login = await client.request('POST', '/auth/login/', {'username': owner, 'password': PASSWORD}, expect=200)
+    _, tenant = await client.request('POST', '/tenants/', {'name': f'Bench Shop {run_id}'}, token=login['access'], expect=201)
+    owner_token = tenant['access']
+
+    product_ids = []
+    for i in range(products):
+        name = f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i}'
+        _, product = await client.request('POST', '/products/', {
+            'name': name, 'description': f'{name} ' * rng.randint(5, 40),
+            'price': f'{rng.randint(1, 300)}.{rng.randint(0, 99):02d}',
+            'stock': 10 ** 6, 'category': rng.choice(['kitchen', 'office', 'garden', 'food']),
+        }, token=owner_token, expect=201)
+        product_ids.append(product['id'])
+
+    usernames = [f'bench_customer_{run_id}_{i}' for i in range(customers)]
+    for username in usernames:
+        await client.request('POST', '/auth/register/', {
+            'username': username, 'password': PASSWORD, 'email': f'{username}@example.com',
+        }, expect=201)
+    logins = await asyncio.gather(*(
+        client.request('POST', '/auth/login/', {'username': usernames[i % customers], 'password': PASSWORD}, expect=200)
+        for i in range(sessions)
+    ))
+    refresh_tokens = asyncio.Queue()
+    for _, data in logins:
+        refresh_tokens.put_nowait(data['refresh'])
+    return {
+        'tenant_id': tenant['id'],
+        'owner_token': owner_token,
+        'product_ids': product_ids,
+        'usernames': usernames,
+        'access_tokens': [data['access'] for _, data in logins],
+        'refresh_tokens': refresh_tokens,
+    }
+
+
+# --- Requests -----------------------------------------------------------------
+
+def browse(rng, data):
+    query = rng.choice(['', '?fields=card', f'?tenant={data["tenant_id"]}', f'?tenant={data["tenant_id"]}&fields=card'])
+    return 'GET /products/', 'GET', '/products/' + query, None, None
+
+
+def detail(rng, data):
+    return 'GET /products/{id}/', 'GET', f'/products/{rng.choice(data["product_ids"])}/', None, None
+
+
+def search(rng, data):
+    return ('GET /products/search/', 'GET',
+            f'/products/search/?q={rng.choice(SEARCH_TERMS).replace(" ", "+")}&scope=marketplace', None, None)
+
+
+def owner_orders(rng, data):
+    return 'GET /orders/', 'GET', '/orders/?fields=card', None, data['owner_token']
+
+
+def checkout(rng, data):
+    items = [{'product_id': product_id, 'quantity': rng.randint(1, 3)}
+             for product_id in rng.sample(data['product_ids'], rng.randint(1, 3))]
+    return 'POST /orders/', 'POST', '/orders/', {'items': items}, rng.choice(data['access_tokens'])
+
+
+def login(rng, data):
+    return ('POST /auth/login/', 'POST', '/auth/login/',
+            {'username': rng.choice(data['usernames']), 'password': PASSWORD}, None)
+
+
+REQUESTS = {
+    'browse': browse, 'detail': detail, 'search': search, 'owner_orders': owner_orders,
+    'checkout': checkout, 'login': login, 'refresh': None,
+}
+
+
+async def run_load(client, data, scenario, total, concurrency, seed):
+    names, weights = zip(*SCENARIOS[scenario].items())
+    samples = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            rng = random.Random(seed * 1_000_003 + i)  # same request sequence on every run
+            kind = rng.choices(names, weights)[0]
+            if kind == 'refresh':
+                # Refresh tokens are single use, so each is checked out of a shared pool
+                token = await data['refresh_tokens'].get()
+                endpoint, method, path, body, bearer = 'POST /auth/refresh/', 'POST', '/auth/refresh/', {'refresh': token}, None
+            else:
+                endpoint, method, path, body, bearer = REQUESTS[kind](rng, data)
+
+            context_token = current_endpoint.set(endpoint)
+            start = time.perf_counter()
+            try:
+                status, payload = await client.request(method, path, body, token=bearer)
+            finally:
+                current_endpoint.reset(context_token)
+            elapsed = time.perf_counter() - start
+            if kind == 'refresh':
+                data['refresh_tokens'].put_nowait(payload['refresh'] if status == 200 else token)
+            samples.setdefault(endpoint, []).append((elapsed, status))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed, count_db):
+    endpoints = {}
+    for endpoint, rows in sorted(samples.items()):
+        latencies = [latency for latency, _ in rows]
+        statuses = {}
+        for _, status in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints[endpoint] = {
+            'count': len(rows),
+            'rps': round(len(rows) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'errors': sum(n for status, n in statuses.items() if int(status) >= 400),
+            'statuses': statuses,
+            'queries_per_request': round(query_counts.get(endpoint, 0) / len(rows), 2) if count_db else None,
+        }
+    total = sum(e['count'] for e in endpoints.values())
+    return {
+        'requests': total,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(total / elapsed, 1),
+        'errors': sum(e['errors'] for e in endpoints.values()),
+    }, endpoints
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(transport, args, count_db):
+    client = Client(transport)
+    rng = random.Random(args.seed)
+    data = await setup_fixtures(client, args.products, args.customers, args.sessions, rng)
+    query_counts.clear()
+    samples, elapsed = await run_load(client, data, args.scenario, args.requests, args.concurrency, args.seed)
+    return summarize(samples, elapsed, count_db)
+
+
+def run(args):
+    setup_django()
+    import django
+    from django.conf import settings
+
+    if args.url:
+        mode = args.url
+        total, endpoints = asyncio.run(benchmark(Remote(args.url), args, count_db=False))
+    else:
+        import logging
+        from django.core.asgi import get_asgi_application
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        mode = 'in-process'
+        install_query_counter()
+        with temporary_database():
+            total, endpoints = asyncio.run(benchmark(InProcess(get_asgi_application()), args, count_db=True))
+
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'mode': mode,
+            'scenario': args.scenario,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'settings': {name: getattr(settings, name, None) for name in (
+                'ASYNC_CATALOG_VIEWS', 'RESPONSE_CACHE_ENABLED', 'FAST_LIST_SERIALIZATION',
+                'AUTH_CLAIMS_ONLY', 'HASH_WORKERS',
+            )},
+        },
+        'total': total,
+        'endpoints': endpoints,
+    }
+    print_result(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'\nWrote {args.out}')
+
+
+def print_result(result):
+    meta, total = result['meta'], result['total']
+    print(f"--- {meta['scenario']}: {meta['requests']} requests, {meta['concurrency']} clients, "
+          f"{meta['mode']} @ {meta['commit']} ---")
+    print(f"{'endpoint':<24}{'count':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'q/req':>7}")
+    for endpoint, e in result['endpoints'].items():
+        queries = '-' if e['queries_per_request'] is None else f"{e['queries_per_request']:.1f}"
+        print(f"{endpoint:<24}{e['count']:>7}{e['rps']:>9.1f}{e['p50_ms']:>9.1f}{e['p95_ms']:>9.1f}"
+              f"{e['p99_ms']:>9.1f}{e['errors']:>8}{queries:>7}")
+    print(f"{'total':<24}{total['requests']:>7}{total['rps']:>9.1f}{'':>27}{total['errors']:>8}")
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"--- {before['meta']['commit']} -> {after['meta']['commit']} (threshold {args.threshold}%) ---")
+    print(f"{'endpoint':<24}{'req/s':>22}{'p95 ms':>24}{'q/req':>14}")
+    regressions = []
+    for endpoint in sorted(set(before['endpoints']) | set(after['endpoints'])):
+        old, new = before['endpoints'].get(endpoint), after['endpoints'].get(endpoint)
+        if not old or not new:
+            print(f"{endpoint:<24} only in {'after' if new else 'before'}")
+            continue
+        rps_change = (new['rps'] - old['rps']) / old['rps'] * 100 if old['rps'] else 0.0
+        p95_change = (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0.0
+        flag = ''
+        if rps_change < -args.threshold or p95_change > args.threshold:
+            regressions.append(endpoint)
+            flag = '  REGRESSION'
+        queries = f"{old['queries_per_request']}->{new['queries_per_request']}" if new['queries_per_request'] is not None else '-'
+        print(f"{endpoint:<24}{old['rps']:>8.1f}->{new['rps']:<8.1f}{rps_change:+5.0f}%"
+              f"{old['p95_ms']:>9.1f}->{new['p95_ms']:<8.1f}{p95_change:+5.0f}%{queries:>14}{flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    run_parser.add_argument('--requests', type=int, default=5000)
+    run_parser.add_argument('--concurrency', type=int, default=100)
+    run_parser.add_argument('--products', type=int, default=200)
+    run_parser.add_argument('--customers', type=int, default=20)
+    run_parser.add_argument('--sessions', type=int, default=10, help='logins whose refresh tokens are cycled')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--url', help='run against this server instead of in-process')
+    run_parser.add_argument('--out', help='write results to this JSON file')
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10.0)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Logins/sec vs refreshes/sec on one core: POST /api/auth/login/ (PBKDF2
+check_password) against POST /api/auth/refresh/ (sha256 lookup + rotation).
+
+    python benchmarks/login_vs_refresh.py [logins] [refreshes]
+"""
+import sys
+import time
+
+from utils import setup_django, temporary_database
+
+setup_django()
+
+from django.test import Client
+
+from store.authentication import hash_pass
+from store.models import StoreUser
+
+LOGINS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+REFRESHES = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+with temporary_database():
+    StoreUser.objects.create(username="bench", email="bench@example.com", password=hash_pass("secret"))
+    client = Client()
+
+    start = time.perf_counter()
+    for _ in range(LOGINS):
+        response = client.post('/api/auth/login/', {'username': 'bench', 'password': 'secret'})
+        assert response.status_code == 200, response.content
+    login_rate = LOGINS / (time.perf_counter() - start)
+
+    refresh = response.json()['refresh']
+    start = time.perf_counter()
+    for _ in range(REFRESHES):
+        response = client.post('/api/auth/refresh/', {'refresh': refresh}, content_type='application/json')
+        assert response.status_code == 200, response.content
+        refresh = response.json()['refresh']
+    refresh_rate = REFRESHES / (time.perf_counter() - start)
+
+    print("--- Token issuance, single process ---")
+    print(f"login  : {login_rate:10,.1f} req/s")
+    print(f"refresh: {refresh_rate:10,.1f} req/s  ({refresh_rate / login_rate:,.0f}x)")
@@ -0,0 +1,80 @@
+"""
+Time to first byte, throughput and peak Python memory of GET
+/api/orders/export/ (store.exports) for one big store, against
+serializing the same orders the way the order list does (OrderSerializer
+over every order with prefetched items).
+
+    python benchmarks/order_export.py [orders]      (default 100000)
+"""
+import io
+import sys
+import time
+import tracemalloc
+
+from utils import setup_django, temporary_database
+
+setup_django()
+
+from django.core.management import call_command
+from django.test import Client
+from rest_framework.renderers import JSONRenderer
+
+from store.authentication import create_token
+from store.models import Order, StoreUser
+from store.serializers import OrderSerializer
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+
+def timed(body):
+    """(first byte, total seconds, bytes) for an iterable of chunks, and its peak memory in a second run."""
+    start = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in body():
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    # Measured separately, tracemalloc slows everything down
+    tracemalloc.start()
+    for chunk in body():
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first, total, size, peak
+
+
+def export(client, auth, **params):
+    return lambda: client.get('/api/orders/export/', params, HTTP_AUTHORIZATION=auth).streaming_content
+
+
+def serialize_all(tenant_id):
+    def body():
+        orders = Order.all_objects.filter(tenant_id=tenant_id).order_by('created_at', 'id').prefetch_related('items')
+        yield JSONRenderer().render(OrderSerializer(orders, many=True).data)
+    return body
+
+
+with temporary_database():
+    # One store holding nearly every order
+    call_command('seed_store', tenants=2, products=2000, customers=1000, orders=ORDERS,
+                 tenant_skew=6, seed=1, stdout=io.StringIO())
+    owner = StoreUser.objects.get(username='seed_owner_0')
+    count = Order.all_objects.filter(tenant_id=owner.tenant_id).count()
+    auth = f'Bearer {create_token(owner)}'
+    client = Client()
+    for chunk in export(client, auth, to='2000-01-01')():
+        pass  # warm up
+
+    print(f"--- Export of {count:,} orders ---")
+    print(f"{'':16}{'first byte':>12}{'total':>10}{'orders/s':>12}{'MB out':>9}{'peak MB':>9}")
+    results = {
+        'list serializer': timed(serialize_all(owner.tenant_id)),
+        'csv': timed(export(client, auth, type='csv')),
+        'ndjson': timed(export(client, auth, type='ndjson')),
+        'csv + gzip': timed(export(client, auth, type='csv', gzip='true')),
+    }
+    for name, (first, total, size, peak) in results.items():
+        print(f"{name:16}{first * 1000:10.0f}ms{total:9.1f}s{count / total:12,.0f}"
+              f"{size / 1e6:9.1f}{peak / 1e6:9.1f}")
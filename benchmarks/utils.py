@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+import contextlib
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+    django.setup()
+
+
+@contextlib.contextmanager
+def temporary_database():
+    # Benchmarks run against a throwaway test database, never the real one
+    from django.db import connection
+    old_name = connection.settings_dict['NAME']
+    if connection.vendor == 'sqlite':
+        # File backed, so it survives connections being closed between requests
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
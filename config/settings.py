@@ -58,6 +58,8 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "store.middleware.CustomAuthMiddleware",
     "store.middleware.TenantMiddleware",
+    "store.middleware.ReplicaMiddleware",
+    "store.middleware.CatalogCacheMiddleware",
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -99,11 +101,122 @@ DATABASES = {
 if os.getenv('DATABASE_URI'):
     DATABASES['default'] = dj_database_url.parse(os.getenv('DATABASE_URI'))
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # File backed test database: threaded tests then get normal SQLite locking
+    # (waits up to the busy timeout) instead of shared-cache "table is locked" errors
+    DATABASES['default']['TEST'] = {'NAME': str(BASE_DIR / "test_db.sqlite3")}
+
+# Read replicas (store.replicas): every DATABASE_URI_REPLICA_<NAME> adds a
+# database 'replica_<name>'. GET/HEAD on the catalog and order history read
+# from them; a client that wrote is pinned to the primary for
+# REPLICA_PIN_SECONDS (at least REPLICA_MAX_LAG). Lag is checked every
+# REPLICA_CHECK_INTERVAL seconds and a replica more than REPLICA_MAX_LAG
+# seconds behind is skipped until it catches up.
+DATABASE_REPLICAS = []
+for name, uri in sorted(os.environ.items()):
+    if name.startswith('DATABASE_URI_REPLICA_') and uri:
+        alias = 'replica_' + name[len('DATABASE_URI_REPLICA_'):].lower()
+        DATABASES[alias] = dj_database_url.parse(uri)
+        # Tests only create the primary; replica queries go to it
+        DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+        DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['store.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "2"))
+
 # Fail fast in production if using SQLite
 if not DEBUG and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
     raise ValueError("CRITICAL: Running in production (DEBUG=False) with SQLite. DATABASE_URI or DATABASE_URL is missing!")
 
 
+# Cache: local memory per process, Redis when REDIS_URL is set so every worker
+# shares the catalog response cache and its generation counters
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "10000"))},
+        }
+    }
+
+# Catalog response cache with ETags (store.response_cache)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "True") == "True"
+RESPONSE_CACHE_ALIAS = os.getenv("RESPONSE_CACHE_ALIAS", "default")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+# Keyset pagination for product and order listings (store.pagination)
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "50"))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "200"))
+# /api/products/search/ is ranked, so it pages by offset; cap how deep it goes
+SEARCH_MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", "20"))
+# Longest date range /api/analytics/ answers in one request (store.analytics)
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", "731"))
+# Orders per server-side cursor fetch and per streamed chunk of /api/orders/export/
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+# Rows per upsert of /api/products/import/, and how many row errors it reports
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Serve GET /api/products/ and /api/products/<id>/ from async views (store.async_views)
+ASYNC_CATALOG_VIEWS = os.getenv("ASYNC_CATALOG_VIEWS", "True") == "True"
+
+# List endpoints serialize values() rows directly (store.fast_serializers), and
+# render with orjson when it's installed. Output is identical either way.
+FAST_LIST_SERIALIZATION = os.getenv("FAST_LIST_SERIALIZATION", "True") == "True"
+FAST_JSON_ENCODER = os.getenv("FAST_JSON_ENCODER", "True") == "True"
+
+
+# Checkout (store.checkout). CHECKOUT_QUEUE queues every POST /api/orders/
+# for `manage.py process_checkouts` (202), not just `Prefer: respond-async`
+# ones. The worker places CHECKOUT_BATCH_SIZE carts per commit and gives up
+# on a cart after CHECKOUT_MAX_ATTEMPTS unexpected errors. Finished
+# checkouts, idempotency keys included, are kept CHECKOUT_RETENTION_HOURS.
+CHECKOUT_QUEUE = os.getenv("CHECKOUT_QUEUE", "False") == "True"
+CHECKOUT_BATCH_SIZE = int(os.getenv("CHECKOUT_BATCH_SIZE", "50"))
+CHECKOUT_MAX_ATTEMPTS = int(os.getenv("CHECKOUT_MAX_ATTEMPTS", "3"))
+CHECKOUT_RETENTION_HOURS = int(os.getenv("CHECKOUT_RETENTION_HOURS", "72"))
+CHECKOUT_RETRY_AFTER = int(os.getenv("CHECKOUT_RETRY_AFTER", "1"))  # seconds, poll hint
+
+# Flash-sale stock reservations (store.reservations). RESERVATION_BACKEND:
+# empty is off, 'redis' keeps the counters at RESERVATION_REDIS_URL, 'local'
+# in this process (single process only, it syncs itself every
+# RESERVATION_SYNC_INTERVAL seconds; run `manage.py sync_reservations` with
+# redis). Holds last RESERVATION_TTL seconds; a checkout's claim on them is
+# presumed dead after RESERVATION_CLAIM_TIMEOUT.
+RESERVATION_BACKEND = os.getenv("RESERVATION_BACKEND", "")
+RESERVATION_REDIS_URL = os.getenv("RESERVATION_REDIS_URL", REDIS_URL)
+RESERVATION_PREFIX = os.getenv("RESERVATION_PREFIX", "reservations")
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", "600"))
+RESERVATION_CLAIM_TIMEOUT = int(os.getenv("RESERVATION_CLAIM_TIMEOUT", "120"))
+RESERVATION_SYNC_INTERVAL = float(os.getenv("RESERVATION_SYNC_INTERVAL", "2"))
+
+
+# Password hashing (store.hashing). PBKDF2 runs in a process pool of
+# HASH_WORKERS (0 = inline); past HASH_MAX_PENDING queued hashes, login and
+# register answer 429 with Retry-After: HASH_RETRY_AFTER seconds.
+# PASSWORD_ITERATIONS unset keeps Django's default; changing it re-hashes
+# each user's password on their next login.
+PASSWORD_HASHERS = [
+    "store.hashing.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+PASSWORD_ITERATIONS = int(os.getenv("PASSWORD_ITERATIONS", "0")) or None
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "32"))
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", "1"))
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -158,8 +271,44 @@ STORAGES = {
 
 MEDIA_URL = f"https://storage.googleapis.com/{GS_BUCKET_NAME}/"
 
+# Resized copies of product images and tenant logos (store.images), made by
+# IMAGE_WORKERS background threads after upload (0 = in the request), in each
+# of IMAGE_FORMATS that the installed Pillow can write
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_FORMATS = [name.strip() for name in os.getenv("IMAGE_FORMATS", "webp,avif").split(",") if name.strip()]
+
+# Direct-to-storage image uploads (store.uploads). UPLOAD_SIGNER issues the
+# signed PUT targets: GCSUploadSigner for the bucket above, LocalUploadSigner
+# for a local FileSystemStorage. Targets last UPLOAD_URL_TTL seconds, the
+# upload can be finalized for UPLOAD_FINALIZE_TTL.
+UPLOAD_SIGNER = os.getenv("UPLOAD_SIGNER", "store.uploads.GCSUploadSigner")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_URL_TTL = int(os.getenv("UPLOAD_URL_TTL", "300"))
+UPLOAD_FINALIZE_TTL = int(os.getenv("UPLOAD_FINALIZE_TTL", "3600"))
+
 # Custom Auth - Manual Implementation
 
+# Rotating refresh tokens for /api/auth/refresh/ (store.authentication)
+REFRESH_TOKEN_LIFETIME_DAYS = int(os.getenv("REFRESH_TOKEN_LIFETIME_DAYS", "14"))
+# Expired and revoked refresh tokens are deleted by a refresh at most this often (seconds, per process)
+REFRESH_TOKEN_PURGE_INTERVAL = int(os.getenv("REFRESH_TOKEN_PURGE_INTERVAL", "3600"))
+
+# In-process cache of resolved users for CustomAuthMiddleware (0 disables it)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))  # seconds
+
+# Build request.custom_user straight from the verified JWT claims instead of
+# loading the StoreUser row. Changing a user's username, role or tenant (or
+# deleting it) revokes its issued tokens; other processes notice within
+# AUTH_TOKEN_VERSION_TTL seconds, the one that made the change at once.
+AUTH_CLAIMS_ONLY = os.getenv("AUTH_CLAIMS_ONLY", "False") == "True"
+AUTH_TOKEN_VERSION_TTL = int(os.getenv("AUTH_TOKEN_VERSION_TTL", "30"))  # seconds
+
+# In-process tenant lookup for X-Tenant-ID / ?tenant= (see store.tenant_registry)
+TENANT_REGISTRY_TTL = int(os.getenv("TENANT_REGISTRY_TTL", "300"))  # full reload, seconds
+# Unknown ids trigger at most one early reload per interval, never a query per id
+TENANT_REGISTRY_RELOAD_INTERVAL = int(os.getenv("TENANT_REGISTRY_RELOAD_INTERVAL", "30"))  # seconds
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
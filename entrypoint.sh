@@ -1,8 +1,8 @@
 #!/bin/bash
 set -e
 
+# Migrations are committed in store/migrations, never generated here
 echo "Applying database migrations..."
-python manage.py makemigrations
 python manage.py migrate
 
 echo "Collecting static files..."
@@ -14,7 +14,7 @@ export default function MarketplacePage() {
         async function fetchProducts() {
             try {
                 const res = await api.get('/products/');
-                setProducts(res.data);
+                setProducts(res.data.results);
             } catch (error) {
                 console.error("Failed to fetch products", error);
                 setProducts([]);
@@ -31,7 +31,7 @@ export default function OrdersPage() {
         const fetchOrders = async () => {
             try {
                 const res = await api.get('/orders/');
-                setOrders(res.data);
+                setOrders(res.data.results);
             } catch (error) {
                 console.error("Failed to fetch orders", error);
             } finally {
@@ -15,7 +15,7 @@ export default function Home() {
     async function fetchProducts() {
       try {
         const res = await api.get('/products/');
-        setProducts(res.data);
+        setProducts(res.data.results);
       } catch (error) {
         console.error("Failed to fetch products", error);
         // Fallback for demo if API fails or is empty
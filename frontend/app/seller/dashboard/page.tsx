@@ -22,7 +22,7 @@ export default function SellerDashboard() {
         api.get('/products/', {
             headers: { Authorization: `Bearer ${token}` }
         })
-            .then(res => setProducts(res.data))
+            .then(res => setProducts(res.data.results))
             .catch(err => console.error(err));
 
     }, [router]);
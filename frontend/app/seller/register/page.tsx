@@ -40,12 +40,17 @@ export default function RegisterSellerPage() {
 
             // 3. Create Tenant (Store) using the token
             // We manually set the header here for this specific request since the global interceptor might not read it yet
-            await api.post('/tenants/', {
+            const tenantRes = await api.post('/tenants/', {
                 name: formData.storeName,
             }, {
                 headers: { Authorization: `Bearer ${token}` }
             });
 
+            // The login token predates the store, use the re-issued one
+            if (tenantRes.data.access) {
+                localStorage.setItem('access_token', tenantRes.data.access);
+            }
+
             router.push('/seller/dashboard');
 
         } catch (error: any) {
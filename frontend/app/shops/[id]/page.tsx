@@ -23,7 +23,7 @@ export default function ShopDetailsPage({ params }: { params: Promise<{ id: stri
 
                 // Fetch Shop Products
                 const prodRes = await api.get(`/products/?tenant=${shopId}`);
-                setProducts(prodRes.data);
+                setProducts(prodRes.data.results);
             } catch (error) {
                 console.error("Failed to fetch shop data", error);
             } finally {
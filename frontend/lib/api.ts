@@ -25,19 +25,22 @@ api.interceptors.response.use(
     async (error) => {
         const originalRequest = error.config;
 
-        if (error.response?.status === 401 && !originalRequest._retry) {
+        // An expired access token is rejected with 401 or 403 depending on the view
+        if ([401, 403].includes(error.response?.status) && !originalRequest._retry) {
             originalRequest._retry = true;
 
             const refreshToken = localStorage.getItem('refresh_token');
             if (refreshToken) {
                 try {
-                    const res = await axios.post('http://127.0.0.1:8000/api/auth/refresh/', {
+                    const res = await axios.post(`${api.defaults.baseURL}/auth/refresh/`, {
                         refresh: refreshToken
                     });
 
                     const newAccessToken = res.data.access;
 
                     localStorage.setItem('access_token', newAccessToken);
+                    // Refresh tokens are single use, the response carries the next one
+                    localStorage.setItem('refresh_token', res.data.refresh);
 
                     originalRequest.headers['Authorization'] = `Bearer ${newAccessToken}`;
 
@@ -0,0 +1,236 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Sum, Count, Min, Max, DecimalField
+from django.db.models.functions import TruncDate, TruncWeek, TruncMonth
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Product, Order, OrderItem, DailySales, ProductDailySales
+
+# Sales rollups: DailySales (tenant x day) and ProductDailySales (tenant x day
+# x product). record() applies an order's contribution in the transaction that
+# places it or changes its status, as UPDATE ... SET col = col + CASE ... so
+# concurrent checkouts add up instead of overwriting each other. Days are in
+# settings.TIME_ZONE. rebuild() recomputes a date range from Order/OrderItem,
+# e.g. after bulk loads that bypass record().
+
+EXCLUDED_STATUSES = ('CANCELLED',)
+INTERVALS = {'day': None, 'week': TruncWeek, 'month': TruncMonth}
+CENTS = Decimal('0.01')
+
+
+def counted(status):
+    return status not in EXCLUDED_STATUSES
+
+
+def sales_day(created_at):
+    return timezone.localdate(created_at)
+
+
+def money(value):
+    return str((value or Decimal(0)).quantize(CENTS))
+
+
+def record(orders, items, sign=1):
+    """
+    Add (sign=1) or take back (sign=-1) `orders` in the rollups. `items` are
+    (order_id, product_id, quantity, price) for those orders. Orders with an
+    excluded status are skipped.
+    """
+    orders = {order.id: order for order in orders if counted(order.status)}
+    # [orders, units, revenue] per (day, tenant_id) and (day, tenant_id, product_id)
+    daily = defaultdict(lambda: [0, 0, Decimal(0)])
+    per_product = defaultdict(lambda: [0, 0, Decimal(0)])
+    for order in orders.values():
+        row = daily[(sales_day(order.created_at), order.tenant_id)]
+        row[0] += sign
+        row[2] += sign * order.total_amount
+    seen = set()
+    for order_id, product_id, quantity, price in items:
+        order = orders.get(order_id)
+        if order is None:
+            continue
+        day = sales_day(order.created_at)
+        daily[(day, order.tenant_id)][1] += sign * quantity
+        row = per_product[(day, order.tenant_id, product_id)]
+        if (order_id, product_id) not in seen:
+            seen.add((order_id, product_id))
+            row[0] += sign
+        row[1] += sign * quantity
+        row[2] += sign * price * quantity
+
+    _increment(DailySales, ('day', 'tenant_id'), daily)
+    _increment(ProductDailySales, ('day', 'tenant_id', 'product_id'), per_product)
+
+
+def _increment(model, fields, deltas):
+    """
+    `deltas`: {values of `fields`: [orders, units, revenue]}, `fields` being
+    day, tenant_id[, product_id]. Makes sure the rows exist, then one UPDATE
+    per day adds every delta through a CASE on the last field.
+    """
+    if not deltas:
+        return
+    key = fields[-1]
+    model.all_objects.bulk_create([model(**dict(zip(fields, k))) for k in sorted(deltas)], ignore_conflicts=True)
+    by_day = defaultdict(dict)
+    for k, delta in sorted(deltas.items()):
+        by_day[k[0]][k[-1]] = (k[1], delta)
+
+    for day, changes in by_day.items():
+        def add(column, index):
+            return F(column) + Case(
+                *[When(**{key: value}, then=Value(delta[index])) for value, (_, delta) in changes.items()],
+                default=Value(0), output_field=model._meta.get_field(column).clone(),
+            )
+        lookup = {'day': day, 'tenant_id__in': {tenant_id for tenant_id, _ in changes.values()}, f'{key}__in': list(changes)}
+        model.all_objects.filter(**lookup).update(
+            orders=add('orders', 0), units=add('units', 1), revenue=add('revenue', 2),
+        )
+
+
+def order_items(order_ids):
+    return list(OrderItem.objects.filter(order_id__in=order_ids).values_list('order_id', 'product_id', 'quantity', 'price'))
+
+
+def day_bounds(first, last):
+    # [first 00:00, last + 1 00:00) in the current time zone
+    start = timezone.make_aware(datetime.datetime.combine(first, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time.min))
+    return start, end
+
+
+def history_bounds(tenant_id):
+    orders = Order.all_objects.filter(tenant_id=tenant_id).aggregate(first=Min('created_at'), last=Max('created_at'))
+    rollups = DailySales.all_objects.filter(tenant_id=tenant_id).aggregate(first=Min('day'), last=Max('day'))
+    days = [sales_day(orders[k]) for k in ('first', 'last') if orders[k]] + [rollups[k] for k in ('first', 'last') if rollups[k]]
+    return (min(days), max(days)) if days else (None, None)
+
+
+def rebuild(tenant_id, first=None, last=None, batch_days=31):
+    """
+    Recompute one tenant's rollups for [first, last] (default its whole
+    history), `batch_days` per transaction. Yields (first, last, orders) per
+    batch. Orders placed in a batch's range while it runs may be missed;
+    rebuild quiet ranges or re-run.
+    """
+    history_first, history_last = history_bounds(tenant_id)
+    first, last = first or history_first, last or history_last
+    if first is None or last is None:
+        return
+    revenue = DecimalField(max_digits=14, decimal_places=2)
+    while first <= last:
+        batch_last = min(first + datetime.timedelta(days=batch_days - 1), last)
+        start, end = day_bounds(first, batch_last)
+        orders = Order.all_objects.filter(tenant_id=tenant_id, created_at__gte=start, created_at__lt=end).exclude(
+            status__in=EXCLUDED_STATUSES
+        )
+        items = OrderItem.objects.filter(order__in=orders)
+        with transaction.atomic():
+            DailySales.all_objects.filter(tenant_id=tenant_id, day__range=(first, batch_last)).delete()
+            ProductDailySales.all_objects.filter(tenant_id=tenant_id, day__range=(first, batch_last)).delete()
+            per_product = [
+                ProductDailySales(tenant_id=tenant_id, day=row['day'], product_id=row['product_id'],
+                                  orders=row['orders'], units=row['units'], revenue=row['revenue'].quantize(CENTS))
+                for row in items.annotate(day=TruncDate('order__created_at')).values('day', 'product_id').annotate(
+                    orders=Count('order_id', distinct=True), units=Sum('quantity'),
+                    revenue=Sum(F('price') * F('quantity'), output_field=revenue),
+                )
+            ]
+            units = defaultdict(int)
+            for row in per_product:
+                units[row.day] += row.units
+            daily = [
+                DailySales(tenant_id=tenant_id, day=row['day'], orders=row['orders'], units=units[row['day']],
+                           revenue=row['revenue'].quantize(CENTS))
+                for row in orders.annotate(day=TruncDate('created_at')).values('day').annotate(
+                    orders=Count('id'), revenue=Sum('total_amount'),
+                )
+            ]
+            DailySales.all_objects.bulk_create(daily)
+            ProductDailySales.all_objects.bulk_create(per_product, batch_size=1000)
+        yield first, batch_last, sum(row.orders for row in daily)
+        first = batch_last + datetime.timedelta(days=1)
+
+
+def parse_query(params):
+    """(first, last, interval, top) from ?from=&to=&interval=&top=, ValidationError (400) if invalid."""
+    errors = {}
+    today = timezone.localdate()
+
+    def date(param, default):
+        value = params.get(param)
+        if not value:
+            return default
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            errors[param] = ['Expected a date, YYYY-MM-DD.']
+
+    last = date('to', today)
+    first = date('from', (last or today) - datetime.timedelta(days=29))
+    interval = params.get('interval', 'day')
+    if interval not in INTERVALS:
+        errors['interval'] = [f'Expected one of: {", ".join(INTERVALS)}.']
+    try:
+        top = min(max(int(params.get('top', 10)), 0), 100)
+    except ValueError:
+        errors['top'] = ['Expected an integer.']
+        top = None
+    if not errors:
+        if first > last:
+            errors['from'] = ['Must not be after "to".']
+        elif (last - first).days + 1 > settings.ANALYTICS_MAX_DAYS:
+            errors['from'] = [f'At most {settings.ANALYTICS_MAX_DAYS} days per query.']
+    if errors:
+        raise ValidationError(errors)
+    return first, last, interval, top
+
+
+def summary(orders, units, revenue):
+    return {
+        'orders': orders or 0,
+        'units': units or 0,
+        'revenue': money(revenue),
+        'average_order_value': money(revenue / orders if orders else None),
+    }
+
+
+def report(tenant_id, first, last, interval='day', top=10):
+    """Totals, a per-`interval` series (periods without sales omitted) and the top products by revenue."""
+    daily = DailySales.all_objects.filter(tenant_id=tenant_id, day__range=(first, last))
+    if INTERVALS[interval]:
+        daily = daily.annotate(period=INTERVALS[interval]('day'))
+    else:
+        daily = daily.annotate(period=F('day'))
+    series = daily.values('period').annotate(
+        sum_orders=Sum('orders'), sum_units=Sum('units'), sum_revenue=Sum('revenue'),
+    ).filter(sum_orders__gt=0).order_by('period')
+    totals = daily.aggregate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+    # Grouped on the rollup alone, names only for the top rows
+    products = list(ProductDailySales.all_objects.filter(tenant_id=tenant_id, day__range=(first, last)).values(
+        'product_id',
+    ).annotate(
+        sum_orders=Sum('orders'), sum_units=Sum('units'), sum_revenue=Sum('revenue'),
+    ).filter(sum_orders__gt=0).order_by('-sum_revenue', 'product_id')[:top])
+    names = dict(Product.all_objects.filter(id__in=[row['product_id'] for row in products]).values_list('id', 'name'))
+
+    return {
+        'from': first,
+        'to': last,
+        'interval': interval,
+        'totals': summary(totals['orders'], totals['units'], totals['revenue']),
+        'series': [
+            {'period': row['period'], **summary(row['sum_orders'], row['sum_units'], row['sum_revenue'])}
+            for row in series
+        ],
+        'top_products': [
+            {'product_id': row['product_id'], 'name': names.get(row['product_id']), 'orders': row['sum_orders'],
+             'units': row['sum_units'], 'revenue': money(row['sum_revenue'])}
+            for row in products
+        ],
+    }
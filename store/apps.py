@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class StoreConfig(AppConfig):
     name = "store"
+    # Django 6's default; pinned so migrations don't depend on the Django version
+    default_auto_field = "django.db.models.BigAutoField"
+
+    def ready(self):
+        from . import signals  # noqa: F401
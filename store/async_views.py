@@ -0,0 +1,84 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import NotFound, ValidationError as DRFValidationError
+
+from .fast_serializers import get_plan, json_response
+from .fieldsets import parse_fields, projection
+from .models import Product
+from .pagination import KeysetPagination
+from .serializers import ProductSerializer
+
+# Async-native read path for the public catalog (ProductViewSet list/retrieve).
+# Writes and the browsable API still go through the DRF viewset.
+
+def wants_browsable_api(request):
+    return request.GET.get('format') == 'api' or 'text/html' in request.headers.get('Accept', '')
+
+
+def serialize_products(products, request, fields=None):
+    return ProductSerializer(products, many=True, context={'request': request}, fields=fields).data
+
+
+def validation_error(exc):
+    return json_response({key: [str(error) for error in errors] for key, errors in exc.detail.items()}, status=400)
+
+
+async def product_list(request):
+    paginator = KeysetPagination()
+    try:
+        fields = parse_fields(request.GET, ProductSerializer)
+    except DRFValidationError as exc:
+        return validation_error(exc)
+    plan = get_plan(ProductSerializer) if settings.FAST_LIST_SERIALIZATION else None
+
+    # Product.objects applies the TenantManager filter from the tenant context
+    if plan:
+        plan = plan.select(fields)
+        queryset = Product.objects.values(*plan.columns, *[c for c in paginator.ordering if c not in plan.columns])
+    elif fields:
+        queryset = Product.objects.only(*projection(ProductSerializer, fields, paginator.ordering))
+    else:
+        queryset = Product.objects.all()
+    try:
+        products = await paginator.apaginate_queryset(queryset, request)
+    except NotFound as exc:
+        return json_response({'detail': str(exc.detail)}, status=404)
+    # Serializing can be CPU heavy (and may sign image URLs), keep it off the loop
+    if plan:
+        data = await sync_to_async(plan.to_representation, thread_sensitive=False)(products, request)
+    else:
+        data = await sync_to_async(serialize_products, thread_sensitive=False)(products, request, fields)
+    return json_response(paginator.get_paginated_data(data))
+
+
+async def product_detail(request, pk):
+    try:
+        fields = parse_fields(request.GET, ProductSerializer)
+    except DRFValidationError as exc:
+        return validation_error(exc)
+    queryset = Product.objects.only(*projection(ProductSerializer, fields)) if fields else Product.objects
+    try:
+        product = await queryset.aget(pk=pk)
+    except (Product.DoesNotExist, TypeError, ValueError, ValidationError):
+        return json_response({'detail': 'No Product matches the given query.'}, status=404)
+    data = await sync_to_async(serialize_products, thread_sensitive=False)([product], request, fields)
+    return json_response(data[0])
+
+
+def catalog_view(async_view, sync_view):
+    """
+    Route GET/HEAD to `async_view` when ASYNC_CATALOG_VIEWS is on and
+    everything else to the DRF `sync_view`.
+    """
+    sync_view = sync_to_async(sync_view)
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        if (settings.ASYNC_CATALOG_VIEWS and request.method in ('GET', 'HEAD')
+                and not wants_browsable_api(request)):
+            return await async_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+
+    return view
@@ -1,19 +1,106 @@
 import jwt
+import time
+import uuid
+import hashlib
+import secrets
 import datetime
 from django.conf import settings
-from django.contrib.auth.hashers import make_password, check_password
-from .models import StoreUser
+from django.db.models import Q
+from django.utils import timezone
+from .models import StoreUser, Tenant, RefreshToken
+from .cache import LRUCache
+from .hashing import make_password, check_password
+from . import metrics
 
 # Hardcoded secret since we removed SIMPLE_JWT settings
 JWT_SECRET = settings.SECRET_KEY
 JWT_ALGORITHM = 'HS256'
 ACCESS_TOKEN_LIFETIME = datetime.timedelta(minutes=60)
+REFRESH_TOKEN_LIFETIME = datetime.timedelta(days=getattr(settings, 'REFRESH_TOKEN_LIFETIME_DAYS', 14))
+
+# Resolved principals (StoreUser with its tenant preloaded) keyed by (user_id, iat).
+# Invalidated by the StoreUser/Tenant signal handlers in store.signals.
+principal_cache = LRUCache(
+    maxsize=getattr(settings, 'AUTH_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_CACHE_TTL', 300),
+)
+metrics.register('auth_principal_cache', principal_cache.stats)
+
+# Token versions for claims-only mode. Tokens carry StoreUser.token_version
+# as issued; the column is bumped when a claim in them (username, role,
+# tenant) changes, which revokes every older token. Processes remember a
+# user's version for AUTH_TOKEN_VERSION_TTL seconds, so a revocation made in
+# another process applies within that. A deleted user's version is DELETED.
+DELETED = -1
+token_versions = LRUCache(
+    maxsize=getattr(settings, 'AUTH_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_TOKEN_VERSION_TTL', 30),
+)
+metrics.register('auth_token_versions', token_versions.stats)
+
+def _version_query(user_id):
+    return StoreUser.objects.filter(pk=user_id).values_list('token_version', flat=True)
+
+def get_token_version(user_id):
+    version = token_versions.get(user_id)
+    if version is None:
+        generation = token_versions.generation
+        version = _version_query(user_id).first()
+        version = DELETED if version is None else version
+        token_versions.set(user_id, version, generation=generation)
+    return version
+
+async def aget_token_version(user_id):
+    version = token_versions.get(user_id)
+    if version is None:
+        generation = token_versions.generation
+        version = await _version_query(user_id).afirst()
+        version = DELETED if version is None else version
+        token_versions.set(user_id, version, generation=generation)
+    return version
+
+def set_token_version(user_id, version):
+    # delete() first: a lookup already under way won't cache the old version
+    token_versions.delete(user_id)
+    token_versions.set(user_id, version)
+
+class TokenPrincipal:
+    """
+    Lightweight stand-in for StoreUser built from verified JWT claims, used by
+    CustomAuthMiddleware when AUTH_CLAIMS_ONLY is on. Has what permissions,
+    TenantMiddleware and the views read (id, role, tenant) but is not a row:
+    code that needs to write the user must load it with StoreUser.objects.get(pk=...).
+    """
+    __slots__ = ('id', 'username', 'role', 'tenant_id', '_tenant')
+
+    def __init__(self, id, username, role, tenant_id):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.tenant_id = tenant_id
+        self._tenant = None
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def tenant(self):
+        # Unsaved shell instance: enough for filter(tenant=...) and FK assignment
+        if self._tenant is None and self.tenant_id is not None:
+            self._tenant = Tenant(id=self.tenant_id)
+        return self._tenant
+
+    def __str__(self):
+        return f"{self.username} ({self.role})"
 
 def hash_pass(password):
+    # Runs in the hashing pool, may raise HashPoolBusy (429)
     return make_password(password)
 
-def verify_pass(plain, hashed):
-    return check_password(plain, hashed)
+def verify_pass(plain, hashed, setter=None):
+    # setter(new_hash) is called when the stored hash was upgraded
+    return check_password(plain, hashed, setter=setter)
 
 def create_token(user):
     payload = {
@@ -21,9 +108,13 @@ def create_token(user):
         'username': user.username,
         'role': user.role,
         'tenant_id': user.tenant.id if user.tenant else None,
+        'ver': user.token_version,
         'exp': datetime.datetime.utcnow() + ACCESS_TOKEN_LIFETIME,
         'iat': datetime.datetime.utcnow()
     }
+    if token_versions.get(user.id) is None:
+        # Checked here without a query while it's remembered
+        token_versions.set(user.id, user.token_version)
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 def decode_token(token):
@@ -33,11 +124,141 @@ def decode_token(token):
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return None
 
+def _principal_key(payload):
+    return (payload['user_id'], payload.get('iat'))
+
 def get_user_from_token(token):
     payload = decode_token(token)
     if not payload:
         return None
+
+    key = _principal_key(payload)
+    user = principal_cache.get(key)
+    if user is not None:
+        return user
+
+    generation = principal_cache.generation
+    try:
+        # select_related so TenantMiddleware's user.tenant doesn't cost a second query
+        user = StoreUser.objects.select_related('tenant').get(id=payload['user_id'])
+    except StoreUser.DoesNotExist:
+        return None
+    principal_cache.set(key, user, generation=generation)
+    return user
+
+async def aget_user_from_token(token):
+    # Same as get_user_from_token, but only leaves the event loop on a cache miss
+    payload = decode_token(token)
+    if not payload:
+        return None
+
+    key = _principal_key(payload)
+    user = principal_cache.get(key)
+    if user is not None:
+        return user
+
+    generation = principal_cache.generation
     try:
-        return StoreUser.objects.get(id=payload['user_id'])
+        user = await StoreUser.objects.select_related('tenant').aget(id=payload['user_id'])
     except StoreUser.DoesNotExist:
         return None
+    principal_cache.set(key, user, generation=generation)
+    return user
+
+def _claims(token):
+    payload = decode_token(token)
+    if not payload or 'user_id' not in payload:
+        return None
+    return payload
+
+def _principal(payload, version):
+    if version == DELETED or payload.get('ver', 0) < version:
+        return None
+    try:
+        return TokenPrincipal(payload['user_id'], payload['username'], payload['role'], payload.get('tenant_id'))
+    except KeyError:
+        return None
+
+def get_principal_from_token(token):
+    # Claims-only mode: the DB is only asked for the token version, see above
+    payload = _claims(token)
+    return payload and _principal(payload, get_token_version(payload['user_id']))
+
+async def aget_principal_from_token(token):
+    payload = _claims(token)
+    return payload and _principal(payload, await aget_token_version(payload['user_id']))
+
+# Refresh tokens: a sha256 lookup instead of a PBKDF2 password check, so an
+# access token expiry storm doesn't turn into a login storm. Every rotation
+# adds a row; rotations also delete the ones that can never be exchanged
+# again (expired or revoked), at most every REFRESH_TOKEN_PURGE_INTERVAL
+# seconds per process. Used, unexpired rows stay: they detect reuse.
+
+refresh_stats = {'issued': 0, 'rotated': 0, 'rejected': 0, 'reuse_detected': 0, 'purged': 0}
+_purged_at = None
+metrics.register('auth_refresh', lambda: dict(refresh_stats))
+
+class InvalidRefreshToken(Exception):
+    pass
+
+def _hash_refresh_token(raw):
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def create_refresh_token(user, family=None):
+    raw = secrets.token_urlsafe(32)
+    RefreshToken.objects.create(
+        user=user,
+        token_hash=_hash_refresh_token(raw),
+        family=family or uuid.uuid4(),
+        expires_at=timezone.now() + REFRESH_TOKEN_LIFETIME,
+    )
+    refresh_stats['issued'] += 1
+    return raw
+
+def rotate_refresh_token(raw):
+    """
+    Exchange a refresh token for (access, refresh). The presented token is
+    spent; presenting it again revokes every token in its family, since one
+    of the two holders must have stolen it.
+    """
+    try:
+        token = RefreshToken.objects.select_related('user__tenant').get(
+            token_hash=_hash_refresh_token(raw or '')
+        )
+    except RefreshToken.DoesNotExist:
+        refresh_stats['rejected'] += 1
+        raise InvalidRefreshToken()
+
+    now = timezone.now()
+    if token.revoked_at is not None or token.expires_at <= now:
+        refresh_stats['rejected'] += 1
+        raise InvalidRefreshToken()
+
+    # Conditional update so two concurrent refreshes can't both spend it
+    spent = RefreshToken.objects.filter(pk=token.pk, used_at__isnull=True).update(used_at=now)
+    if not spent:
+        revoke_refresh_family(token.family)
+        refresh_stats['reuse_detected'] += 1
+        raise InvalidRefreshToken()
+
+    refresh_stats['rotated'] += 1
+    maybe_purge_refresh_tokens()
+    return create_token(token.user), create_refresh_token(token.user, family=token.family)
+
+def purge_refresh_tokens():
+    """Delete the refresh tokens that are expired or revoked. Returns how many."""
+    deleted = RefreshToken.objects.filter(
+        Q(expires_at__lte=timezone.now()) | Q(revoked_at__isnull=False)
+    ).delete()[0]
+    refresh_stats['purged'] += deleted
+    return deleted
+
+def maybe_purge_refresh_tokens():
+    global _purged_at
+    now = time.monotonic()
+    if _purged_at is None or now - _purged_at >= getattr(settings, 'REFRESH_TOKEN_PURGE_INTERVAL', 3600):
+        _purged_at = now
+        purge_refresh_tokens()
+
+def revoke_refresh_family(family):
+    RefreshToken.objects.filter(family=family, revoked_at__isnull=True).update(revoked_at=timezone.now())
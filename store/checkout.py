@@ -0,0 +1,241 @@
+import json
+import hashlib
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, When, Value, F, IntegerField
+from django.utils import timezone
+
+from .models import Product, Order, OrderItem, Checkout
+from .response_cache import invalidate_catalog
+from .tenant_utils import tenant_context
+from . import analytics, reservations
+
+# Carts to orders. place_orders() does the work (validate, split per tenant,
+# insert, take stock, update the rollups) inside the caller's transaction.
+# POST /api/orders/ runs it in the request, or with `Prefer: respond-async`
+# (or CHECKOUT_QUEUE on) stores the cart as a QUEUED Checkout and answers
+# 202; `manage.py process_checkouts` then places queued carts in batches,
+# one commit per batch and a savepoint per cart, as PENDING orders.
+# An Idempotency-Key makes the Checkout row unique per customer and key, so
+# a retried POST returns the first attempt's checkout instead of ordering
+# twice. Products enrolled in store.reservations take their units from the
+# reservation counters (the customer's holds first) instead of the row.
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class CheckoutError(Exception):
+    """The cart can't be ordered as it is; the message is for the customer."""
+
+
+class IdempotencyConflict(Exception):
+    """The Idempotency-Key was already used for a different cart."""
+
+
+def stock_case(quantities):
+    # CASE id WHEN <product_id> THEN <quantity> ... END
+    return Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def deduct_stock(quantities):
+    """
+    Atomically take `quantities` ({product_id: quantity}) out of stock.
+    Returns the number of products updated; a product without enough stock
+    left is not updated, so anything short of len(quantities) means the
+    caller must roll back.
+    """
+    quantity = stock_case(quantities)
+    return Product.all_objects.filter(id__in=list(quantities), stock__gte=quantity).update(
+        stock=F('stock') - quantity
+    )
+
+
+def place_orders(customer_id, items, status='COMPLETED', checkout=None, holds=()):
+    """
+    One order per tenant for `items` ([(product_id, quantity)]), stock taken
+    and rollups updated, in the caller's transaction. Products are looked up
+    in the current tenant context; `holds` are reservation ids to use for
+    enrolled ones. Raises CheckoutError, after which the caller must roll
+    back.
+    """
+    # Total quantity per product, the same product may be listed twice
+    quantities = {}
+    for product_id, quantity in items:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    product_ids = list(quantities)
+    product_map = {p.id: p for p in Product.objects.filter(id__in=product_ids).select_related('tenant')}
+    if len(product_map) != len(product_ids):
+        raise CheckoutError("One or more products found invalid")
+
+    engine = reservations.get_engine() if reservations.enabled() else None
+    reserved = engine.enrolled(product_ids) if engine else set()
+
+    # Early, friendly check. The conditional UPDATE below is what actually
+    # guarantees we never oversell. Reserved stock lags in the column.
+    for product_id, quantity in quantities.items():
+        product = product_map[product_id]
+        if product_id not in reserved and product.stock < quantity:
+            raise CheckoutError(f"Not enough stock for {product.name}")
+
+    orders_by_tenant = {}
+    for product_id, quantity in items:
+        product = product_map[product_id]
+        orders_by_tenant.setdefault(product.tenant_id, []).append({'product': product, 'quantity': quantity})
+
+    # Claimed before the transaction, handed back if it doesn't commit
+    claims = []
+    if reserved:
+        try:
+            claims = engine.acquire(customer_id, {p: q for p, q in quantities.items() if p in reserved}, holds)
+        except reservations.Unavailable as e:
+            raise CheckoutError(f"Not enough stock for {product_map[e.args[0]].name}")
+        quantities = {p: q for p, q in quantities.items() if p not in reserved}
+
+    try:
+        with transaction.atomic():
+            # The tenant is set explicitly: a customer buying from Tenant A may not
+            # have Tenant A as the current context
+            created_orders = Order.objects.bulk_create([
+                Order(
+                    tenant=order_items[0]['product'].tenant,
+                    customer_id=customer_id,
+                    status=status,
+                    checkout=checkout,
+                    total_amount=sum(i['product'].price * i['quantity'] for i in order_items)
+                )
+                for order_items in orders_by_tenant.values()
+            ])
+
+            created_items = OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=item['product'],
+                    quantity=item['quantity'],
+                    price=item['product'].price,
+                    product_name=item['product'].name,
+                    stock_pending=item['product'].id in reserved,
+                )
+                for order, order_items in zip(created_orders, orders_by_tenant.values())
+                for item in order_items
+            ])
+
+            # Deduct stock for every product in one statement:
+            # UPDATE ... SET stock = stock - q WHERE id IN (...) AND stock >= q
+            if quantities and deduct_stock(quantities) != len(quantities):
+                # Someone else bought it between the check above and our UPDATE
+                sold_out = Product.all_objects.filter(id__in=list(quantities), stock__lt=stock_case(quantities)).first()
+                name = sold_out.name if sold_out else "one or more products"
+                raise CheckoutError(f"Not enough stock for {name}")
+            analytics.record(created_orders, [
+                (item.order_id, item.product_id, item.quantity, item.price) for item in created_items
+            ])
+            # Stock is part of the cached catalog responses
+            invalidate_catalog(*orders_by_tenant)
+            if claims:
+                # Only once the outermost transaction commits
+                transaction.on_commit(lambda: engine.settle(claims))
+    except BaseException:
+        if claims:
+            engine.abort(claims)
+        raise
+    return created_orders
+
+
+def request_hash(items):
+    return hashlib.sha256(json.dumps(items, separators=(',', ':')).encode()).hexdigest()
+
+
+def find(customer_id, key, items):
+    """The checkout already made with this Idempotency-Key, or None. IdempotencyConflict if the cart differs."""
+    checkout = Checkout.objects.filter(customer_id=customer_id, idempotency_key=key).first()
+    if checkout is not None and checkout.request_hash != request_hash(items):
+        raise IdempotencyConflict()
+    return checkout
+
+
+def create(customer_id, items, key=None, tenant=None, status='QUEUED', holds=()):
+    """
+    A new Checkout, or the one a concurrent request with the same key just
+    made (second value False then).
+    """
+    items = [list(item) for item in items]
+    try:
+        with transaction.atomic():
+            return Checkout.objects.create(
+                customer_id=customer_id, tenant=tenant, idempotency_key=key, request_hash=request_hash(items),
+                items=items, holds=list(holds), status=status,
+                processed_at=timezone.now() if status != 'QUEUED' else None,
+            ), True
+    except IntegrityError:
+        if key is None:
+            raise
+        return find(customer_id, key, items), False
+
+
+def place_now(customer_id, items, key=None, tenant=None, holds=()):
+    """
+    place_orders() in a transaction of its own; with a key the Checkout row is
+    written with the orders. Returns (checkout or None, orders). A failed cart
+    leaves no row behind, so retrying it is attempted again.
+    """
+    if key is None:
+        # Its own writes are atomic. Not wrapped: on SQLite a transaction that
+        # reads first can't wait for the write lock, it fails at once.
+        return None, place_orders(customer_id, items, holds=holds)
+    with transaction.atomic():
+        checkout, created = create(customer_id, items, key, tenant, status='DONE')
+        if not created:
+            return checkout, None
+        return checkout, place_orders(customer_id, items, checkout=checkout, holds=holds)
+
+
+def placed_orders(checkout):
+    """The orders `checkout` placed: its customer's, and in its tenant when it had one."""
+    orders = Order.all_objects.filter(checkout=checkout, customer_id=checkout.customer_id)
+    if checkout.tenant_id is not None:
+        orders = orders.filter(tenant_id=checkout.tenant_id)
+    return orders.prefetch_related('items').order_by('id')
+
+
+def process_batch(batch_size):
+    """
+    Place up to `batch_size` queued checkouts, oldest first, committed
+    together. Returns how many were taken. Concurrent workers skip each
+    other's rows where the database can (SKIP LOCKED); on SQLite run one.
+    """
+    with transaction.atomic():
+        batch = list(
+            Checkout.objects.filter(status='QUEUED').select_related('tenant').order_by('created_at')
+            .select_for_update(skip_locked=True, of=('self',))[:batch_size]
+        )
+        now = timezone.now()
+        for checkout in batch:
+            try:
+                # A savepoint per cart: a rejected one undoes only its own writes
+                with transaction.atomic(), tenant_context(checkout.tenant):
+                    place_orders(checkout.customer_id, checkout.items, status='PENDING', checkout=checkout,
+                                 holds=checkout.holds)
+                checkout.status = 'DONE'
+            except CheckoutError as e:
+                checkout.status, checkout.error = 'REJECTED', str(e)
+            except Exception as e:
+                # Left queued for the next batch, up to CHECKOUT_MAX_ATTEMPTS
+                checkout.attempts += 1
+                if checkout.attempts < settings.CHECKOUT_MAX_ATTEMPTS:
+                    continue
+                checkout.status, checkout.error = 'FAILED', f'{type(e).__name__}: {e}'
+            checkout.processed_at = now
+        Checkout.objects.bulk_update(batch, ['status', 'error', 'attempts', 'processed_at'])
+    return len(batch)
+
+
+def purge(older_than_hours):
+    """Forget finished checkouts (and their idempotency keys) older than that. Orders stay."""
+    cutoff = timezone.now() - datetime.timedelta(hours=older_than_hours)
+    return Checkout.objects.exclude(status='QUEUED').filter(created_at__lt=cutoff).delete()[0]
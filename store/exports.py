@@ -0,0 +1,181 @@
+import io
+import csv
+import zlib
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .models import Order, OrderItem
+from .fast_serializers import datetime_converter, render_json
+from . import analytics
+
+# Order history export for accounting: GET /api/orders/export/. Orders are
+# read through a server-side cursor (iterator(chunk_size=EXPORT_BATCH_SIZE));
+# each batch's items come in one extra query and the batch is written out as
+# one chunk, so memory stays at a batch whatever the history and the first
+# bytes (the CSV header) go out before any query runs.
+
+TYPES = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+ORDER_COLUMNS = ('id', 'created_at', 'status', 'customer_id', 'customer__username', 'total_amount')
+ITEM_COLUMNS = ('order_id', 'product_id', 'product_name', 'quantity', 'price')
+CSV_HEADER = (
+    'order_id', 'created_at', 'status', 'customer_id', 'customer', 'order_total',
+    'product_id', 'product_name', 'quantity', 'unit_price',
+)
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_query(params):
+    """(type, {filters}, gzip) from ?type=csv|ndjson&from=&to=&status=a,b&gzip=true."""
+    errors = {}
+    kind = params.get('type', 'csv')
+    if kind not in TYPES:
+        errors['type'] = [f'Expected one of: {", ".join(TYPES)}.']
+
+    filters = {}
+    days = {}
+    for param in ('from', 'to'):
+        if params.get(param):
+            try:
+                days[param] = datetime.date.fromisoformat(params[param])
+            except ValueError:
+                errors[param] = ['Expected a date, YYYY-MM-DD.']
+    if 'from' in days:
+        filters['created_at__gte'] = analytics.day_bounds(days['from'], days['from'])[0]
+    if 'to' in days:
+        filters['created_at__lt'] = analytics.day_bounds(days['to'], days['to'])[1]
+
+    if params.get('status'):
+        statuses = [name.strip().upper() for name in params['status'].split(',') if name.strip()]
+        known = {value for value, _ in Order.STATUS_CHOICES}
+        unknown = [name for name in statuses if name not in known]
+        if unknown:
+            errors['status'] = [f'Unknown status: {name}' for name in unknown]
+        if statuses:
+            filters['status__in'] = statuses
+
+    if errors:
+        raise ValidationError(errors)
+    return kind, filters, params.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+
+def batches(orders, batch_size):
+    """(order rows, {order_id: [item rows]}) per batch of the orders queryset."""
+    batch = []
+    for row in orders.values_list(*ORDER_COLUMNS).iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch, items_for(batch)
+            batch = []
+    if batch:
+        yield batch, items_for(batch)
+
+
+def items_for(orders):
+    items = {}
+    rows = OrderItem.objects.filter(order_id__in=[row[0] for row in orders]).order_by('order_id', 'id')
+    for row in rows.values_list(*ITEM_COLUMNS):
+        items.setdefault(row[0], []).append(row[1:])
+    return items
+
+
+def safe_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(orders, batch_size, to_iso):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        chunk = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    writer.writerow(CSV_HEADER)
+    yield flush()
+    for batch, items in batches(orders, batch_size):
+        for order_id, created_at, status, customer_id, username, total in batch:
+            order = [order_id, to_iso(created_at), status, customer_id, safe_cell(username), f'{total:f}']
+            # One row per item; an order without items still gets a row
+            for product_id, name, quantity, price in items.get(order_id) or [(None, None, None, None)]:
+                writer.writerow(order + [
+                    product_id, safe_cell(name), quantity, None if price is None else f'{price:f}',
+                ])
+        yield flush()
+
+
+def ndjson_chunks(orders, batch_size, to_iso):
+    for batch, items in batches(orders, batch_size):
+        yield b''.join(render_json({
+            'id': order_id,
+            'created_at': to_iso(created_at),
+            'status': status,
+            'customer_id': customer_id,
+            'customer': username,
+            'total_amount': f'{total:f}',
+            'items': [
+                {'product_id': product_id, 'product_name': name, 'quantity': quantity, 'price': f'{price:f}'}
+                for product_id, name, quantity, price in items.get(order_id, ())
+            ],
+        }) + b'\n' for order_id, created_at, status, customer_id, username, total in batch)
+
+
+def gzipped(chunks):
+    # Flushed per chunk so compressed bytes still stream out batch by batch
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def async_chunks(chunks):
+    # Each chunk is produced in the request's sync thread, where the
+    # connection holding the server-side cursor lives
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    done = object()
+    try:
+        while (chunk := await next_chunk(chunks, done)) is not done:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+def export_response(request, tenant_id, kind, filters, gzip=False):
+    """
+    StreamingHttpResponse with the tenant's orders matching `filters`. The
+    queryset is bound to `tenant_id` explicitly: the body is generated after
+    the view (and the tenant context) has returned.
+    """
+    orders = Order.all_objects.filter(tenant_id=tenant_id, **filters).order_by('created_at', 'id')
+    # Timestamps as the orders API renders them
+    convert = datetime_converter(serializers.DateTimeField()) or (lambda value, tz: value.astimezone(tz).isoformat())
+    tz = timezone.get_current_timezone()
+    to_iso = lambda value: convert(value, tz)
+    batch_size = settings.EXPORT_BATCH_SIZE
+    chunks = (csv_chunks if kind == 'csv' else ndjson_chunks)(orders, batch_size, to_iso)
+
+    content_type, extension = TYPES[kind]
+    filename = f'orders-{timezone.localdate():%Y%m%d}.{extension}'
+    if gzip:
+        chunks, content_type, filename = gzipped(chunks), 'application/gzip', filename + '.gz'
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        # A sync iterator would be read to the end before the first byte under ASGI
+        chunks = async_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
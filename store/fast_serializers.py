@@ -0,0 +1,176 @@
+import copy
+import json
+import decimal
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from .images import variant_urls
+from .serializers import ImageVariantsField
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
+# Fast path for list endpoints: read values() rows and convert them with
+# per-field converters worked out once per serializer class, instead of
+# building DRF field objects and model instances for every row. Output is
+# byte-for-byte what the ModelSerializer + JSONRenderer would produce; a
+# serializer using anything we can't reproduce exactly gets no fast path.
+
+# Fields whose to_representation is the identity for the values() types
+PASSTHROUGH = (
+    serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+_plans = {}
+
+
+def decimal_converter(field):
+    if (not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+            or field.localize or field.normalize_output):
+        return None
+    if field.decimal_places is None:
+        return lambda value: f'{value:f}'
+    quantum = decimal.Decimal('.1') ** field.decimal_places
+    rounding = field.rounding
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    return lambda value: f'{value.quantize(quantum, rounding=rounding, context=context):f}'
+
+
+def datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if (output_format is None or output_format.lower() != 'iso-8601'
+            or not settings.USE_TZ or hasattr(field, 'timezone')):
+        return None
+
+    def convert(value, tz):
+        value = value.astimezone(tz).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+class Plan:
+    """values() columns plus a (key, column, kind, converter) per field."""
+
+    def __init__(self, serializer_class):
+        self.columns = []
+        self.fields = []
+        model = serializer_class.Meta.model
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if field.source == '*' or '.' in field.source:
+                raise TypeError(f'{name}: dotted or * source')
+            model_field = model._meta.get_field(field.source)
+            if isinstance(field, serializers.DecimalField):
+                kind, convert = 'decimal', decimal_converter(field)
+            elif isinstance(field, serializers.DateTimeField):
+                kind, convert = 'datetime', datetime_converter(field)
+            elif isinstance(field, serializers.FileField):
+                if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+                    raise TypeError(f'{name}: file names without urls')
+                kind, convert = 'file', model_field.storage
+            elif isinstance(field, ImageVariantsField):
+                kind, convert = 'variants', model._meta.get_field(field.image_field).storage
+            elif isinstance(field, PASSTHROUGH):
+                kind, convert = 'value', None
+            else:
+                raise TypeError(f'{name}: {type(field).__name__}')
+            if kind != 'value' and convert is None:
+                raise TypeError(f'{name}: unsupported options')
+            self.columns.append(model_field.name)
+            self.fields.append((name, model_field.name, kind, convert))
+
+    def select(self, names):
+        """This plan restricted to `names` (a ?fields= selection), None for all."""
+        if names is None:
+            return self
+        plan = copy.copy(self)
+        plan.fields = [field for field in self.fields if field[0] in names]
+        plan.columns = [field[1] for field in plan.fields]
+        return plan
+
+    def converters(self, request):
+        # Bound per call: the active timezone and the request can change
+        tz = timezone.get_current_timezone()
+        absolute = request.build_absolute_uri if request is not None else str
+        bound = []
+        for name, column, kind, convert in self.fields:
+            if kind == 'datetime':
+                convert = (lambda to_iso: lambda value: to_iso(value, tz))(convert)
+            elif kind == 'file':
+                # An empty file name renders as null
+                convert = (lambda storage: lambda value: absolute(storage.url(value)) if value else None)(convert)
+            elif kind == 'variants':
+                convert = (lambda storage: lambda value: variant_urls(value, storage, absolute))(convert)
+            bound.append((name, column, convert))
+        return bound
+
+    def to_representation(self, rows, request=None):
+        converters = self.converters(request)
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert in converters:
+                value = row[column]
+                item[name] = value if value is None or convert is None else convert(value)
+            data.append(item)
+        return data
+
+
+def get_plan(serializer_class):
+    """The serializer's Plan, or None when it can't be reproduced exactly."""
+    if serializer_class not in _plans:
+        try:
+            _plans[serializer_class] = Plan(serializer_class)
+        except (TypeError, AttributeError, LookupError):
+            _plans[serializer_class] = None
+    return _plans[serializer_class]
+
+
+def render_json(data):
+    # Same bytes as rest_framework.renderers.JSONRenderer (compact, unicode, strict)
+    if orjson is not None and settings.FAST_JSON_ENCODER:
+        body = orjson.dumps(data)
+    else:
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':'), allow_nan=False).encode('utf-8')
+    # JSONRenderer escapes these so the output is also valid JavaScript
+    return body.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def json_response(data, status=200):
+    return HttpResponse(render_json(data), status=status, content_type='application/json')
+
+
+class FastListMixin:
+    """
+    ModelViewSet.list() through the fast path when FAST_LIST_SERIALIZATION
+    is on and the negotiated renderer is JSON; otherwise the normal list().
+    """
+
+    def list(self, request, *args, **kwargs):
+        plan = get_plan(self.get_serializer_class())
+        if (plan is None or not settings.FAST_LIST_SERIALIZATION
+                or (self.paginator is not None and not hasattr(self.paginator, 'get_paginated_data'))
+                or getattr(request.accepted_renderer, 'format', None) != 'json'):
+            return super().list(request, *args, **kwargs)
+
+        plan = plan.select(getattr(self, 'selected_fields', None))
+        # The paginator needs its ordering columns even if they aren't rendered
+        ordering = getattr(self.paginator, 'ordering', ())
+        columns = plan.columns + [column for column in ordering if column not in plan.columns]
+        rows = self.filter_queryset(self.get_queryset()).values(*columns)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return json_response(plan.to_representation(rows, request))
+        return json_response(self.paginator.get_paginated_data(plan.to_representation(page, request)))
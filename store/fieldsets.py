@@ -0,0 +1,101 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+# Sparse fieldsets: ?fields=name,price / ?fields=card / ?exclude=description.
+# The selection trims the serializer output and the SQL projection (only() on
+# the DRF path, values() on the fast path). Presets are declared on the
+# serializer (SparseFieldsModelSerializer.presets), None meaning every field.
+
+_readable = {}
+
+
+def readable_fields(serializer_class):
+    if serializer_class not in _readable:
+        _readable[serializer_class] = [
+            name for name, field in serializer_class().fields.items() if not field.write_only
+        ]
+    return _readable[serializer_class]
+
+
+def parse_fields(params, serializer_class):
+    """
+    Names selected by ?fields= and ?exclude=, in serializer order, or None
+    when neither is given. Unknown names are a ValidationError (400).
+    """
+    if not params.get('fields') and not params.get('exclude'):
+        return None
+    available = readable_fields(serializer_class)
+    presets = getattr(serializer_class, 'presets', {})
+    errors = {}
+
+    def expand(param):
+        names, unknown = set(), []
+        for name in params.get(param, '').split(','):
+            name = name.strip()
+            if not name:
+                continue
+            if name in presets:
+                names.update(presets[name] or available)
+            elif name in available:
+                names.add(name)
+            else:
+                unknown.append(name)
+        if unknown:
+            errors[param] = [f'Unknown field: {name}' for name in unknown]
+        return names
+
+    selected = expand('fields') if params.get('fields') else set(available)
+    selected -= expand('exclude')
+    if errors:
+        raise ValidationError(errors)
+    if not selected:
+        raise ValidationError({'fields': ['No fields selected.']})
+    return tuple(name for name in available if name in selected)
+
+
+def projection(serializer_class, fields, always=()):
+    """Model columns to load for `fields`, plus `always` (e.g. the pagination order)."""
+    model = serializer_class.Meta.model
+    serializer_fields = serializer_class().fields
+    columns = list(always)
+    for name in fields:
+        source = serializer_fields[name].source
+        try:
+            model_field = model._meta.get_field(source)
+        except LookupError:
+            continue
+        # Reverse relations and m2m (e.g. Order.items) come from prefetches
+        if model_field.concrete and not model_field.many_to_many and source not in columns:
+            columns.append(source)
+    return columns
+
+
+class SparseFieldsMixin:
+    """
+    ?fields= / ?exclude= for a ModelViewSet whose serializer is a
+    SparseFieldsModelSerializer. Only applies to reads.
+    """
+    selected_fields = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Parsed before any query runs so bad names fail fast
+        if request.method in SAFE_METHODS:
+            self.selected_fields = parse_fields(request.query_params, self.get_serializer_class())
+
+    def wants_field(self, name):
+        return self.selected_fields is None or name in self.selected_fields
+
+    def get_serializer(self, *args, **kwargs):
+        if self.selected_fields is not None:
+            kwargs.setdefault('fields', self.selected_fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def project_queryset(self, queryset):
+        if self.selected_fields is None:
+            return queryset
+        ordering = getattr(self.paginator, 'ordering', ())
+        return queryset.only(*projection(self.get_serializer_class(), self.selected_fields, ordering))
+
+    def filter_queryset(self, queryset):
+        return self.project_queryset(super().filter_queryset(queryset))
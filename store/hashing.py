@@ -0,0 +1,135 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import Throttled
+
+from . import metrics
+
+# Password hashing off the request thread. PBKDF2 runs in a small process
+# pool so a burst of logins/registrations can't take the GIL (and every other
+# request) with it. At most HASH_MAX_PENDING jobs are queued or running; past
+# that callers get HashPoolBusy, a 429 with Retry-After. HASH_WORKERS = 0
+# hashes inline in the calling thread.
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """Django's PBKDF2-SHA256 with the iteration count from PASSWORD_ITERATIONS.
+    Hashes with a different count are re-hashed on the next successful login."""
+    iterations = getattr(settings, 'PASSWORD_ITERATIONS', None) or hashers.PBKDF2PasswordHasher.iterations
+
+
+class HashPoolBusy(Throttled):
+    default_detail = 'Too many sign-in requests right now, please retry shortly.'
+
+
+def _init_worker():
+    # Spawned workers start from scratch and need settings for the hashers
+    import django
+    django.setup()
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+def _check_password(password, encoded):
+    """(valid, new_encoded); new_encoded is set when the hash needs an upgrade."""
+    upgraded = []
+    valid = hashers.check_password(password, encoded, setter=lambda raw: upgraded.append(hashers.make_password(raw)))
+    return valid, (upgraded[0] if upgraded else None)
+
+
+class HashPool:
+    def __init__(self, workers, max_pending, retry_after):
+        self.workers = workers
+        self.retry_after = retry_after
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=1000)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: forking a threaded server process is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def run(self, fn, *args):
+        if not self.workers:
+            return self._timed(fn, *args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashPoolBusy(wait=self.retry_after)
+        started = time.perf_counter()
+        with self._lock:
+            self.pending += 1
+        try:
+            return self.executor().submit(fn, *args).result()
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next caller
+            with self._lock:
+                self._executor = None
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+            self._record(started)
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._record(started)
+
+    def _record(self, started):
+        self.latencies.append(time.perf_counter() - started)
+        self.completed += 1
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000, 1) if latencies else 0.0
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'latency_p50_ms': percentile(50),
+            'latency_p99_ms': percentile(99),
+        }
+
+
+hash_pool = HashPool(
+    workers=getattr(settings, 'HASH_WORKERS', 2),
+    max_pending=getattr(settings, 'HASH_MAX_PENDING', 32),
+    retry_after=getattr(settings, 'HASH_RETRY_AFTER', 1),
+)
+metrics.register('password_hashing', hash_pool.stats)
+
+
+def make_password(password):
+    return hash_pool.run(_make_password, password)
+
+
+def check_password(password, encoded, setter=None):
+    """Like django's check_password: `setter(new_encoded)` runs if the hash was upgraded."""
+    valid, upgraded = hash_pool.run(_check_password, password, encoded)
+    if valid and upgraded and setter:
+        setter(upgraded)
+    return valid
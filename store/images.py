@@ -0,0 +1,187 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from PIL import Image, ImageOps, features
+
+from . import metrics
+from .models import Product, Tenant
+from .response_cache import invalidate_catalog
+
+logger = logging.getLogger(__name__)
+
+# Image derivatives: every Product.image / Tenant.logo gets resized copies
+# (VARIANTS, never upscaled) in each of IMAGE_FORMATS that this Pillow can
+# write. They're generated after the upload's transaction commits, by a pool
+# of IMAGE_WORKERS threads (0 = inline), and stored through the image field's
+# storage under variants/<original name>/. The variants column lists them:
+#   {'source': 'products/mug.jpg',
+#    'card': {'width': 480, 'height': 360, 'webp': 'variants/products/mug.jpg/card.webp', ...}, ...}
+# `source` ties it to the upload it was made from: after a new upload it is
+# stale until the new derivatives are written. Jobs still queued when a
+# process exits are lost; `manage.py backfill_image_variants` redoes
+# whatever is missing or stale.
+
+# Largest first, each one is resized from the previous
+VARIANTS = {
+    'detail': (1200, 1200),
+    'card': (480, 480),
+    'thumbnail': (160, 160),
+}
+ENCODERS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60, 'speed': 8},
+}
+# model -> (image field, variants field)
+SOURCES = {
+    Product: ('image', 'image_variants'),
+    Tenant: ('logo', 'logo_variants'),
+}
+
+
+def formats():
+    return [name for name in settings.IMAGE_FORMATS if name in ENCODERS and features.check(name)]
+
+
+def variant_name(name, variant, extension):
+    return f'variants/{name}/{variant}.{extension}'
+
+
+def variant_urls(variants, storage, absolute=str):
+    """{variant: {'width', 'height', format: url}} for the API, None until generated."""
+    if not variants or 'error' in variants:
+        return None
+    return {
+        variant: {
+            key: value if key in ('width', 'height') else absolute(storage.url(value))
+            for key, value in variants[variant].items()
+        }
+        for variant in VARIANTS if variant in variants
+    }
+
+
+def variant_files(variants):
+    return {
+        value for variant in VARIANTS for key, value in (variants or {}).get(variant, {}).items()
+        if key not in ('width', 'height')
+    }
+
+
+def render(storage, name):
+    """Resize and encode every variant of the image `name`, writing them to `storage`."""
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        # JPEGs decode straight at 1/2, 1/4 or 1/8 scale when that's still big enough
+        image.draft(None, VARIANTS['detail'])
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+    variants = {'source': name}
+    for variant, size in VARIANTS.items():
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        entry = {'width': image.width, 'height': image.height}
+        for extension in formats():
+            buffer = io.BytesIO()
+            image.save(buffer, **ENCODERS[extension])
+            target = variant_name(name, variant, extension)
+            # Regenerating replaces the file instead of saving a renamed copy
+            if storage.exists(target):
+                storage.delete(target)
+            entry[extension] = storage.save(target, ContentFile(buffer.getvalue()))
+        variants[variant] = entry
+    return variants
+
+
+def generate(model, pk, force=False):
+    """
+    Write the derivatives of one row's image unless they're up to date (or
+    `force`). Returns 'generated', 'failed' (unreadable image, recorded so it
+    isn't retried) or 'skipped'.
+    """
+    image_field, variants_field = SOURCES[model]
+    rows = model._base_manager.filter(pk=pk)
+    row = rows.values(image_field, variants_field).first()
+    name = row and row[image_field]
+    if not name or (not force and (row[variants_field] or {}).get('source') == name):
+        return 'skipped'
+    storage = model._meta.get_field(image_field).storage
+    try:
+        variants = render(storage, name)
+        status = 'generated'
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError and a missing file are OSErrors
+        logger.warning('No variants for %s %s (%s): %s', model.__name__, pk, name, e)
+        variants, status = {'source': name, 'error': str(e)}, 'failed'
+
+    # Only if the image wasn't replaced meanwhile; update() so no signals fire
+    if rows.filter(**{image_field: name}).update(**{variants_field: variants}):
+        stale = variant_files(row[variants_field]) - variant_files(variants)
+        invalidate_catalog(pk if model is Tenant else rows.values_list('tenant_id', flat=True).first())
+    else:
+        stale = variant_files(variants)
+    for path in stale:
+        storage.delete(path)
+    return status
+
+
+class VariantPool:
+    """
+    Runs generate() for (model, pk) in background threads. A row already
+    waiting isn't queued twice: the job reads the row when it starts.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.completed = 0
+        self.failed = 0
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, model, pk):
+        if not self.workers:
+            self._run((model, pk))
+            return
+        with self._lock:
+            if (model, pk) in self._queued:
+                return
+            self._queued.add((model, pk))
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-variants')
+            self._executor.submit(self._run, (model, pk))
+
+    def _run(self, key):
+        with self._lock:
+            self._queued.discard(key)
+        if self.workers:
+            close_old_connections()
+        try:
+            status = generate(*key)
+        except Exception:
+            logger.exception('Image variants failed for %s %s', key[0].__name__, key[1])
+            status = 'failed'
+        finally:
+            if self.workers:
+                close_old_connections()
+        with self._lock:
+            self.completed += 1
+            self.failed += status == 'failed'
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queued': len(self._queued),
+            'completed': self.completed,
+            'failed': self.failed,
+            'formats': formats(),
+        }
+
+
+variant_pool = VariantPool(workers=getattr(settings, 'IMAGE_WORKERS', 2))
+metrics.register('image_variants', variant_pool.stats)
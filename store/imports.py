@@ -0,0 +1,266 @@
+import csv
+import json
+import codecs
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Product
+from .response_cache import invalidate_catalog
+
+# Bulk catalog import: POST /api/products/import/ with a CSV or NDJSON body
+# (or a multipart `file`). The upload is read as a stream, validated
+# IMPORT_BATCH_SIZE rows at a time and written by (tenant, sku): new skus
+# with one INSERT ... ON CONFLICT DO UPDATE per batch, existing ones with one
+# bulk_update of just the uploaded columns. Valid rows are written, invalid
+# ones come back in the report with their row number.
+
+TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+COLUMNS = ('sku', 'name', 'description', 'price', 'stock', 'category')
+# Needed to create a product, optional when updating one
+REQUIRED_ON_CREATE = ('name', 'price')
+
+
+class RowError(Exception):
+    pass
+
+
+def text_parser(field):
+    max_length = field.max_length
+
+    def parse(value):
+        if not isinstance(value, str):
+            raise RowError('Not a valid string.')
+        value = value.strip()
+        if not value and not field.blank:
+            raise RowError('This field may not be blank.')
+        if max_length and len(value) > max_length:
+            raise RowError(f'Ensure this field has no more than {max_length} characters.')
+        return value
+    return parse
+
+
+def decimal_parser(field):
+    max_whole = field.max_digits - field.decimal_places
+
+    def parse(value):
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise RowError('A valid number is required.')
+        try:
+            value = Decimal(str(value).strip())
+        except InvalidOperation:
+            raise RowError('A valid number is required.')
+        if not value.is_finite():
+            raise RowError('A valid number is required.')
+        if value < 0:
+            raise RowError('Ensure this value is greater than or equal to 0.')
+        if value.as_tuple().exponent < -field.decimal_places:
+            raise RowError(f'Ensure that there are no more than {field.decimal_places} decimal places.')
+        if value.adjusted() >= max_whole:
+            raise RowError(f'Ensure that there are no more than {max_whole} digits before the decimal point.')
+        return value
+    return parse
+
+
+def integer_parser(field):
+    def parse(value):
+        if isinstance(value, bool):
+            raise RowError('A valid integer is required.')
+        try:
+            value = int(value.strip() if isinstance(value, str) else value)
+        except (TypeError, ValueError):
+            raise RowError('A valid integer is required.')
+        if value < 0 or value > 2147483647:
+            raise RowError('Ensure this value is between 0 and 2147483647.')
+        return value
+    return parse
+
+
+PARSERS = {
+    'sku': text_parser, 'name': text_parser, 'description': text_parser, 'category': text_parser,
+    'price': decimal_parser, 'stock': integer_parser,
+}
+_parsers = {}
+
+
+def parsers():
+    # Built once from the model fields, so limits follow the schema
+    if not _parsers:
+        for column in COLUMNS:
+            field = Product._meta.get_field(column)
+            _parsers[column] = PARSERS[column](field)
+    return _parsers
+
+
+def detect_type(request):
+    kind = request.query_params.get('type')
+    if kind:
+        if kind not in TYPES.values():
+            raise ValidationError({'type': [f'Expected one of: {", ".join(sorted(set(TYPES.values())))}.']})
+        return kind
+    upload = request.FILES.get('file') if request.content_type.startswith('multipart/') else None
+    if upload is not None:
+        return 'ndjson' if upload.name.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+    return TYPES.get(request.content_type.split(';')[0].strip().lower(), 'csv')
+
+
+def open_upload(request):
+    """The upload as a text stream; never read into memory in one piece."""
+    if request.content_type.startswith('multipart/'):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['No file was submitted.']})
+        stream = upload
+    else:
+        stream = request.stream
+        if stream is None:
+            raise ValidationError({'detail': ['Empty upload.']})
+    # Incremental decoding over read(); HttpRequest isn't a full io object
+    return codecs.getreader('utf-8-sig')(stream)
+
+
+def csv_rows(text):
+    """(row number, {column: value}) per data row; row 1 is the header."""
+    reader = csv.reader(text)
+    header = [name.strip().lower() for name in next(reader, [])]
+    unknown = [name for name in header if name not in COLUMNS]
+    if unknown or 'sku' not in header or len(set(header)) != len(header):
+        raise ValidationError({'header': [
+            f'Expected a header with sku and any of: {", ".join(COLUMNS[1:])}; got {", ".join(header) or "nothing"}.'
+        ]})
+    for number, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) != len(header):
+            yield number, RowError(f'Expected {len(header)} columns, got {len(row)}.')
+        else:
+            yield number, dict(zip(header, row))
+
+
+def ndjson_rows(text):
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, RowError('Invalid JSON.')
+            continue
+        if not isinstance(row, dict):
+            yield number, RowError('Expected a JSON object.')
+            continue
+        unknown = sorted(set(row) - set(COLUMNS))
+        yield number, (RowError(f'Unknown fields: {", ".join(unknown)}.') if unknown else row)
+
+
+class Importer:
+    """Validates and upserts rows for one tenant, collecting the report."""
+
+    def __init__(self, tenant, dry_run=False):
+        self.tenant = tenant
+        self.dry_run = dry_run
+        self.parsers = parsers()
+        self.seen = {}  # sku -> row number, duplicates in one upload are errors
+        self.created = self.updated = self.failed = 0
+        self.errors = []
+
+    def error(self, number, sku, errors):
+        self.failed += 1
+        if len(self.errors) < settings.IMPORT_MAX_ERRORS:
+            self.errors.append({'row': number, 'sku': sku, 'errors': errors})
+
+    def clean(self, number, row):
+        if isinstance(row, RowError):
+            self.error(number, None, {'row': [str(row)]})
+            return None
+        values, errors = {}, {}
+        for column, value in row.items():
+            if value is None:
+                continue
+            try:
+                values[column] = self.parsers[column](value)
+            except RowError as e:
+                errors[column] = [str(e)]
+        sku = values.get('sku') or None
+        if 'sku' not in errors and not sku:
+            errors['sku'] = ['This field is required.']
+        elif sku in self.seen:
+            errors['sku'] = [f'Duplicate sku, already on row {self.seen[sku]}.']
+        if errors:
+            self.error(number, sku, errors)
+            return None
+        self.seen[sku] = number
+        return values
+
+    def run(self, rows):
+        batch = []
+        for number, row in rows:
+            values = self.clean(number, row)
+            if values is not None:
+                batch.append((number, values))
+            if len(batch) >= settings.IMPORT_BATCH_SIZE:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+        if self.created or self.updated:
+            invalidate_catalog(self.tenant.id)
+        return self.report()
+
+    def write(self, batch):
+        existing = dict(Product.all_objects.filter(
+            tenant=self.tenant, sku__in=[values['sku'] for _, values in batch],
+        ).values_list('sku', 'id'))
+        # Grouped by column set, one statement per group; a CSV has one set
+        creates, updates = {}, {}
+        for number, values in batch:
+            columns = tuple(sorted(column for column in values if column != 'sku'))
+            if values['sku'] in existing:
+                updates.setdefault(columns, []).append(Product(pk=existing[values['sku']], **values))
+                continue
+            missing = [column for column in REQUIRED_ON_CREATE if column not in values]
+            if missing:
+                self.error(number, values['sku'], {column: ['Required for a new sku.'] for column in missing})
+                continue
+            creates.setdefault(columns, []).append(Product(tenant=self.tenant, **values))
+
+        with transaction.atomic():
+            for columns, products in creates.items():
+                if not self.dry_run:
+                    # Upsert: a sku created since the lookup above is updated instead
+                    Product.all_objects.bulk_create(
+                        products, update_conflicts=True, unique_fields=['tenant', 'sku'], update_fields=columns,
+                    )
+                self.created += len(products)
+            for columns, products in updates.items():
+                # Only the uploaded columns are written, the rest keep their value
+                if not self.dry_run and columns:
+                    Product.all_objects.bulk_update(products, columns)
+                self.updated += len(products)
+
+    def report(self):
+        return {
+            'dry_run': self.dry_run,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def import_products(request, tenant):
+    kind = detect_type(request)
+    dry_run = request.query_params.get('dry_run', '').lower() in ('1', 'true', 'yes')
+    text = open_upload(request)
+    rows = csv_rows(text) if kind == 'csv' else ndjson_rows(text)
+    try:
+        return Importer(tenant, dry_run).run(rows)
+    except UnicodeDecodeError:
+        raise ValidationError({'detail': ['The upload must be UTF-8 text.']})
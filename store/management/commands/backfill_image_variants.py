@@ -0,0 +1,57 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from store import images
+from store.models import Product, Tenant
+
+MODELS = {'product': Product, 'tenant': Tenant}
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the resized image variants (store.images) of product images and tenant "
+        "logos that have none yet or were made from a replaced upload."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=MODELS, action='append', dest='models',
+                            help='product or tenant, repeatable (default both)')
+        parser.add_argument('--tenant', type=int, action='append', dest='tenants', help='tenant id, repeatable')
+        parser.add_argument('--force', action='store_true', help='regenerate up to date and failed variants too')
+        parser.add_argument('--workers', type=int, default=max(settings.IMAGE_WORKERS, 1),
+                            help='threads resizing in parallel (0 = inline)')
+
+    def handle(self, *args, **options):
+        for name in options['models'] or MODELS:
+            model = MODELS[name]
+            image_field, variants_field = images.SOURCES[model]
+            rows = model._base_manager.exclude(**{f'{image_field}__isnull': True}).exclude(**{image_field: ''})
+            if options['tenants']:
+                rows = rows.filter(**{'pk__in' if model is Tenant else 'tenant_id__in': options['tenants']})
+            # Stale rows picked here, generate() checks again before resizing
+            pks = [
+                pk for pk, source, variants in rows.order_by('pk').values_list('pk', image_field, variants_field)
+                if options['force'] or (variants or {}).get('source') != source
+            ]
+
+            def job(pk):
+                try:
+                    return images.generate(model, pk, force=options['force'])
+                finally:
+                    if options['workers']:
+                        connection.close()
+
+            if options['workers']:
+                with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                    results = Counter(executor.map(job, pks))
+            else:
+                results = Counter(map(job, pks))
+            self.stdout.write(
+                f"{name}: {results['generated']:,} generated, {results['failed']:,} failed, "
+                f"{results['skipped']:,} skipped"
+            )
+        self.stdout.write(self.style.SUCCESS(f'Image formats: {", ".join(images.formats()) or "none"}'))
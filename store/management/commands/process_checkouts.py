@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store import checkout
+
+
+class Command(BaseCommand):
+    help = (
+        "Place queued checkouts (store.checkout) as PENDING orders, --batch-size carts per "
+        "commit, until stopped. Finished checkouts past CHECKOUT_RETENTION_HOURS are purged while idle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.CHECKOUT_BATCH_SIZE)
+        parser.add_argument('--idle-sleep', type=float, default=0.5, help='seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='drain the queue, then exit')
+
+    def handle(self, *args, **options):
+        total = 0
+        purged_at = 0
+        try:
+            while True:
+                taken = checkout.process_batch(options['batch_size'])
+                total += taken
+                if taken and options['verbosity'] > 1:
+                    self.stdout.write(f'{taken} checkout(s)')
+                if taken:
+                    continue
+                if options['once']:
+                    break
+                if time.monotonic() - purged_at > 3600:
+                    checkout.purge(settings.CHECKOUT_RETENTION_HOURS)
+                    purged_at = time.monotonic()
+                time.sleep(options['idle_sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Processed {total:,} checkout(s)'))
@@ -0,0 +1,287 @@
+import time
+import random
+import datetime
+from array import array
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from store import analytics
+from store.models import Tenant, StoreUser, Product, Order, OrderItem
+from store.response_cache import invalidate_catalog
+
+ADJECTIVES = ['Classic', 'Organic', 'Handmade', 'Vintage', 'Compact', 'Deluxe', 'Rustic', 'Modern',
+              'Smart', 'Eco', 'Premium', 'Travel', 'Ceramic', 'Wooden', 'Steel', 'Cotton']
+NOUNS = ['Mug', 'Lamp', 'Kettle', 'Chair', 'Desk', 'Bowl', 'Notebook', 'Backpack', 'Candle',
+         'Teapot', 'Blanket', 'Speaker', 'Planter', 'Watch', 'Wallet', 'Jacket']
+CATEGORIES = ['kitchen', 'home', 'office', 'garden', 'fashion', 'electronics', 'outdoors', 'food']
+STATUSES = [('COMPLETED', 70), ('SHIPPED', 12), ('PAID', 8), ('PENDING', 6), ('CANCELLED', 4)]
+
+
+def zipf_rank(u, n, s):
+    """Rank in [0, n) for uniform u, Zipf-distributed with exponent s (0 = uniform).
+    Inverse CDF of the continuous approximation, so no per-item weight table."""
+    if n <= 1:
+        return 0
+    if abs(s - 1.0) < 1e-9:
+        x = n ** u
+    else:
+        x = ((n ** (1 - s) - 1) * u + 1) ** (1 / (1 - s))
+    return min(n - 1, max(0, int(x) - 1))
+
+
+def split(total, parts, s, minimum=0):
+    """Split `total` into `parts` Zipf(s)-weighted integer shares, largest first."""
+    weights = [1 / (i + 1) ** s for i in range(parts)]
+    scale = (total - minimum * parts) / sum(weights)
+    shares = [minimum + int(w * scale) for w in weights]
+    for i in range(total - sum(shares)):
+        shares[i % parts] += 1
+    return shares
+
+
+def product_name(n, seed):
+    # Derived from the product number so it can be rebuilt for OrderItem.product_name
+    h = (n * 2654435761 + seed) & 0xFFFFFFFF
+    return f'{ADJECTIVES[h % len(ADJECTIVES)]} {NOUNS[(h >> 8) % len(NOUNS)]} {n}'
+
+
+@contextmanager
+def explicit_created_at(*models):
+    # Let bulk_create keep the generated timestamps instead of auto_now_add's now()
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic multi-tenant dataset: tenants with Zipf-skewed catalog sizes, "
+        "owners, customers, products and an order history with hot products. Deterministic "
+        "for a given --seed and --until."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=50)
+        parser.add_argument('--products', type=int, default=20000, help='total across all tenants')
+        parser.add_argument('--customers', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--max-items', type=int, default=5, help='max line items per order')
+        parser.add_argument('--tenant-skew', type=float, default=1.2, help='Zipf exponent of tenant sizes')
+        parser.add_argument('--product-skew', type=float, default=1.1, help='Zipf exponent of product popularity')
+        parser.add_argument('--customer-skew', type=float, default=0.8, help='Zipf exponent of orders per customer')
+        parser.add_argument('--days', type=int, default=365, help='history length')
+        parser.add_argument('--until', type=datetime.date.fromisoformat, default=None,
+                            help='last day of history, YYYY-MM-DD (default today)')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seed', help='username / tenant name prefix')
+        parser.add_argument('--password', default='password', help='password of every generated user')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = options['prefix']
+        if options['tenants'] < 1 or options['products'] < options['tenants']:
+            raise CommandError('Need at least one tenant and one product per tenant.')
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError('The database must return ids from bulk inserts (PostgreSQL, SQLite 3.35+).')
+        if StoreUser.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f'Users prefixed "{prefix}_" already exist, pick another --prefix.')
+
+        until = options['until'] or timezone.localdate()
+        self.end = timezone.make_aware(datetime.datetime.combine(until, datetime.time.max))
+        self.start = self.end - datetime.timedelta(days=options['days'])
+        # Hashed once, every generated user shares it
+        self.password_hash = make_password(options['password'])
+
+        started = time.perf_counter()
+        with explicit_created_at(Tenant, StoreUser, Product):
+            tenants = self.create_tenants(prefix)
+            self.create_users(prefix, tenants)
+            self.create_products(tenants)
+            self.create_orders(tenants)
+        # Raw inserts skip the incremental sales rollups
+        for tenant in tenants:
+            for _ in analytics.rebuild(tenant.id):
+                pass
+        self.stdout.write(f'sales rollups: {len(tenants):,} tenants')
+        invalidate_catalog(*[tenant.id for tenant in tenants])
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s'))
+
+    def timestamp(self, fraction):
+        return self.start + (self.end - self.start) * fraction
+
+    def progress(self, label, done, total, started):
+        rate = done / max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f'{label}: {done:,}/{total:,} ({rate:,.0f} rows/s)')
+
+    def create_tenants(self, prefix):
+        count = self.options['tenants']
+        tenants = Tenant.objects.bulk_create(
+            [Tenant(name=f'{prefix} shop {i}', created_at=self.timestamp(i / count * 0.1)) for i in range(count)],
+            batch_size=self.batch_size,
+        )
+        self.stdout.write(f'tenants: {count:,}')
+        return tenants
+
+    def create_users(self, prefix, tenants):
+        owners = (
+            StoreUser(username=f'{prefix}_owner_{i}', email=f'{prefix}_owner_{i}@example.com',
+                      password=self.password_hash, role='OWNER', tenant=tenant, created_at=tenant.created_at)
+            for i, tenant in enumerate(tenants)
+        )
+        self.bulk_insert(StoreUser, owners, 'owners', len(tenants))
+
+        count = self.options['customers']
+        customers = (
+            StoreUser(username=f'{prefix}_customer_{i}', email=f'{prefix}_customer_{i}@example.com',
+                      password=self.password_hash, role='CUSTOMER', created_at=self.timestamp(i / count * 0.5))
+            for i in range(count)
+        )
+        ids = self.bulk_insert(StoreUser, customers, 'customers', count)
+        self.customer_ids = array('q', ids)
+
+    def create_products(self, tenants):
+        seed = self.options['seed']
+        rng = self.rng
+        sizes = split(self.options['products'], len(tenants), self.options['tenant_skew'], minimum=1)
+        # Per tenant: product ids and prices (cents) in catalog order; rank 0 is the hottest
+        self.product_ids = [array('q') for _ in tenants]
+        self.product_prices = [array('q') for _ in tenants]
+        self.product_numbers = []
+
+        def generate():
+            n = 0
+            for t, (tenant, size) in enumerate(zip(tenants, sizes)):
+                self.product_numbers.append(n)
+                for i in range(size):
+                    cents = int(rng.lognormvariate(7.5, 1.0)) + 99
+                    self.product_prices[t].append(cents)
+                    yield t, Product(
+                        tenant_id=tenant.id, name=product_name(n, seed),
+                        description=' '.join(rng.choices(NOUNS + ADJECTIVES, k=rng.randint(5, 60))),
+                        price=Decimal(cents).scaleb(-2), stock=rng.randint(0, 500),
+                        category=rng.choice(CATEGORIES),
+                        created_at=self.timestamp(rng.random() * 0.3),
+                    )
+                    n += 1
+
+        total = sum(sizes)
+        started = time.perf_counter()
+        done = 0
+        for batch in self.batches(generate()):
+            with transaction.atomic():
+                created = Product.objects.bulk_create([product for _, product in batch])
+            for (t, _), product in zip(batch, created):
+                self.product_ids[t].append(product.id)
+            done += len(batch)
+            self.progress('products', done, total, started)
+        self.tenant_sizes = sizes
+
+    def create_orders(self, tenants):
+        opts = self.options
+        rng = self.rng
+        seed = opts['seed']
+        total = opts['orders']
+        tenant_weights = []
+        running = 0
+        for size in self.tenant_sizes:
+            running += size  # bigger catalogs sell proportionally more
+            tenant_weights.append(running)
+        statuses, status_weights = zip(*STATUSES)
+
+        def generate():
+            for k in range(total):
+                t = rng.choices(range(len(tenants)), cum_weights=tenant_weights)[0]
+                size = self.tenant_sizes[t]
+                lines = {}
+                for _ in range(rng.randint(1, opts['max_items'])):
+                    rank = zipf_rank(rng.random(), size, opts['product_skew'])
+                    lines[rank] = lines.get(rank, 0) + rng.randint(1, 3)
+                customer = self.customer_ids[zipf_rank(rng.random(), len(self.customer_ids), opts['customer_skew'])]
+                fraction = 0.3 + 0.7 * (k + rng.random()) / total  # ids increase with time
+                yield t, customer, lines, rng.choices(statuses, status_weights)[0], self.timestamp(fraction)
+
+        started = time.perf_counter()
+        done = items_done = 0
+        for batch in self.batches(generate()):
+            orders = []
+            for t, customer, lines, status, created_at in batch:
+                amount = sum(self.product_prices[t][rank] * quantity for rank, quantity in lines.items())
+                orders.append((tenants[t].id, customer, status, Decimal(amount).scaleb(-2),
+                               connection.ops.adapt_datetimefield_value(created_at)))
+            items = []
+            with transaction.atomic():
+                order_ids = self.insert_rows(
+                    Order, ['tenant', 'customer', 'status', 'total_amount', 'created_at'], orders, returning=True,
+                )
+                for order_id, (t, _, lines, _, _) in zip(order_ids, batch):
+                    for rank, quantity in lines.items():
+                        items.append((
+                            order_id, self.product_ids[t][rank], quantity,
+                            Decimal(self.product_prices[t][rank]).scaleb(-2),
+                            product_name(self.product_numbers[t] + rank, seed), False,
+                        ))
+                self.insert_rows(
+                    OrderItem, ['order', 'product', 'quantity', 'price', 'product_name', 'stock_pending'], items,
+                )
+            done += len(batch)
+            items_done += len(items)
+            self.progress('orders', done, total, started)
+        self.stdout.write(f'order items: {items_done:,}')
+
+    def bulk_insert(self, model, objects, label, total):
+        ids = []
+        started = time.perf_counter()
+        for batch in self.batches(objects):
+            with transaction.atomic():
+                ids.extend(obj.id for obj in model.objects.bulk_create(batch))
+            self.progress(label, len(ids), total, started)
+        return ids
+
+    def insert_rows(self, model, fields, rows, returning=False):
+        """
+        Plain INSERTs for the high-volume tables, skipping bulk_create's
+        per-object model and SQL compilation. With `returning`, the new ids in
+        row order (multi-row INSERT ... RETURNING, as bulk_create does).
+        """
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+        row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+        sql = f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES '
+        with connection.cursor() as cursor:
+            if not returning:
+                cursor.executemany(sql + row_sql, rows)
+                return None
+            ids = []
+            size = connection.ops.bulk_batch_size([model._meta.get_field(name) for name in fields], rows) or len(rows)
+            for start in range(0, len(rows), size):
+                chunk = rows[start:start + size]
+                cursor.execute(
+                    sql + ', '.join([row_sql] * len(chunk)) + f' RETURNING {quote(model._meta.pk.column)}',
+                    [value for row in chunk for value in row],
+                )
+                ids.extend(row[0] for row in cursor.fetchall())
+            return ids
+
+    def batches(self, iterable):
+        # Never more than one batch of unsaved objects in memory
+        batch = []
+        for item in iterable:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from store import reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Release expired stock holds, apply checkouts of reserved products to Product.stock and "
+        "reconcile the reservation counters (store.reservations), every --interval seconds until stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.RESERVATION_SYNC_INTERVAL or 2)
+        parser.add_argument('--once', action='store_true', help='sync once, then exit')
+
+    def handle(self, *args, **options):
+        if not reservations.enabled():
+            raise CommandError('Stock reservations are off, set RESERVATION_BACKEND.')
+        if settings.RESERVATION_BACKEND == 'local' and not options['once']:
+            # Those counters live in the web process, which syncs them itself
+            raise CommandError('RESERVATION_BACKEND=local is synced by the process that holds it.')
+        engine = reservations.get_engine()
+        try:
+            while True:
+                result = reservations.sync(engine)
+                if options['verbosity'] > 1 or options['once']:
+                    self.stdout.write(
+                        f"{result['released']:,} hold(s) released, {result['flushed']:,} unit(s) applied, "
+                        f"{result['corrected']:,} counter(s) corrected"
+                    )
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,9 @@
+# Process-local metrics registry. Components register a callable returning a
+# dict of counters and MetricsView (/api/metrics/) reports all of them.
+_sources = {}
+
+def register(name, fn):
+    _sources[name] = fn
+
+def collect():
+    return {name: fn() for name, fn in _sources.items()}
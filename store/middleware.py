@@ -1,46 +1,188 @@
-from django.utils.deprecation import MiddlewareMixin
-from .tenant_utils import set_current_tenant
-from .models import Tenant
-from .authentication import get_user_from_token
-
-class CustomAuthMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        auth_header = request.headers.get('Authorization')
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .tenant_utils import tenant_context, get_current_tenant
+from .tenant_registry import tenant_registry
+from .authentication import get_user_from_token, aget_user_from_token, get_principal_from_token, aget_principal_from_token
+from . import response_cache, replicas
+
+# Both middlewares are sync *and* async capable. Under ASGI they run on the
+# event loop instead of being wrapped in sync_to_async, and only leave it
+# when a cache miss needs the database.
+
+def _bearer_token(request):
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+    return None
+
+class CustomAuthMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         request.custom_user = None # Default to None
+        token = _bearer_token(request)
+        if token:
+            if settings.AUTH_CLAIMS_ONLY:
+                request.custom_user = get_principal_from_token(token)
+            else:
+                request.custom_user = get_user_from_token(token)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.custom_user = None
+        token = _bearer_token(request)
+        if token:
+            if settings.AUTH_CLAIMS_ONLY:
+                request.custom_user = await aget_principal_from_token(token)
+            else:
+                request.custom_user = await aget_user_from_token(token)
+        return await self.get_response(request)
+
+class TenantMiddleware:
+    sync_capable = True
+    async_capable = True
 
-        if auth_header and auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
-            user = get_user_from_token(token)
-            if user:
-                request.custom_user = user
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
-class TenantMiddleware(MiddlewareMixin):
-    def process_request(self, request):
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        tenant = self.user_tenant(request)
+        # Fallback: Header for testing / public access, then
+        # Query Param for public access (e.g. store front)
+        for tenant_id in self.requested_tenant_ids(request, tenant):
+            tenant = tenant_registry.get(tenant_id)
+            if tenant:
+                break
+
+        # The context is always reset, even if the view raises
+        with tenant_context(tenant):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        tenant = self.user_tenant(request)
+        for tenant_id in self.requested_tenant_ids(request, tenant):
+            tenant = await tenant_registry.aget(tenant_id)
+            if tenant:
+                break
+
+        with tenant_context(tenant):
+            return await self.get_response(request)
+
+    def user_tenant(self, request):
         # Relies on CustomAuthMiddleware running BEFORE this
         user = getattr(request, 'custom_user', None)
-        tenant = None
-
-        if user:
-            # If user is OWNER or STAFF, their context is their Tenant
-            if user.role in ['OWNER', 'STAFF'] and user.tenant:
-                tenant = user.tenant
-        
-        # Fallback: Header for testing / public access
-        if not tenant:
-            tenant_header = request.headers.get('X-Tenant-ID')
-            if tenant_header:
-                try:
-                    tenant = Tenant.objects.get(id=tenant_header)
-                except Tenant.DoesNotExist:
-                    pass
-
-        # Fallback: Query Param for public access (e.g. store front)
-        if not tenant:
-             tenant_param = request.GET.get('tenant')
-             if tenant_param:
-                 try:
-                     tenant = Tenant.objects.get(id=tenant_param)
-                 except (Tenant.DoesNotExist, ValueError):
-                     pass
-        
-        set_current_tenant(tenant)
+        # If user is OWNER or STAFF, their context is their Tenant
+        if user and user.role in ['OWNER', 'STAFF'] and user.tenant:
+            return user.tenant
+        return None
+
+    def requested_tenant_ids(self, request, tenant):
+        if tenant:
+            return
+        tenant_header = request.headers.get('X-Tenant-ID')
+        if tenant_header:
+            yield tenant_header
+        tenant_param = request.GET.get('tenant')
+        if tenant_param:
+            yield tenant_param
+
+class ReplicaMiddleware:
+    """
+    Reads the catalog and order history from a replica (store.replicas)
+    unless the client is pinned to the primary, and pins it after a write.
+    Must come after TenantMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with replicas.reading(replicas.replica_for(request, get_current_tenant())):
+            response = self.get_response(request)
+        replicas.remember_write(request, response)
+        return response
+
+    async def __acall__(self, request):
+        with replicas.reading(await replicas.areplica_for(request, get_current_tenant())):
+            response = await self.get_response(request)
+        await replicas.aremember_write(request, response)
+        return response
+
+class CatalogCacheMiddleware:
+    """
+    Serves catalog reads from store.response_cache. Must come after
+    TenantMiddleware, the cache key depends on the resolved tenant.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        scope = response_cache.request_scope(request, get_current_tenant())
+        if scope is None:
+            return self.get_response(request)
+
+        key = response_cache.entry_key(request, scope, response_cache.get_generation(scope))
+        etag = response_cache.etag_for(key)
+        if response_cache.is_not_modified(request, etag):
+            return response_cache.not_modified(etag)
+
+        cache = response_cache.get_cache()
+        entry = cache.get(key)
+        if entry is not None:
+            return response_cache.from_entry(entry, etag)
+
+        response_cache.stats['misses'] += 1
+        response = self.get_response(request)
+        if response_cache.storable(request, response):
+            cache.set(key, response_cache.to_entry(response, etag), settings.RESPONSE_CACHE_TTL)
+        return response
+
+    async def __acall__(self, request):
+        scope = response_cache.request_scope(request, get_current_tenant())
+        if scope is None:
+            return await self.get_response(request)
+
+        key = response_cache.entry_key(request, scope, await response_cache.aget_generation(scope))
+        etag = response_cache.etag_for(key)
+        if response_cache.is_not_modified(request, etag):
+            return response_cache.not_modified(etag)
+
+        cache = response_cache.get_cache()
+        entry = await cache.aget(key)
+        if entry is not None:
+            return response_cache.from_entry(entry, etag)
+
+        response_cache.stats['misses'] += 1
+        response = await self.get_response(request)
+        if response_cache.storable(request, response):
+            await cache.aset(key, response_cache.to_entry(response, etag), settings.RESPONSE_CACHE_TTL)
+        return response
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:37
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_product_names(apps, schema_editor):
+    # Copy the current product name into existing rows, one id range per
+    # UPDATE so no single statement locks or rewrites the whole table.
+    OrderItem = apps.get_model('store', 'OrderItem')
+    Product = apps.get_model('store', 'Product')
+    db = schema_editor.connection.alias
+    items = OrderItem.objects.using(db)
+    product_name = Subquery(Product.objects.using(db).filter(pk=OuterRef('product_id')).values('name')[:1])
+
+    last_id = items.order_by('-id').values_list('id', flat=True).first() or 0
+    start = 0
+    while start < last_id:
+        items.filter(id__gt=start, id__lte=start + BATCH_SIZE, product_name='').update(product_name=product_name)
+        start += BATCH_SIZE
+
+
+class Migration(migrations.Migration):
+
+    # Each backfill batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('store', '0002_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_product_names, migrations.RunPython.noop),
+    ]
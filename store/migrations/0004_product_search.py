@@ -0,0 +1,85 @@
+from django.db import migrations
+
+# Full-text search support for store.search. Vendor specific, so done here
+# rather than with Meta.indexes. The PostgreSQL expression must stay
+# identical to store.search.PG_DOCUMENT for the planner to use the index.
+
+PG_CREATE = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_search_idx ON store_product USING GIN ((
+    setweight(to_tsvector('english', coalesce("name", '')), 'A') ||
+    setweight(to_tsvector('english', coalesce("description", '')), 'B')
+))
+"""
+PG_DROP = "DROP INDEX CONCURRENTLY IF EXISTS product_search_idx"
+
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE store_product_fts USING fts5(
+        name, description, content='store_product', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER store_product_fts_insert AFTER INSERT ON store_product BEGIN
+        INSERT INTO store_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER store_product_fts_delete AFTER DELETE ON store_product BEGIN
+        INSERT INTO store_product_fts(store_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER store_product_fts_update AFTER UPDATE OF name, description ON store_product BEGIN
+        INSERT INTO store_product_fts(store_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO store_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    # Index the rows that already exist
+    "INSERT INTO store_product_fts(store_product_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS store_product_fts_insert",
+    "DROP TRIGGER IF EXISTS store_product_fts_delete",
+    "DROP TRIGGER IF EXISTS store_product_fts_update",
+    "DROP TABLE IF EXISTS store_product_fts",
+]
+
+
+def sqlite_has_fts5(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(PG_CREATE)
+    elif vendor == 'sqlite' and sqlite_has_fts5(schema_editor):
+        for statement in SQLITE_CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(PG_DROP)
+    elif vendor == 'sqlite':
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('store', '0003_orderitem_product_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
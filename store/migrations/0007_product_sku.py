@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:22
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+search_migration = import_module('store.migrations.0004_product_search')
+
+
+def restore_sqlite_search_triggers(apps, schema_editor):
+    # SQLite applies AddField/AddConstraint by rebuilding store_product,
+    # which drops the FTS triggers from 0004. Put them back and reindex.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if 'store_product_fts' not in schema_editor.connection.introspection.table_names(cursor):
+            return
+    for statement in search_migration.SQLITE_DROP[:-1] + search_migration.SQLITE_CREATE[1:]:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('tenant', 'sku'), name='product_tenant_sku_uniq'),
+        ),
+        migrations.RunPython(restore_sqlite_search_triggers, restore_sqlite_search_triggers),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_checkout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkout',
+            name='holds',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='stock_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(condition=models.Q(('stock_pending', True)), fields=['product'], name='orderitem_stock_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_replica_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storeuser',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,9 +1,13 @@
+import uuid
+
 from django.db import models
 from .tenant_utils import TenantAwareModel
 
 class Tenant(models.Model):
     name = models.CharField(max_length=100)
     logo = models.ImageField(upload_to='tenant_logos/', blank=True, null=True)
+    # Resized copies of the logo, written by store.images after upload
+    logo_variants = models.JSONField(null=True, blank=True, editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -22,6 +26,8 @@ class StoreUser(models.Model):
     
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name='users', null=True, blank=True)
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='CUSTOMER')
+    # Issued tokens carry it; bumped when a claim in them changes (store.signals)
+    token_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -29,14 +35,32 @@ class StoreUser(models.Model):
 
 class Product(TenantAwareModel):
     # tenant field inherited from TenantAwareModel
+    # Merchant's own product code, unique per tenant; bulk imports upsert by it
+    sku = models.CharField(max_length=64, null=True, blank=True)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
     category = models.CharField(max_length=100, blank=True)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Resized copies of the image, written by store.images after upload.
+    # Nullable without a default so SQLite adds it without rebuilding the table
+    image_variants = models.JSONField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Keyset pagination order (created_at, id), per tenant and marketplace
+        # wide, and within a tenant's category (also the category facet counts)
+        indexes = [
+            models.Index(fields=['tenant', 'created_at', 'id'], name='product_tenant_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+            models.Index(fields=['tenant', 'category', 'created_at', 'id'], name='product_tenant_category_idx'),
+        ]
+        constraints = [
+            # NULLs don't conflict, products without a SKU are fine
+            models.UniqueConstraint(fields=['tenant', 'sku'], name='product_tenant_sku_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.tenant.name})"
 
@@ -52,8 +76,19 @@ class Order(TenantAwareModel):
     customer = models.ForeignKey(StoreUser, on_delete=models.CASCADE, related_name='orders')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # The checkout that placed it, see store.checkout
+    checkout = models.ForeignKey('Checkout', on_delete=models.SET_NULL, related_name='orders', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Keyset pagination order (created_at, id) for owner and customer order
+        # lists; the admin's status filter across stores
+        indexes = [
+            models.Index(fields=['tenant', 'created_at', 'id'], name='order_tenant_created_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='order_customer_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.customer.username}"
 
@@ -62,3 +97,105 @@ class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2) # Price at time of order
+    product_name = models.CharField(max_length=255, blank=True) # Name at time of order, no join needed
+    # Sold from reserved stock (store.reservations), not yet taken out of Product.stock
+    stock_pending = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product'], name='orderitem_stock_pending_idx', condition=models.Q(stock_pending=True)),
+        ]
+
+class Checkout(models.Model):
+    # A cart posted to /api/orders/ (store.checkout). Queued ones wait here
+    # for `manage.py process_checkouts`; keyed ones remember the client's
+    # Idempotency-Key so a retry gets the same orders instead of new ones.
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('DONE', 'Done'),
+        ('REJECTED', 'Rejected'),
+        ('FAILED', 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    customer = models.ForeignKey(StoreUser, on_delete=models.CASCADE, related_name='checkouts')
+    # The request's tenant context, products are looked up in it
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    request_hash = models.CharField(max_length=64)
+    items = models.JSONField()  # [[product_id, quantity], ...] as posted
+    holds = models.JSONField(default=list, blank=True)  # store.reservations hold ids to check out
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'idempotency_key'], name='checkout_idempotency_uniq'),
+        ]
+        indexes = [
+            # The queue itself; finished checkouts stay out of this index
+            models.Index(fields=['created_at'], name='checkout_queued_idx', condition=models.Q(status='QUEUED')),
+        ]
+
+    def __str__(self):
+        return f"Checkout {self.id} ({self.status})"
+
+class RefreshToken(models.Model):
+    # Opaque long-lived token exchanged at /api/auth/refresh/ for a new access
+    # token. Only the sha256 of the token is stored. Every refresh rotates it
+    # within the same family; presenting a used token revokes the family.
+    user = models.ForeignKey(StoreUser, on_delete=models.CASCADE, related_name='refresh_tokens')
+    token_hash = models.CharField(max_length=64, unique=True)
+    family = models.UUIDField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    used_at = models.DateTimeField(null=True, blank=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Refresh token {self.family} ({self.user_id})"
+
+class DailySales(TenantAwareModel):
+    # Sales rollup per tenant and day (store.analytics). Maintained
+    # incrementally as orders are placed and change status; cancelled orders
+    # don't count. `manage.py rebuild_sales_rollups` recomputes it.
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'day'], name='dailysales_tenant_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.tenant_id} {self.day}: {self.revenue}"
+
+class ProductDailySales(TenantAwareModel):
+    # Same rollup per tenant, day and product; `orders` counts the orders
+    # containing the product.
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'day', 'product'], name='productdailysales_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.day}: {self.units}"
+
+class ReplicaHeartbeat(models.Model):
+    # One row, rewritten on the primary every REPLICA_CHECK_INTERVAL; how far
+    # a replica's copy trails it is that replica's lag (store.replicas).
+    id = models.PositiveSmallIntegerField(primary_key=True, default=1)
+    written_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"heartbeat {self.written_at}"
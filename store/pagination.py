@@ -0,0 +1,135 @@
+import json
+import base64
+import datetime
+
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over (created_at, id), newest first.
+
+    Pages are fetched with `WHERE created_at <= c AND (created_at < c OR id < i)
+    ORDER BY created_at DESC, id DESC LIMIT n+1`, so page N costs the same as
+    page 1 and no COUNT(*) is ever run. Cursors are opaque base64 tokens.
+    Needs a (..., created_at, id) index matching the queryset's filter.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = settings.API_PAGE_SIZE
+        self.max_page_size = settings.API_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        return self.finish_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        return self.finish_page([row async for row in queryset])
+
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+        field, tiebreak = self.ordering
+
+        if self.cursor is None:
+            return queryset.order_by(f'-{field}', f'-{tiebreak}')[:self.page_size + 1]
+
+        value, pk, reverse = self.cursor
+        if reverse:
+            # Previous page: walk forward from the cursor, then flip the rows
+            queryset = queryset.filter(**{f'{field}__gte': value}).exclude(**{field: value, f'{tiebreak}__lte': pk})
+            return queryset.order_by(field, tiebreak)[:self.page_size + 1]
+        queryset = queryset.filter(**{f'{field}__lte': value}).exclude(**{field: value, f'{tiebreak}__gte': pk})
+        return queryset.order_by(f'-{field}', f'-{tiebreak}')[:self.page_size + 1]
+
+    def finish_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        reverse = bool(self.cursor and self.cursor[2])
+        if reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = self.cursor is not None, has_more
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def row_key(self, row):
+        # Rows are model instances, or dicts on the values() fast path
+        field, tiebreak = self.ordering
+        if isinstance(row, dict):
+            return row[field], row[tiebreak]
+        return getattr(row, field), getattr(row, tiebreak)
+
+    def encode_cursor(self, row, reverse):
+        value, pk = self.row_key(row)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        data = {'v': value, 'i': pk}
+        if reverse:
+            data['r'] = 1
+        raw = json.dumps(data, separators=(',', ':')).encode()
+        token = base64.urlsafe_b64encode(raw).decode().rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.GET.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            data = json.loads(raw)
+            return datetime.datetime.fromisoformat(data['v']), int(data['i']), bool(data.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # Walked back past the newest row, start over from the top
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
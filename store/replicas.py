@@ -0,0 +1,268 @@
+import math
+import time
+import itertools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections, transaction
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from . import metrics, response_cache
+
+# Read replicas. Each DATABASE_URI_REPLICA_<NAME> is a database alias
+# replica_<name> (config.settings). ReplicaRouter sends reads to one only
+# inside reading(), which ReplicaMiddleware opens for GET/HEAD on
+# REPLICA_VIEWS; everything else, and every write, uses the primary.
+#
+# Read-your-writes: a successful POST/PUT/PATCH/DELETE pins its user to the
+# primary for REPLICA_PIN_SECONDS, and a committed catalog write
+# (invalidate_catalog) pins that catalog for everyone, so the response cache
+# isn't refilled from a replica that hasn't caught up. Pins are keys in the
+# default cache, shared by every worker when it's Redis.
+#
+# Lag: the primary's ReplicaHeartbeat row is rewritten every
+# REPLICA_CHECK_INTERVAL seconds and compared with each replica's copy. A
+# replica more than REPLICA_MAX_LAG behind, or unreachable, is left out until
+# a later check finds it caught up; with none left, reads use the primary.
+
+# url_name -> the catalog (store.response_cache scope) whose writes pin it;
+# None: only the user's own writes matter
+REPLICA_VIEWS = {
+    'product-list': 'tenant',
+    'product-detail': 'tenant',
+    'tenant-list': 'global',
+    'tenant-detail': 'global',
+    'order-list': None,
+    'order-detail': None,
+}
+SAFE_METHODS = ('GET', 'HEAD')
+
+_reading = ContextVar('replica_reading', default=None)
+
+
+def enabled():
+    return bool(settings.DATABASE_REPLICAS)
+
+
+@contextmanager
+def reading(alias):
+    """Reads in the block go to the database `alias`, the primary if it's None."""
+    token = _reading.set(alias)
+    try:
+        yield alias
+    finally:
+        _reading.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _reading.get()
+        # A transaction on the primary reads what it may just have written
+        if alias is not None and connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Rows read from a replica are saved to the primary too
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+def pin_key(kind, value):
+    return f'replica:pin:{kind}:{value}'
+
+
+def pin_seconds():
+    # Shorter than the lag allowed, a pin could expire before the replica has the write
+    return math.ceil(max(settings.REPLICA_PIN_SECONDS, settings.REPLICA_MAX_LAG))
+
+
+def pin_catalog(scopes):
+    if enabled():
+        cache.set_many({pin_key('catalog', scope): 1 for scope in scopes}, pin_seconds())
+
+
+def pin_keys(request, tenant):
+    """The pins keeping this request on the primary, None if it never reads from a replica."""
+    if request.method not in SAFE_METHODS or not enabled():
+        return None
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None
+    if match.url_name not in REPLICA_VIEWS:
+        return None
+    keys = []
+    user = getattr(request, 'custom_user', None)
+    if user:
+        keys.append(pin_key('user', user.pk))
+    depends_on = REPLICA_VIEWS[match.url_name]
+    if depends_on:
+        keys.append(pin_key('catalog', response_cache.catalog_scope(request, tenant, depends_on)))
+    return keys
+
+
+def wrote(request, response):
+    """The user whose write `response` answers, None for anything else."""
+    user = getattr(request, 'custom_user', None)
+    if request.method in SAFE_METHODS or not user or response.status_code >= 400 or not enabled():
+        return None
+    return user.pk
+
+
+def replica_for(request, tenant):
+    """The replica alias to read `request`'s data from, None for the primary."""
+    keys = pin_keys(request, tenant)
+    if keys is None:
+        return None
+    if cache.get_many(keys):
+        pool.pinned += 1
+        return None
+    if pool.due():
+        pool.check()
+    return pool.choose()
+
+
+async def areplica_for(request, tenant):
+    keys = pin_keys(request, tenant)
+    if keys is None:
+        return None
+    if await cache.aget_many(keys):
+        pool.pinned += 1
+        return None
+    if pool.due():
+        await sync_to_async(pool.check)()
+    return pool.choose()
+
+
+def remember_write(request, response):
+    user_id = wrote(request, response)
+    if user_id is not None:
+        cache.set(pin_key('user', user_id), 1, pin_seconds())
+
+
+async def aremember_write(request, response):
+    user_id = wrote(request, response)
+    if user_id is not None:
+        await cache.aset(pin_key('user', user_id), 1, pin_seconds())
+
+
+def heartbeat(alias):
+    """When the primary wrote the heartbeat as `alias` has it, None if there's none yet."""
+    ReplicaHeartbeat = apps.get_model('store', 'ReplicaHeartbeat')
+    return ReplicaHeartbeat.objects.using(alias).filter(pk=1).values_list('written_at', flat=True).first()
+
+
+def beat(now):
+    ReplicaHeartbeat = apps.get_model('store', 'ReplicaHeartbeat')
+    if ReplicaHeartbeat.objects.filter(pk=1).update(written_at=now):
+        return
+    try:
+        with transaction.atomic():
+            ReplicaHeartbeat.objects.create(pk=1, written_at=now)
+    except IntegrityError:
+        # Another process wrote the first one
+        pass
+
+
+def measure(aliases):
+    """{alias: {'lag': seconds behind the primary or None if unknown, 'error'}}, beating the primary when due."""
+    now = timezone.now()
+    try:
+        written = heartbeat(DEFAULT_DB_ALIAS)
+        if written is None or (now - written).total_seconds() >= settings.REPLICA_CHECK_INTERVAL:
+            beat(now)
+    except DatabaseError as e:
+        return {alias: {'lag': None, 'error': f'primary: {e}'} for alias in aliases}
+
+    # Replicas are compared with the beat they've had time to receive
+    state = {}
+    for alias in aliases:
+        try:
+            seen = heartbeat(alias)
+        except DatabaseError as e:
+            state[alias] = {'lag': None, 'error': str(e)}
+            continue
+        if written is None or seen is None:
+            # Measurable from the next check
+            state[alias] = {'lag': None, 'error': 'no heartbeat yet'}
+        else:
+            state[alias] = {'lag': max((written - seen).total_seconds(), 0.0), 'error': None}
+    return state
+
+
+class ReplicaPool:
+    """
+    Which replicas are fit to read from. The first request after
+    REPLICA_CHECK_INTERVAL measures them again; others meanwhile keep using
+    the last result.
+    """
+
+    def __init__(self):
+        self.state = {}
+        self.checked_at = None
+        self.reads = Counter()
+        self.pinned = 0
+        self.fallbacks = 0
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def due(self):
+        return self.checked_at is None or time.monotonic() - self.checked_at >= settings.REPLICA_CHECK_INTERVAL
+
+    def check(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self.due():
+                self.state = measure(settings.DATABASE_REPLICAS)
+                self.checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def healthy(self):
+        return [
+            alias for alias in settings.DATABASE_REPLICAS
+            if alias in self.state and self.state[alias]['lag'] is not None
+            and self.state[alias]['lag'] <= settings.REPLICA_MAX_LAG
+        ]
+
+    def choose(self):
+        """The next healthy replica in turn, None when there's none."""
+        healthy = self.healthy()
+        if not healthy:
+            self.fallbacks += 1
+            return None
+        alias = healthy[next(self._turn) % len(healthy)]
+        self.reads[alias] += 1
+        return alias
+
+    def stats(self):
+        return {
+            'replicas': {
+                alias: {**self.state.get(alias, {'lag': None, 'error': 'not checked yet'}), 'reads': self.reads[alias]}
+                for alias in settings.DATABASE_REPLICAS
+            },
+            'pinned': self.pinned,
+            'fallbacks': self.fallbacks,
+        }
+
+
+pool = ReplicaPool()
+metrics.register('replicas', lambda: pool.stats())
@@ -0,0 +1,508 @@
+import time
+import uuid
+import logging
+import datetime
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import metrics
+from .models import Product, OrderItem
+from .response_cache import invalidate_catalog
+
+logger = logging.getLogger(__name__)
+
+# Flash-sale stock reservations. The stock of an enrolled product is fronted
+# by counters outside the database:
+#
+#   POST /api/reservations/ {product_id, quantity}  -> a hold for RESERVATION_TTL seconds, 409 if sold out
+#   POST /api/orders/ {items, holds: [id, ...]}      -> orders from the customer's holds
+#
+# Adding to the cart, and turning buyers away once it's gone, never touches
+# the database; checking out an enrolled product inserts its order rows with
+# OrderItem.stock_pending set instead of taking the product row lock. sync()
+# (a background thread, or `manage.py sync_reservations`) releases expired
+# holds, applies pending items to Product.stock in bulk and reconciles
+#
+#   available + held == Product.stock - pending items
+#
+# so stock edited through the API or an import reaches the counters too.
+#
+# RESERVATION_BACKEND picks where the counters live: 'redis' is the server at
+# RESERVATION_REDIS_URL, shared by every process; 'local' is LocalStore, an
+# in-process stand-in answering the same commands, for one process,
+# development and tests. Empty turns reservations off. Only plain commands in
+# MULTI blocks are used, no scripts: a hold decrements first and gives the
+# units back if that went below zero, and whoever wins HSETNX on a hold's
+# `owner` field is the only one to release or sell it.
+
+BACKENDS = ('local', 'redis')
+
+
+class NotReserved(Exception):
+    """The product's stock isn't reserved here."""
+
+
+class Unavailable(Exception):
+    """Not enough stock left to hold for the product (args[0], its id)."""
+
+
+class LocalStore:
+    """
+    The subset of redis-py's client (decode_responses=True) used here, kept
+    in this process's memory. Commands are atomic, and a pipeline runs as a
+    MULTI block does.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+    def _get(self, name, kind):
+        value = self._data.get(name)
+        if value is None:
+            value = self._data[name] = kind()
+        return value
+
+    def get(self, name):
+        with self._lock:
+            value = self._data.get(name)
+            return None if value is None else str(value)
+
+    def set(self, name, value, nx=False):
+        with self._lock:
+            if nx and name in self._data:
+                return None
+            self._data[name] = str(value)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def incrby(self, name, amount=1):
+        with self._lock:
+            value = int(self._data.get(name, 0)) + amount
+            self._data[name] = str(value)
+            return value
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._lock:
+            fields = dict(mapping or {})
+            if key is not None:
+                fields[key] = value
+            record = self._get(name, dict)
+            added = sum(field not in record for field in fields)
+            record.update((field, str(value)) for field, value in fields.items())
+            return added
+
+    def hsetnx(self, name, key, value):
+        with self._lock:
+            record = self._get(name, dict)
+            if key in record:
+                return 0
+            record[key] = str(value)
+            return 1
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data.get(name) or {})
+
+    def sadd(self, name, *values):
+        with self._lock:
+            members = self._get(name, set)
+            added = {str(value) for value in values} - members
+            members |= added
+            return len(added)
+
+    def srem(self, name, *values):
+        with self._lock:
+            members = self._data.get(name) or set()
+            removed = {str(value) for value in values} & members
+            members -= removed
+            return len(removed)
+
+    def sismember(self, name, value):
+        with self._lock:
+            return str(value) in (self._data.get(name) or ())
+
+    def smembers(self, name):
+        with self._lock:
+            return set(self._data.get(name) or ())
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            scores = self._get(name, dict)
+            added = sum(str(member) not in scores for member in mapping)
+            scores.update((str(member), float(score)) for member, score in mapping.items())
+            return added
+
+    def zrem(self, name, *values):
+        with self._lock:
+            scores = self._data.get(name) or {}
+            return sum(scores.pop(str(value), None) is not None for value in values)
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._data.get(name) or ())
+
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        low, high = float(min), float(max)
+        with self._lock:
+            scores = self._data.get(name) or {}
+            members = sorted((score, member) for member, score in scores.items() if low <= score <= high)
+        members = [member for score, member in members]
+        if start is not None:
+            members = members[start:start + num]
+        return members
+
+
+class LocalPipeline:
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+
+    def __getattr__(self, command):
+        method = getattr(self.store, command)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.store._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+class Reservations:
+    """Holds and counters for enrolled products, on a Redis-style client."""
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+
+    def key(self, *parts):
+        return ':'.join([self.prefix, *map(str, parts)])
+
+    def products(self):
+        return {int(product_id) for product_id in self.client.smembers(self.key('products'))}
+
+    def enrolled(self, product_ids):
+        """The ids among `product_ids` whose stock is reserved here."""
+        return self.products() & set(product_ids) if product_ids else set()
+
+    def enroll(self, product_id):
+        """Start reserving the product's stock; reconcile() then fills its counter."""
+        pipe = self.client.pipeline()
+        pipe.set(self.key('available', product_id), 0, nx=True)
+        pipe.set(self.key('held', product_id), 0, nx=True)
+        pipe.sadd(self.key('products'), product_id)
+        pipe.execute()
+
+    def unenroll(self, product_id):
+        # Counters are left alone, a later enroll() reconciles them; holds
+        # still out expire as usual
+        self.client.srem(self.key('products'), product_id)
+
+    def counters(self, product_ids):
+        """{product_id: (available, held)}, read in one MULTI."""
+        pipe = self.client.pipeline()
+        for product_id in product_ids:
+            pipe.get(self.key('available', product_id))
+            pipe.get(self.key('held', product_id))
+        values = [int(value or 0) for value in pipe.execute()]
+        return {product_id: (values[i * 2], values[i * 2 + 1]) for i, product_id in enumerate(product_ids)}
+
+    def hold(self, customer_id, product_id, quantity, ttl):
+        """
+        Take `quantity` units out of the product's available stock for `ttl`
+        seconds. Returns the hold, None when there aren't that many left.
+        """
+        if not self.client.sismember(self.key('products'), product_id):
+            raise NotReserved(product_id)
+        hold_id = uuid.uuid4().hex
+        expires = time.time() + ttl
+        available, held, record = self.key('available', product_id), self.key('held', product_id), self.key('hold', hold_id)
+        pipe = self.client.pipeline()
+        pipe.incrby(available, -quantity)
+        pipe.incrby(held, quantity)
+        pipe.hset(record, mapping={'product': product_id, 'customer': customer_id, 'quantity': quantity, 'expires': expires})
+        pipe.zadd(self.key('expiry'), {hold_id: expires})
+        if pipe.execute()[0] < 0:
+            # Oversubscribed: give them back. Holds racing this one may have
+            # been refused while the counter was short, they can retry.
+            self._finish(hold_id, product_id, quantity, returned=quantity)
+            return None
+        return self.describe(hold_id, {'product': product_id, 'quantity': quantity, 'expires': expires})
+
+    def describe(self, hold_id, record):
+        return {
+            'id': hold_id,
+            'product_id': int(record['product']),
+            'quantity': int(record['quantity']),
+            'expires_at': datetime.datetime.fromtimestamp(float(record['expires']), tz=datetime.timezone.utc),
+        }
+
+    def get(self, hold_id, customer_id):
+        record = self.client.hgetall(self.key('hold', hold_id))
+        if not record or int(record['customer']) != customer_id or 'owner' in record:
+            return None
+        return self.describe(hold_id, record)
+
+    def _own(self, hold_id, owner):
+        """(won, record): HSETNX of the owner field, the first caller wins."""
+        record_key = self.key('hold', hold_id)
+        pipe = self.client.pipeline()
+        pipe.hsetnx(record_key, 'owner', f'{owner}:{time.time()}')
+        pipe.hgetall(record_key)
+        won, record = pipe.execute()
+        if 'product' not in record:
+            # Already finished; HSETNX made an empty hash of it
+            if won:
+                self.client.delete(record_key)
+            return False, None
+        return bool(won), record
+
+    def _finish(self, hold_id, product_id, quantity, returned):
+        """
+        End the hold: its units leave `held`, `returned` of them go back to
+        available. Only whoever deletes the record moves the counters; a crash
+        in between leaves them held, undersold rather than oversold.
+        """
+        if not self.client.delete(self.key('hold', hold_id)):
+            return False
+        pipe = self.client.pipeline()
+        pipe.incrby(self.key('held', product_id), -quantity)
+        if returned:
+            pipe.incrby(self.key('available', product_id), returned)
+        pipe.zrem(self.key('expiry'), hold_id)
+        pipe.execute()
+        return True
+
+    def release(self, hold_id, customer_id):
+        """Give a customer's hold back. False if there is no such hold (anymore)."""
+        record = self.client.hgetall(self.key('hold', hold_id))
+        if not record or int(record['customer']) != customer_id:
+            return False
+        won, record = self._own(hold_id, 'release')
+        if not won:
+            return False
+        self._finish(hold_id, record['product'], int(record['quantity']), returned=int(record['quantity']))
+        return True
+
+    def acquire(self, customer_id, quantities, hold_ids=()):
+        """
+        Claim stock for a checkout of `quantities` ({product_id: quantity},
+        enrolled products only): the customer's holds first, fresh holds for
+        the rest. Returns the claims to settle() once the orders are
+        committed, or abort() if they aren't. Raises Unavailable.
+        """
+        need = dict(quantities)
+        claims = []
+        try:
+            for hold_id in dict.fromkeys(hold_ids):
+                record = self.client.hgetall(self.key('hold', hold_id))
+                if (not record or 'owner' in record or int(record['customer']) != customer_id
+                        or need.get(int(record['product']), 0) <= 0):
+                    continue
+                won, record = self._own(hold_id, 'checkout')
+                if won:
+                    # An expired hold not yet released still counts, its units are still held
+                    used = min(int(record['quantity']), need[int(record['product'])])
+                    need[int(record['product'])] -= used
+                    claims.append((hold_id, record, used))
+            for product_id, quantity in need.items():
+                if quantity <= 0:
+                    continue
+                hold = self.hold(customer_id, product_id, quantity, settings.RESERVATION_CLAIM_TIMEOUT)
+                if hold is None:
+                    raise Unavailable(product_id)
+                won, record = self._own(hold['id'], 'checkout')
+                claims.append((hold['id'], record, quantity))
+        except BaseException:
+            self.abort(claims)
+            raise
+        return claims
+
+    def settle(self, claims):
+        """The orders for `claims` are committed: their units are sold, any surplus goes back."""
+        for hold_id, record, used in claims:
+            quantity = int(record['quantity'])
+            self._finish(hold_id, record['product'], quantity, returned=quantity - used)
+
+    def abort(self, claims):
+        for hold_id, record, used in claims:
+            self._finish(hold_id, record['product'], int(record['quantity']), returned=int(record['quantity']))
+
+    def reap(self, now=None, limit=1000):
+        """
+        Release holds past their expiry. A checkout's claim left over by a
+        crash is dropped without returning its units, reconcile() gives them
+        back if no order was committed. Returns how many holds were released.
+        """
+        now = now or time.time()
+        released = 0
+        for hold_id in self.client.zrangebyscore(self.key('expiry'), '-inf', now, start=0, num=limit):
+            won, record = self._own(hold_id, 'expired')
+            if record is None:
+                self.client.zrem(self.key('expiry'), hold_id)
+                continue
+            quantity = int(record['quantity'])
+            if won:
+                self._finish(hold_id, record['product'], quantity, returned=quantity)
+                released += 1
+                continue
+            # Owned by someone; only step in if they've been gone too long
+            owner, _, since = record['owner'].rpartition(':')
+            if now - float(since) < settings.RESERVATION_CLAIM_TIMEOUT:
+                continue
+            self._finish(hold_id, record['product'], quantity, returned=0 if owner == 'checkout' else quantity)
+            released += 1
+        return released
+
+    def stats(self):
+        return {
+            'backend': settings.RESERVATION_BACKEND,
+            'products': len(self.products()),
+            'holds': self.client.zcard(self.key('expiry')),
+        }
+
+
+def flush():
+    """Take pending order items out of Product.stock. Returns the units applied."""
+    with transaction.atomic():
+        rows = list(
+            OrderItem.objects.filter(stock_pending=True).select_for_update(skip_locked=True)
+            .values_list('id', 'product_id', 'quantity')
+        )
+        if not rows:
+            return 0
+        quantities = {}
+        for _, product_id, quantity in rows:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        for product_id, quantity in quantities.items():
+            Product.all_objects.filter(id=product_id).update(stock=F('stock') - quantity)
+        OrderItem.objects.filter(id__in=[row[0] for row in rows]).update(stock_pending=False)
+        tenants = set(Product.all_objects.filter(id__in=list(quantities)).values_list('tenant_id', flat=True))
+        invalidate_catalog(*tenants)
+    return sum(quantities.values())
+
+
+def reconcile(engine, product_ids=None):
+    """
+    Move available counters to Product.stock - pending - held. Returns
+    {product_id: correction} for the ones that were off.
+    """
+    product_ids = sorted(engine.products() if product_ids is None else product_ids)
+    if not product_ids:
+        return {}
+    # Read in the order units flow (available -> held -> pending -> stock),
+    # so a unit moving meanwhile is counted twice rather than missed: a
+    # correction may briefly undersell, never oversell.
+    counters = engine.counters(product_ids)
+    pending = dict(
+        OrderItem.objects.filter(stock_pending=True, product_id__in=product_ids)
+        .values('product_id').annotate(quantity=Sum('quantity')).values_list('product_id', 'quantity')
+    )
+    stock = dict(Product.all_objects.filter(id__in=product_ids).values_list('id', 'stock'))
+    corrections = {}
+    for product_id in product_ids:
+        if product_id not in stock:
+            engine.unenroll(product_id)
+            continue
+        available, held = counters[product_id]
+        correction = stock[product_id] - pending.get(product_id, 0) - held - available
+        if correction:
+            engine.client.incrby(engine.key('available', product_id), correction)
+            corrections[product_id] = correction
+    return corrections
+
+
+def sync(engine):
+    """Release expired holds, apply pending stock and reconcile; what the worker runs."""
+    return {
+        'released': engine.reap(),
+        'flushed': flush(),
+        'corrected': len(reconcile(engine)),
+        'at': timezone.now(),
+    }
+
+
+def enabled():
+    return bool(settings.RESERVATION_BACKEND)
+
+
+def connect():
+    backend = settings.RESERVATION_BACKEND
+    if backend == 'local':
+        return LocalStore()
+    if backend == 'redis':
+        if not settings.RESERVATION_REDIS_URL:
+            raise ImproperlyConfigured('RESERVATION_BACKEND=redis needs RESERVATION_REDIS_URL or REDIS_URL.')
+        import redis
+        return redis.Redis.from_url(settings.RESERVATION_REDIS_URL, decode_responses=True)
+    raise ImproperlyConfigured(f'RESERVATION_BACKEND must be one of: {", ".join(BACKENDS)}; got {backend!r}.')
+
+
+class Syncer(threading.Thread):
+    """sync() every `interval` seconds in this process, for the local backend."""
+
+    def __init__(self, engine, interval):
+        super().__init__(name='reservations-sync', daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.last = None
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                self.last = sync(self.engine)
+            except Exception:
+                logger.exception('Reservation sync failed')
+            finally:
+                close_old_connections()
+
+
+_engine = None
+_syncer = None
+_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine, _syncer
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                engine = Reservations(connect(), settings.RESERVATION_PREFIX)
+                # Only this process sees local counters, so it syncs them itself
+                if settings.RESERVATION_BACKEND == 'local' and settings.RESERVATION_SYNC_INTERVAL:
+                    _syncer = Syncer(engine, settings.RESERVATION_SYNC_INTERVAL)
+                    _syncer.start()
+                _engine = engine
+    return _engine
+
+
+def stats():
+    if not enabled() or _engine is None:
+        return {'backend': settings.RESERVATION_BACKEND or None}
+    return {**_engine.stats(), 'last_sync': _syncer.last if _syncer else None}
+
+
+metrics.register('reservations', stats)
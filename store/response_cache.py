@@ -0,0 +1,173 @@
+import time
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, urlencode
+
+from . import metrics, replicas
+
+# Shared response cache for public catalog reads. Entries are keyed by
+# (catalog generation, scheme, host, path, sorted query); a write bumps the
+# generation so old entries are simply never looked up again and age out.
+# The ETag is derived from the same key, so a matching If-None-Match gets a
+# 304 without touching the database or even the cached body.
+
+# url_name -> whose generation the response depends on. 'tenant' responses
+# fall back to the marketplace-wide generation when no tenant is resolved.
+# 'search' is 'tenant' unless ?scope=marketplace, which only search reads:
+# anywhere else the param must not move a tenant's page to the global key.
+CACHEABLE_VIEWS = {
+    'product-list': 'tenant',
+    'product-detail': 'tenant',
+    'product-search': 'search',
+    'tenant-list': 'global',
+    'tenant-detail': 'global',
+}
+GLOBAL = 'all'
+
+# Responses vary on these through TenantMiddleware
+VARY_HEADERS = ('Authorization', 'X-Tenant-ID')
+
+stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'stores': 0, 'invalidations': 0}
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def generation_key(scope):
+    return f'catalog:gen:{scope}'
+
+
+def initial_generation():
+    # Never restart at 1 when a generation key is evicted, or entries cached
+    # under the old numbers could come back to life
+    return time.time_ns()
+
+
+def _bump(scopes):
+    cache = get_cache()
+    for scope in scopes:
+        try:
+            cache.incr(generation_key(scope))
+        except ValueError:
+            cache.add(generation_key(scope), initial_generation(), timeout=None)
+    stats['invalidations'] += 1
+
+
+def invalidate_catalog(*tenant_ids):
+    """
+    Expire cached catalog responses for these tenants and the marketplace.
+    Bumped now so the current transaction reads its own writes, and again on
+    commit so a response cached from pre-commit data in between is dropped.
+    Replica reads of the catalog stop until replicas have the write.
+    """
+    scopes = {str(t) for t in tenant_ids if t is not None} | {GLOBAL}
+    _bump(scopes)
+    # Pinned first, or a lagging replica could fill the new generation
+    transaction.on_commit(lambda: (replicas.pin_catalog(scopes), _bump(scopes)))
+
+
+def get_generation(scope):
+    cache = get_cache()
+    generation = cache.get(generation_key(scope))
+    if generation is None:
+        cache.add(generation_key(scope), initial_generation(), timeout=None)
+        generation = cache.get(generation_key(scope))
+    return generation
+
+
+async def aget_generation(scope):
+    cache = get_cache()
+    generation = await cache.aget(generation_key(scope))
+    if generation is None:
+        await cache.aadd(generation_key(scope), initial_generation(), timeout=None)
+        generation = await cache.aget(generation_key(scope))
+    return generation
+
+
+def request_scope(request, tenant):
+    if request.method not in ('GET', 'HEAD') or not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    # The browsable API renders per user (login state, forms)
+    if request.GET.get('format') == 'api' or 'text/html' in request.headers.get('Accept', ''):
+        return None
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None
+    depends_on = CACHEABLE_VIEWS.get(match.url_name)
+    if depends_on is None:
+        return None
+    return catalog_scope(request, tenant, depends_on)
+
+
+def catalog_scope(request, tenant, depends_on):
+    if depends_on == 'search' and request.GET.get('scope') == 'marketplace':
+        return GLOBAL
+    if depends_on in ('tenant', 'search') and tenant is not None:
+        return str(tenant.pk)
+    return GLOBAL
+
+
+def entry_key(request, scope, generation):
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    raw = f'{scope}|{generation}|{request.scheme}|{request.get_host()}|{request.path}|{query}'
+    return 'catalog:resp:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def etag_for(key):
+    return '"%s"' % key.rsplit(':', 1)[1][:32]
+
+
+def is_not_modified(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags
+
+
+def not_modified(etag):
+    stats['not_modified'] += 1
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    patch_vary_headers(response, VARY_HEADERS)
+    return response
+
+
+def from_entry(entry, etag):
+    stats['hits'] += 1
+    status, content_type, content = entry
+    response = HttpResponse(content, status=status, content_type=content_type)
+    response['ETag'] = etag
+    response['X-Cache'] = 'HIT'
+    patch_vary_headers(response, VARY_HEADERS)
+    return response
+
+
+def storable(request, response):
+    return (request.method == 'GET' and response.status_code == 200
+            and not response.streaming and not response.has_header('Set-Cookie'))
+
+
+def to_entry(response, etag):
+    stats['stores'] += 1
+    response['ETag'] = etag
+    response['X-Cache'] = 'MISS'
+    patch_vary_headers(response, VARY_HEADERS)
+    return response.status_code, response['Content-Type'], response.content
+
+
+def get_stats():
+    looked_up = stats['hits'] + stats['not_modified'] + stats['misses']
+    served = stats['hits'] + stats['not_modified']
+    return dict(stats, hit_ratio=served / looked_up if looked_up else 0.0)
+
+
+metrics.register('response_cache', get_stats)
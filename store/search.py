@@ -0,0 +1,168 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections
+from django.db.models import BooleanField, Count, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import ValidationError
+
+# Full-text product search. PostgreSQL uses a GIN index over a weighted
+# tsvector expression, SQLite an FTS5 external-content table kept in sync by
+# triggers (both created in migration 0004). Anything else falls back to
+# icontains with no ranking.
+
+# Must stay identical to the indexed expression in migration 0004
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(\"store_product\".\"name\", '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(\"store_product\".\"description\", '')), 'B')"
+)
+PG_QUERY = "websearch_to_tsquery('english', %s)"
+
+SQLITE_FTS_TABLE = 'store_product_fts'
+
+# Upper bounds of the price facet buckets; the last bucket is open ended
+PRICE_BUCKETS = (10, 25, 50, 100, 250)
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts_tables = {}
+
+
+def fts_available(using='default'):
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    if connection.settings_dict['NAME'] not in _fts_tables:
+        # The migration skips the FTS table when SQLite lacks FTS5
+        with connection.cursor() as cursor:
+            _fts_tables[connection.settings_dict['NAME']] = SQLITE_FTS_TABLE in connection.introspection.table_names(cursor)
+    return _fts_tables[connection.settings_dict['NAME']]
+
+
+def fts5_query(text):
+    # Quote every word so user input can't use FTS5 query syntax; words are ANDed
+    return ' '.join('"%s"' % word for word in _WORD_RE.findall(text))
+
+
+def match(queryset, text):
+    """Filter `queryset` to products matching `text`."""
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql':
+        return queryset.filter(RawSQL(f"({PG_DOCUMENT}) @@ {PG_QUERY}", [text], output_field=BooleanField()))
+
+    if connection.vendor == 'sqlite' and fts_available(queryset.db):
+        query = fts5_query(text)
+        if not query:
+            return queryset.none()
+        return queryset.filter(RawSQL(
+            f'"store_product"."id" IN (SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s)',
+            [query], output_field=BooleanField(),
+        ))
+
+    condition = Q()
+    for word in _WORD_RE.findall(text):
+        condition &= Q(name__icontains=word) | Q(description__icontains=word)
+    return queryset.filter(condition)
+
+
+def rank(queryset, text):
+    """Annotate matched products with `rank`, higher is better."""
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql':
+        return queryset.annotate(
+            rank=RawSQL(f"ts_rank({PG_DOCUMENT}, {PG_QUERY})", [text], output_field=FloatField())
+        )
+
+    if connection.vendor == 'sqlite' and fts_available(queryset.db):
+        # bm25() is lower-is-better, name weighted over description
+        return queryset.annotate(rank=RawSQL(
+            f'(SELECT -bm25({SQLITE_FTS_TABLE}, 10.0, 1.0) FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid = "store_product"."id")',
+            [fts5_query(text)], output_field=FloatField(),
+        ))
+
+    return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def parse_filters(params):
+    """Validate the category / min_price / max_price / in_stock query params."""
+    filters = {}
+    errors = {}
+
+    categories = [c for c in params.get('category', '').split(',') if c]
+    if categories:
+        filters['category'] = categories
+
+    for name in ('min_price', 'max_price'):
+        raw = params.get(name)
+        if raw in (None, ''):
+            continue
+        try:
+            value = Decimal(raw)
+        except InvalidOperation:
+            errors[name] = ['A valid number is required.']
+            continue
+        if not value.is_finite() or value < 0:
+            errors[name] = ['A valid number is required.']
+            continue
+        filters[name] = value
+
+    in_stock = params.get('in_stock')
+    if in_stock not in (None, ''):
+        if in_stock.lower() not in ('true', 'false', '1', '0'):
+            errors['in_stock'] = ['Must be true or false.']
+        elif in_stock.lower() in ('true', '1'):
+            filters['in_stock'] = True
+
+    if errors:
+        raise ValidationError(errors)
+    return filters
+
+
+def apply_filters(queryset, filters, skip=()):
+    if 'category' in filters and 'category' not in skip:
+        queryset = queryset.filter(category__in=filters['category'])
+    if 'price' not in skip:
+        if 'min_price' in filters:
+            queryset = queryset.filter(price__gte=filters['min_price'])
+        if 'max_price' in filters:
+            queryset = queryset.filter(price__lte=filters['max_price'])
+    if filters.get('in_stock'):
+        queryset = queryset.filter(stock__gt=0)
+    return queryset
+
+
+def facets(matched, filters):
+    """
+    Category histogram and price buckets, each one aggregate query. A facet
+    ignores its own filter, so the counts show what selecting another
+    category / price range would return.
+    """
+    categories = (
+        apply_filters(matched, filters, skip=('category',))
+        .order_by()
+        .values('category')
+        .annotate(count=Count('id'))
+        .order_by('-count', 'category')
+    )
+
+    bounds = (0,) + PRICE_BUCKETS + (None,)
+    aggregates = {}
+    for i, (low, high) in enumerate(zip(bounds, bounds[1:])):
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'bucket_{i}'] = Count('id', filter=condition)
+    counts = apply_filters(matched, filters, skip=('price',)).order_by().aggregate(**aggregates)
+
+    return {
+        'category': [{'value': row['category'], 'count': row['count']} for row in categories],
+        'price': [
+            {'min': low, 'max': high, 'count': counts[f'bucket_{i}']}
+            for i, (low, high) in enumerate(zip(bounds, bounds[1:]))
+        ],
+    }
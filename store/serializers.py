@@ -1,8 +1,46 @@
+import base64
+
+from django.conf import settings
 from rest_framework import serializers
-from .models import Tenant, StoreUser, Product, Order, OrderItem
+from .models import Tenant, StoreUser, Product, Order, OrderItem, Checkout
 from .authentication import hash_pass
+from .checkout import placed_orders
+from . import images, uploads
+
+class SparseFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Takes `fields=` (field names) to drop every other field, see
+    store.fieldsets. `presets` are named field sets for ?fields=.
+    """
+    presets = {}
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class ImageVariantsField(serializers.Field):
+    """URLs of the resized copies of `image_field` (see store.images), null until they exist."""
+
+    def __init__(self, image_field, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.image_field = image_field
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        storage = self.parent.Meta.model._meta.get_field(self.image_field).storage
+        return images.variant_urls(value, storage, request.build_absolute_uri if request is not None else str)
+
+class TenantSerializer(SparseFieldsModelSerializer):
+    logo_variants = ImageVariantsField('logo')
+    presets = {
+        'card': ('id', 'name', 'logo', 'logo_variants'),
+        'detail': None,
+    }
 
-class TenantSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tenant
         fields = '__all__'
@@ -30,30 +68,96 @@ class RegisterSerializer(serializers.ModelSerializer):
         )
         return user
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsModelSerializer):
+    image_variants = ImageVariantsField('image')
+    presets = {
+        # What ProductCard needs; no description
+        'card': ('id', 'tenant', 'name', 'price', 'image', 'image_variants', 'stock'),
+        'detail': None,
+    }
+
     class Meta:
         model = Product
         fields = '__all__'
         read_only_fields = ('tenant',)
+        # The (tenant, sku) constraint is checked in validate_sku, tenant is read-only here
+        validators = []
 
-class OrderItemSerializer(serializers.ModelSerializer):
-    product_name = serializers.ReadOnlyField(source='product.name')
+    def validate_sku(self, value):
+        value = value.strip() if value else None  # blank means no SKU
+        if value:
+            request = self.context.get('request')
+            user = getattr(request, 'custom_user', None)
+            tenant_id = self.instance.tenant_id if self.instance else getattr(user, 'tenant_id', None)
+            clash = Product.all_objects.filter(tenant_id=tenant_id, sku=value)
+            if self.instance:
+                clash = clash.exclude(pk=self.instance.pk)
+            if tenant_id and clash.exists():
+                raise serializers.ValidationError('A product with this sku already exists in your store.')
+        return value
 
+class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
+        # product_name is the snapshot taken at order time, not a join on product
         fields = ('product', 'quantity', 'price', 'product_name')
+        read_only_fields = ('product_name',)
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
+    presets = {
+        'card': ('id', 'status', 'total_amount', 'created_at'),
+        'detail': None,
+    }
 
     class Meta:
         model = Order
         fields = '__all__'
-        read_only_fields = ('tenant', 'customer', 'total_amount', 'created_at')
+        read_only_fields = ('tenant', 'customer', 'checkout', 'total_amount', 'created_at')
 
 class OrderItemInputSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
-    quantity = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
 
 class PlaceOrderSerializer(serializers.Serializer):
     items = OrderItemInputSerializer(many=True)
+    # Reservation ids (store.reservations) to check out
+    holds = serializers.ListField(child=serializers.CharField(max_length=64), required=False, default=list)
+
+class ReservationSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+class CheckoutSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(view_name='checkout-detail')
+    orders = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Checkout
+        fields = ('id', 'url', 'status', 'error', 'created_at', 'processed_at', 'orders')
+
+    def get_orders(self, checkout):
+        if checkout.status != 'DONE':
+            return []
+        return OrderSerializer(placed_orders(checkout), many=True).data
+
+class DirectUploadSerializer(serializers.Serializer):
+    content_type = serializers.ChoiceField(choices=list(uploads.CONTENT_TYPES))
+    size = serializers.IntegerField(min_value=1)
+    md5 = serializers.CharField(help_text='Base64 MD5 of the bytes, as in a Content-MD5 header')
+
+    def validate_size(self, value):
+        if value > settings.UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(f'Ensure this value is less than or equal to {settings.UPLOAD_MAX_BYTES}.')
+        return value
+
+    def validate_md5(self, value):
+        try:
+            if len(base64.b64decode(value, validate=True)) == 16:
+                return value
+        except ValueError:
+            pass
+        raise serializers.ValidationError('Expected a base64 encoded MD5 digest.')
+
+class FinalizeUploadSerializer(serializers.Serializer):
+    token = serializers.CharField()
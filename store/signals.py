@@ -0,0 +1,100 @@
+from django.db import connection, transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.db.models import F
+from django.dispatch import receiver
+
+from .models import StoreUser, Tenant, Product, Order
+from .authentication import DELETED, principal_cache, set_token_version
+from .tenant_registry import tenant_registry
+from .response_cache import invalidate_catalog
+from . import analytics, images
+
+
+# Claims carried by issued tokens (store.authentication.create_token)
+TOKEN_CLAIMS = ('username', 'role', 'tenant_id')
+
+
+@receiver(pre_save, sender=StoreUser)
+def note_changed_claims(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._claims_changed = False
+    if raw or instance._state.adding or (update_fields is not None and not set(TOKEN_CLAIMS) & set(update_fields)):
+        return
+    old = StoreUser.objects.filter(pk=instance.pk).values_list(*TOKEN_CLAIMS).first()
+    instance._claims_changed = old is not None and old != tuple(getattr(instance, f) for f in TOKEN_CLAIMS)
+
+
+@receiver([post_save, post_delete], sender=StoreUser)
+def invalidate_user_principals(sender, instance, **kwargs):
+    principal_cache.delete_where(lambda key, user: key[0] == instance.pk)
+    if kwargs['signal'] is post_delete:
+        set_token_version(instance.pk, DELETED)
+    elif kwargs.get('created'):
+        set_token_version(instance.pk, instance.token_version)
+    elif getattr(instance, '_claims_changed', False):
+        # Revokes the tokens with the old claims, in every process (the column is shared)
+        StoreUser.objects.filter(pk=instance.pk).update(token_version=F('token_version') + 1)
+        instance.token_version = StoreUser.objects.filter(pk=instance.pk).values_list('token_version', flat=True).get()
+        set_token_version(instance.pk, instance.token_version)
+        instance._claims_changed = False
+
+
+@receiver([post_save, post_delete], sender=Tenant)
+def invalidate_tenant_principals(sender, instance, **kwargs):
+    principal_cache.delete_where(lambda key, user: user.tenant_id == instance.pk)
+    # Applied once committed: a rolled back tenant must not resolve
+    if kwargs['signal'] is post_delete:
+        tenant_id = instance.pk  # None by the time delete() returns
+        transaction.on_commit(lambda: tenant_registry.discard(tenant_id))
+    else:
+        transaction.on_commit(lambda: tenant_registry.update(instance))
+    invalidate_catalog(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_responses(sender, instance, **kwargs):
+    invalidate_catalog(instance.tenant_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Tenant)
+def queue_image_variants(sender, instance, **kwargs):
+    image_field, variants_field = images.SOURCES[sender]
+    name = getattr(instance, image_field).name
+    if name and (getattr(instance, variants_field) or {}).get('source') != name:
+        # After commit, so the worker sees the row and the uploaded file
+        transaction.on_commit(lambda: images.variant_pool.submit(sender, instance.pk))
+
+
+# Sales rollups follow order status changes made through save() (the orders
+# API, admin). OrderViewSet.create records new orders itself, bulk_create
+# sends no signals.
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    instance._previous_status = None
+    if instance.pk:
+        previous = Order.all_objects.filter(pk=instance.pk)
+        if connection.in_atomic_block:
+            # Concurrent status changes of one order apply one after the other
+            previous = previous.select_for_update()
+        instance._previous_status = previous.values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Order)
+def update_sales_rollups(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_status', None)
+    if created or previous is None or analytics.counted(previous) == analytics.counted(instance.status):
+        return
+    items = analytics.order_items([instance.pk])
+    if analytics.counted(instance.status):
+        analytics.record([instance], items)
+    else:
+        # record() skips uncounted orders, take it back as it was
+        counted_order = Order(pk=instance.pk, tenant_id=instance.tenant_id, status=previous,
+                              total_amount=instance.total_amount, created_at=instance.created_at)
+        analytics.record([counted_order], items, sign=-1)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_from_sales_rollups(sender, instance, **kwargs):
+    # pre_delete: the items are still there
+    analytics.record([instance], analytics.order_items([instance.pk]), sign=-1)
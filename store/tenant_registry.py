@@ -0,0 +1,136 @@
+import time
+import threading
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from . import metrics
+
+
+class TenantRegistry:
+    """
+    In-process id -> Tenant map used by TenantMiddleware for the X-Tenant-ID
+    header and ?tenant= param. Loaded in one query on first use (or at startup
+    via preload()), kept current by the Tenant signal handlers and fully
+    reloaded every `ttl` seconds to pick up changes made by other processes.
+    The map holds every tenant, so an id missing from it is answered as
+    absent without a query; unknown ids only bring the next reload forward,
+    to at most one every `reload_interval` seconds, so tenants created
+    elsewhere resolve soon while probing random ids can't reach the DB.
+    """
+
+    def __init__(self, ttl=300, reload_interval=30):
+        self.ttl = ttl
+        self.reload_interval = reload_interval
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._tenants = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def preload(self):
+        Tenant = apps.get_model('store', 'Tenant')
+        generation = self.generation
+        self.reloads += 1
+        tenants = {t.id: t for t in Tenant.objects.all()}
+        with self._lock:
+            if generation != self.generation:
+                return  # changed mid-load, the next lookup retries
+            self._tenants = tenants
+            self._loaded_at = time.monotonic()
+
+    def get(self, tenant_id):
+        tenant_id = self._parse(tenant_id)
+        if tenant_id is None:
+            return None
+        if self._needs_load(tenant_id):
+            self._reload(tenant_id)
+        return self._answer(tenant_id)
+
+    async def aget(self, tenant_id):
+        # Only hops to a thread when the DB has to be consulted
+        tenant_id = self._parse(tenant_id)
+        if tenant_id is None:
+            return None
+        if self._needs_load(tenant_id):
+            await sync_to_async(self._reload)(tenant_id)
+        return self._answer(tenant_id)
+
+    def _parse(self, tenant_id):
+        try:
+            return int(tenant_id)
+        except (TypeError, ValueError):
+            return None
+
+    def _needs_load(self, tenant_id):
+        if self._loaded_at is None:
+            return True
+        age = time.monotonic() - self._loaded_at
+        return age > self.ttl or (tenant_id not in self._tenants and age >= self.reload_interval)
+
+    def _reload(self, tenant_id):
+        # Only the first load is waited for; while one thread reloads, the
+        # others answer from the current map
+        if not self._reload_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._needs_load(tenant_id):
+                self.preload()
+        finally:
+            self._reload_lock.release()
+
+    def _answer(self, tenant_id):
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return tenant
+
+    def update(self, tenant):
+        with self._lock:
+            self.generation += 1
+            self._tenants[tenant.pk] = tenant
+
+    def discard(self, tenant_id):
+        with self._lock:
+            self.generation += 1
+            self._tenants.pop(tenant_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._tenants = {}
+            self._loaded_at = None
+
+    def stats(self):
+        return {
+            'size': len(self._tenants),
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+        }
+
+
+tenant_registry = TenantRegistry(
+    ttl=getattr(settings, 'TENANT_REGISTRY_TTL', 300),
+    reload_interval=getattr(settings, 'TENANT_REGISTRY_RELOAD_INTERVAL', 30),
+)
+metrics.register('tenant_registry', tenant_registry.stats)
+
+
+def preload_at_startup():
+    # Called from config.asgi / config.wsgi. Lookups fall back to a lazy load
+    # if the database isn't reachable (or migrated) yet.
+    try:
+        tenant_registry.preload()
+    except DatabaseError:
+        tenant_registry.clear()
+    finally:
+        connections.close_all()
@@ -1,14 +1,31 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.db import models
 from django.db.models import Manager
-from threading import local
 
-_thread_locals = local()
+# A ContextVar rather than a threading.local: it follows the request across
+# sync_to_async/async_to_sync hops and can't leak into the next request that
+# happens to run on the same thread.
+_current_tenant = ContextVar('current_tenant', default=None)
 
 def get_current_tenant():
-    return getattr(_thread_locals, 'tenant', None)
+    return _current_tenant.get()
 
 def set_current_tenant(tenant):
-    _thread_locals.tenant = tenant
+    # Returns a token for reset_current_tenant(). Prefer tenant_context().
+    return _current_tenant.set(tenant)
+
+def reset_current_tenant(token):
+    _current_tenant.reset(token)
+
+@contextmanager
+def tenant_context(tenant):
+    token = _current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current_tenant.reset(token)
 
 class TenantManager(models.Manager):
     def get_queryset(self):
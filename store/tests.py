@@ -1,3 +1,2095 @@
-from django.test import TestCase
+import io
+import csv
+import base64
+import hashlib
+import gzip
+import asyncio
+import datetime
+import json
+import importlib
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import SyncToAsync, iscoroutinefunction
+from django.http import HttpResponse
+from django.apps import apps
+from django.contrib.auth.hashers import check_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django.db import connection, connections
+from django.db.models import Count, F
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .models import (
+    Tenant, StoreUser, Product, Order, OrderItem, RefreshToken, DailySales, ProductDailySales, Checkout, ReplicaHeartbeat,
+)
+from .serializers import ProductSerializer
+from .authentication import create_token, decode_token, get_principal_from_token, hash_pass, principal_cache, TokenPrincipal
+from .permissions import IsOwnerOrStaff, IsCustomer
+from .middleware import CustomAuthMiddleware, TenantMiddleware
+from .tenant_utils import get_current_tenant, tenant_context
+from .tenant_registry import tenant_registry
+from . import authentication, response_cache, fast_serializers, hashing, analytics, images, checkout, reservations, replicas, search, uploads
+
+
+def make_user(username, role='CUSTOMER', tenant=None):
+    return StoreUser.objects.create(
+        username=username,
+        email=f'{username}@example.com',
+        password='!',
+        role=role,
+        tenant=tenant,
+    )
+
+
+class PrincipalCacheTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        principal_cache.reset_stats()
+        self.factory = RequestFactory()
+        self.tenant = Tenant.objects.create(name='Shop')
+        self.owner = make_user('owner', role='OWNER', tenant=self.tenant)
+        self.token = create_token(self.owner)
+
+    def run_middleware(self, token):
+        seen = {}
+
+        def view(request):
+            seen['user'] = request.custom_user
+            seen['tenant'] = get_current_tenant()
+            return HttpResponse()
+
+        handler = CustomAuthMiddleware(TenantMiddleware(view))
+        handler(self.factory.get('/api/products/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+        return seen
+
+    def test_warm_path_does_no_queries(self):
+        with self.assertNumQueries(1):
+            self.run_middleware(self.token)
+        with self.assertNumQueries(0):
+            seen = self.run_middleware(self.token)
+        self.assertEqual(seen['user'].id, self.owner.id)
+        self.assertEqual(seen['tenant'].id, self.tenant.id)
+        stats = principal_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_user_save_invalidates(self):
+        self.run_middleware(self.token)
+        self.owner.role = 'STAFF'
+        self.owner.save()
+        with self.assertNumQueries(1):
+            seen = self.run_middleware(self.token)
+        self.assertEqual(seen['user'].role, 'STAFF')
+
+    def test_tenant_save_invalidates(self):
+        self.run_middleware(self.token)
+        self.tenant.name = 'Renamed'
+        self.tenant.save()
+        seen = self.run_middleware(self.token)
+        self.assertEqual(seen['tenant'].name, 'Renamed')
+
+    def test_deleted_user_is_rejected(self):
+        self.run_middleware(self.token)
+        self.owner.delete()
+        self.assertIsNone(self.run_middleware(self.token)['user'])
+
+
+@override_settings(AUTH_CLAIMS_ONLY=True)
+class ClaimsOnlyAuthTests(TestCase):
+    def setUp(self):
+        authentication.token_versions.clear()
+        self.factory = RequestFactory()
+        self.tenant = Tenant.objects.create(name='Shop')
+        self.owner = make_user('owner', role='OWNER', tenant=self.tenant)
+        self.customer = make_user('customer')
+
+    def authenticate(self, token):
+        seen = {}
+
+        def view(request):
+            seen['user'] = request.custom_user
+            seen['tenant'] = get_current_tenant()
+            return HttpResponse()
+
+        handler = CustomAuthMiddleware(TenantMiddleware(view))
+        request = self.factory.get('/api/orders/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        with self.assertNumQueries(0):
+            handler(request)
+        return request, seen
+
+    def test_principal_from_claims(self):
+        request, seen = self.authenticate(create_token(self.owner))
+        user = seen['user']
+        self.assertIsInstance(user, TokenPrincipal)
+        self.assertEqual((user.id, user.role, user.tenant_id), (self.owner.id, 'OWNER', self.tenant.id))
+        self.assertEqual(seen['tenant'].pk, self.tenant.id)
+        self.assertTrue(IsOwnerOrStaff().has_permission(request, None))
+        self.assertFalse(IsCustomer().has_permission(request, None))
+
+    def test_claim_change_revokes_tokens(self):
+        token = create_token(self.customer)
+        # Not in the token: it stays valid
+        self.customer.email = 'new@example.com'
+        self.customer.save()
+        self.assertIsNotNone(self.authenticate(token)[1]['user'])
+
+        self.customer.role = 'STAFF'
+        self.customer.save(update_fields=['role'])
+        self.assertIsNone(self.authenticate(token)[1]['user'])
+        self.assertEqual(self.authenticate(create_token(self.customer))[1]['user'].role, 'STAFF')
+
+        token = create_token(self.owner)
+        self.owner.delete()
+        self.assertIsNone(self.authenticate(token)[1]['user'])
+
+    def test_versions_come_from_the_shared_column(self):
+        # Issued and revoked by other processes: this one only has the database
+        token = create_token(self.customer)
+        authentication.token_versions.clear()
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(authentication.get_principal_from_token(token))
+            self.assertIsNotNone(authentication.get_principal_from_token(token))
+
+        StoreUser.objects.filter(pk=self.customer.pk).update(token_version=F('token_version') + 1)
+        self.assertIsNotNone(authentication.get_principal_from_token(token))
+        # Until the remembered version expires
+        authentication.token_versions.clear()
+        self.assertIsNone(authentication.get_principal_from_token(token))
+        self.customer.refresh_from_db()
+        self.assertIsNotNone(asyncio.run(authentication.aget_principal_from_token(create_token(self.customer))))
+
+    def test_order_history_and_tenant_creation(self):
+        token = create_token(self.customer)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(client.get('/api/orders/').status_code, 200)
+
+        response = client.post('/api/tenants/', {'name': 'New Shop'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.role, 'OWNER')
+        # The old token's claims are stale, the re-issued one carries the new tenant
+        self.assertIsNone(self.authenticate(token)[1]['user'])
+        self.assertEqual(self.authenticate(response.data['access'])[1]['tenant'].pk, response.data['id'])
+
+
+class TenantRegistryTests(TestCase):
+    def setUp(self):
+        tenant_registry.clear()
+        self.factory = RequestFactory()
+        self.tenant = Tenant.objects.create(name='Shop')
+
+    def resolve(self, **extra):
+        seen = {}
+
+        def view(request):
+            seen['tenant'] = get_current_tenant()
+            return HttpResponse()
+
+        path = extra.pop('path', '/api/products/')
+        CustomAuthMiddleware(TenantMiddleware(view))(self.factory.get(path, **extra))
+        return seen['tenant']
+
+    def test_header_and_query_param_served_from_registry(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.resolve(HTTP_X_TENANT_ID=str(self.tenant.id)), self.tenant)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve(path=f'/api/products/?tenant={self.tenant.id}'), self.tenant)
+
+    def test_unknown_ids_never_query_per_id(self):
+        tenant_registry.preload()
+        with self.assertNumQueries(0):
+            for tenant_id in range(1000, 1100):
+                self.assertIsNone(self.resolve(HTTP_X_TENANT_ID=str(tenant_id)))
+            self.assertIsNone(self.resolve(path='/api/products/?tenant=999'))
+            self.assertIsNone(self.resolve(HTTP_X_TENANT_ID='not-a-number'))
+
+    def test_unknown_id_brings_the_reload_forward(self):
+        tenant_registry.preload()
+        # Created by another process: no signal here
+        other = Tenant.objects.create(name='Elsewhere')
+        tenant_registry.discard(other.id)
+        self.assertIsNone(self.resolve(HTTP_X_TENANT_ID=str(other.id)))
+        with mock.patch.object(tenant_registry, 'reload_interval', 0), self.assertNumQueries(1):
+            self.assertEqual(self.resolve(HTTP_X_TENANT_ID=str(other.id)), other)
+            self.assertEqual(self.resolve(HTTP_X_TENANT_ID=str(self.tenant.id)), self.tenant)
+
+    def test_signals_keep_registry_current(self):
+        tenant_registry.preload()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tenant.name = 'Renamed'
+            self.tenant.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve(HTTP_X_TENANT_ID=str(self.tenant.id)).name, 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created = Tenant.objects.create(name='New')
+        self.assertEqual(self.resolve(HTTP_X_TENANT_ID=str(created.id)), created)
+
+        tenant_id = self.tenant.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tenant.delete()
+        self.assertIsNone(self.resolve(HTTP_X_TENANT_ID=str(tenant_id)))
+
+
+class TenantContextConcurrencyTests(TestCase):
+    REQUESTS = 2000
+
+    def setUp(self):
+        principal_cache.clear()
+        tenant_registry.clear()
+        self.factory = RequestFactory()
+        self.tenants = [Tenant.objects.create(name=f'Shop {i}') for i in range(8)]
+        self.tokens = {
+            t.id: create_token(make_user(f'owner{t.id}', role='OWNER', tenant=t))
+            for t in self.tenants
+        }
+        rng = random.Random(4)
+        self.requests = []
+        for i in range(self.REQUESTS):
+            tenant = rng.choice(self.tenants)
+            if i % 2:
+                request = self.factory.get('/api/orders/', HTTP_AUTHORIZATION=f'Bearer {self.tokens[tenant.id]}')
+            else:
+                request = self.factory.get('/api/products/', HTTP_X_TENANT_ID=str(tenant.id))
+            request.expected_tenant_id = tenant.id
+            self.requests.append(request)
+        # Warm the principal cache and tenant registry
+        sync_handler = CustomAuthMiddleware(TenantMiddleware(lambda request: HttpResponse()))
+        for request in self.requests[:64]:
+            sync_handler(request)
+
+    async def test_interleaved_async_requests_do_not_bleed(self):
+        mismatches = []
+
+        async def view(request):
+            for _ in range(3):
+                await asyncio.sleep(0)
+                tenant = get_current_tenant()
+                if tenant is None or tenant.id != request.expected_tenant_id:
+                    mismatches.append(request)
+            return HttpResponse()
+
+        handler = CustomAuthMiddleware(TenantMiddleware(view))
+        self.assertTrue(iscoroutinefunction(handler))
+
+        original_call = SyncToAsync.__call__
+        with mock.patch.object(SyncToAsync, '__call__', autospec=True, side_effect=original_call) as hops:
+            await asyncio.gather(*(handler(request) for request in self.requests))
+
+        self.assertEqual(mismatches, [])
+        # Warm path never leaves the event loop (MiddlewareMixin needed 2 hops per request)
+        self.assertEqual(hops.call_count, 0)
+        self.assertIsNone(get_current_tenant())
+
+    def test_threaded_sync_requests_do_not_bleed_or_leak(self):
+        def view(request):
+            tenant = get_current_tenant()
+            return HttpResponse(status=200 if tenant and tenant.id == request.expected_tenant_id else 500)
+
+        handler = CustomAuthMiddleware(TenantMiddleware(view))
+
+        def run(request):
+            status = handler(request).status_code
+            # Nothing left behind for the next request on this worker thread
+            return status, get_current_tenant()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(run, self.requests))
+        self.assertEqual({status for status, _ in results}, {200})
+        self.assertEqual({leftover for _, leftover in results}, {None})
+
+
+class AsyncCatalogTests(TestCase):
+    def setUp(self):
+        tenant_registry.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        self.products = [
+            Product.objects.create(tenant=self.shop, name='Caf\u00e9 mug', price='12.50', stock=3),
+            Product.objects.create(tenant=self.shop, name='Teapot', price='30.00', stock=1),
+            Product.objects.create(tenant=self.other, name='Lamp', price='45.99', stock=0),
+        ]
+
+    def fetch(self, path, async_views):
+        # Both paths must render, not replay each other's cached response
+        with override_settings(ASYNC_CATALOG_VIEWS=async_views, RESPONSE_CACHE_ENABLED=False):
+            return self.client.get(path)
+
+    def test_matches_sync_viewset_output(self):
+        paths = [
+            '/api/products/',
+            f'/api/products/?tenant={self.shop.id}',
+            f'/api/products/{self.products[0].id}/',
+            f'/api/products/{self.products[2].id}/?tenant={self.shop.id}',
+            '/api/products/999/',
+            '/api/products/?page_size=1',
+            '/api/products/?cursor=bogus',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                expected = self.fetch(path, async_views=False)
+                response = self.fetch(path, async_views=True)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response['Content-Type'], expected['Content-Type'])
+                self.assertEqual(response.content, expected.content)
+
+    def test_tenant_filtering(self):
+        response = self.fetch(f'/api/products/?tenant={self.other.id}', async_views=True)
+        self.assertEqual([p['name'] for p in response.json()['results']], ['Lamp'])
+
+    def test_writes_still_use_viewset(self):
+        owner = make_user('owner', role='OWNER', tenant=self.shop)
+        response = self.client.post(
+            '/api/products/', {'name': 'Kettle', 'price': '20.00', 'stock': 5},
+            HTTP_AUTHORIZATION=f'Bearer {create_token(owner)}', content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['tenant'], self.shop.id)
+        self.assertEqual(self.client.post('/api/products/', {}).status_code, 403)
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        self.mug = Product.objects.create(tenant=self.shop, name='Mug', price='12.50', stock=5)
+        self.pot = Product.objects.create(tenant=self.shop, name='Teapot', price='30.00', stock=2)
+        self.lamp = Product.objects.create(tenant=self.other, name='Lamp', price='45.99', stock=1)
+        self.customer = make_user('customer')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.customer)}'}
+
+    def place(self, *items):
+        return self.client.post('/api/orders/', {
+            'items': [{'product_id': p.id, 'quantity': q} for p, q in items],
+        }, content_type='application/json', **self.auth)
+
+    def test_splits_by_tenant_and_deducts_stock(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.place((self.mug, 2), (self.pot, 1), (self.lamp, 1), (self.mug, 1))
+        self.assertEqual(response.status_code, 201)
+        totals = sorted(order['total_amount'] for order in response.json())
+        self.assertEqual(totals, ['45.99', '67.50'])
+        self.assertEqual(OrderItem.objects.count(), 4)
+        stock = dict(Product.all_objects.values_list('name', 'stock'))
+        self.assertEqual(stock, {'Mug': 2, 'Teapot': 1, 'Lamp': 0})
+        writes = [q for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        # orders, items, stock + an upsert and an UPDATE per sales rollup table
+        self.assertEqual(len(writes), 7)
+
+    def test_insufficient_stock(self):
+        response = self.place((self.mug, 2), (self.pot, 3))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Not enough stock for Teapot'})
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_lost_race_rolls_back_whole_order(self):
+        # Stock went away after the pre-check, e.g. a concurrent checkout
+        with mock.patch('store.checkout.deduct_stock', return_value=1):
+            response = self.place((self.mug, 1), (self.pot, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(OrderItem.objects.count(), 0)
+
+    def test_rejects_non_positive_quantity(self):
+        self.assertEqual(self.place((self.mug, -3)).status_code, 400)
+        self.assertEqual(Product.all_objects.get(id=self.mug.id).stock, 5)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    ORDERS = 1000
+    STOCK = 600
+    THREADS = 8
+
+    def test_hot_product_is_never_oversold(self):
+        shop = Tenant.objects.create(name='Shop')
+        hot = Product.objects.create(tenant=shop, name='Hot', price='1.00', stock=self.STOCK)
+        tokens = [create_token(make_user(f'buyer{i}')) for i in range(self.THREADS)]
+        body = json.dumps({'items': [{'product_id': hot.id, 'quantity': 1}]})
+
+        def buy(i):
+            try:
+                return self.client_class().post(
+                    '/api/orders/', body, content_type='application/json',
+                    HTTP_AUTHORIZATION=f'Bearer {tokens[i % self.THREADS]}',
+                ).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            statuses = list(pool.map(buy, range(self.ORDERS)))
+
+        hot.refresh_from_db()
+        sold = sum(OrderItem.objects.filter(product=hot).values_list('quantity', flat=True))
+        self.assertGreaterEqual(hot.stock, 0)
+        self.assertEqual(sold, self.STOCK - hot.stock)
+        self.assertEqual(statuses.count(201), sold)
+        self.assertEqual(Order.objects.count(), sold)
+        # More buyers than stock: it sells out
+        self.assertEqual(hot.stock, 0)
+
+    @override_settings(RESERVATION_BACKEND='local', RESERVATION_SYNC_INTERVAL=0)
+    def test_reserved_hot_product_is_never_oversold(self):
+        engine = reservations.get_engine()
+        engine.client.flushall()
+        shop = Tenant.objects.create(name='Shop')
+        hot = Product.objects.create(tenant=shop, name='Hot', price='1.00', stock=self.STOCK)
+        engine.enroll(hot.id)
+        reservations.reconcile(engine)
+        tokens = [create_token(make_user(f'buyer{i}')) for i in range(self.THREADS)]
+
+        def buy(i):
+            client = self.client_class(HTTP_AUTHORIZATION=f'Bearer {tokens[i % self.THREADS]}')
+            try:
+                # Add to cart, then check out with the hold; every fifth buyer skips the cart
+                holds = []
+                if i % 5:
+                    response = client.post('/api/reservations/', {'product_id': hot.id, 'quantity': 1},
+                                           content_type='application/json')
+                    if response.status_code == 409:
+                        return 409
+                    holds = [response.json()['id']]
+                return client.post('/api/orders/', {
+                    'items': [{'product_id': hot.id, 'quantity': 1}], 'holds': holds,
+                }, content_type='application/json').status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            statuses = list(pool.map(buy, range(self.ORDERS)))
+
+        reservations.sync(engine)
+        hot.refresh_from_db()
+        sold = sum(OrderItem.objects.filter(product=hot).values_list('quantity', flat=True))
+        self.assertEqual(statuses.count(201), sold)
+        self.assertEqual(sold, self.STOCK)
+        self.assertEqual(hot.stock, 0)
+        self.assertEqual(engine.counters([hot.id]), {hot.id: (0, 0)})
+        self.assertFalse(OrderItem.objects.filter(stock_pending=True).exists())
+
+    def test_retries_with_one_idempotency_key_order_once(self):
+        shop = Tenant.objects.create(name='Shop')
+        mug = Product.objects.create(tenant=shop, name='Mug', price='1.00', stock=100)
+        token = create_token(make_user('buyer'))
+        body = json.dumps({'items': [{'product_id': mug.id, 'quantity': 1}]})
+
+        def buy(i):
+            try:
+                response = self.client_class().post(
+                    '/api/orders/', body, content_type='application/json',
+                    HTTP_AUTHORIZATION=f'Bearer {token}', HTTP_IDEMPOTENCY_KEY='cart-1',
+                )
+                return response.status_code, tuple(order['id'] for order in response.json())
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = set(pool.map(buy, range(self.THREADS * 4)))
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=mug.pk).stock, 99)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        tenant_registry.clear()
+        principal_cache.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        Product.objects.bulk_create(
+            Product(tenant=self.shop, name=f'P{i}', price='1.00', stock=1) for i in range(25)
+        )
+        Product.objects.create(tenant=self.other, name='Elsewhere', price='1.00', stock=1)
+        # Same created_at for a few rows so the id tiebreak matters
+        first_ids = list(Product.objects.filter(tenant=self.shop).order_by('id').values_list('id', flat=True)[:6])
+        stamp = Product.objects.get(id=first_ids[0]).created_at
+        Product.objects.filter(id__in=first_ids).update(created_at=stamp)
+
+    def walk(self, url, key='next'):
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([p['name'] for p in data['results']])
+            url = data[key]
+        return pages
+
+    def test_walks_all_rows_forward_and_back(self):
+        expected = list(
+            Product.objects.filter(tenant=self.shop).order_by('-created_at', '-id').values_list('name', flat=True)
+        )
+        pages = self.walk(f'/api/products/?tenant={self.shop.id}&page_size=4')
+        self.assertEqual([len(p) for p in pages], [4, 4, 4, 4, 4, 4, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        last_page = self.client.get(f'/api/products/?tenant={self.shop.id}&page_size=4').json()
+        for _ in range(6):
+            last_page = self.client.get(last_page['next']).json()
+        backwards = self.walk(last_page['previous'], key='previous')
+        self.assertEqual(sum(reversed(backwards), []), expected[:24])
+
+    def test_deep_pages_cost_one_query_without_count_or_offset(self):
+        url = f'/api/products/?tenant={self.shop.id}&page_size=3'
+        tenant_registry.preload()
+        for _ in range(6):
+            with CaptureQueriesContext(connection) as ctx:
+                url = self.client.get(url).json()['next']
+            self.assertEqual(len(ctx.captured_queries), 1)
+            sql = ctx.captured_queries[0]['sql']
+            self.assertNotIn('COUNT(', sql)
+            self.assertNotIn('OFFSET', sql)
+
+    @override_settings(API_MAX_PAGE_SIZE=10)
+    def test_page_size_cap_and_invalid_cursor(self):
+        response = self.client.get(f'/api/products/?tenant={self.shop.id}&page_size=1000')
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertEqual(self.client.get('/api/products/?cursor=bm9wZQ').status_code, 404)
+
+    def test_customer_order_history_is_paginated(self):
+        customer = make_user('customer')
+        Order.objects.bulk_create(Order(tenant=self.shop, customer=customer, total_amount=1) for _ in range(7))
+        Order.objects.create(tenant=self.shop, customer=make_user('someone-else'), total_amount=1)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {create_token(customer)}')
+        data = client.get('/api/orders/?page_size=5').json()
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual(len(client.get(data['next']).json()['results']), 2)
+
+
+class OrderReadPathTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.owner = make_user('owner', role='OWNER', tenant=self.shop)
+        self.customer = make_user('customer')
+        self.products = [
+            Product.objects.create(tenant=self.shop, name=f'P{i}', price='2.00', stock=100) for i in range(4)
+        ]
+        self.client = APIClient()
+
+    def add_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(tenant=self.shop, customer=self.customer, total_amount=8)
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=p, quantity=1, price=p.price, product_name=p.name)
+                for p in self.products
+            )
+
+    def list_queries(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.client.get('/api/orders/')  # warm the principal cache
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/orders/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()['results']
+
+    def test_listing_uses_fixed_number_of_queries(self):
+        for token in (create_token(self.owner), create_token(self.customer)):
+            self.add_orders(2)
+            few, _ = self.list_queries(token)
+            self.add_orders(10)
+            many, results = self.list_queries(token)
+            self.assertEqual(few, many)
+            self.assertEqual(many, 2)
+            self.assertEqual(len(results[0]['items']), 4)
+
+    def test_history_keeps_name_at_order_time(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {create_token(self.customer)}')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/orders/', {
+                'items': [{'product_id': self.products[0].id, 'quantity': 2}],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()[0]['items'][0]['product_name'], 'P0')
+        item_reads = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "store_orderitem"' in q['sql']]
+        self.assertEqual(len(item_reads), 1)
+        self.assertNotIn('"store_product"', item_reads[0])
+
+        Product.objects.filter(id=self.products[0].id).update(name='Renamed')
+        items = self.client.get('/api/orders/').json()['results'][0]['items']
+        self.assertEqual(items[0]['product_name'], 'P0')
+
+    def test_backfill_migration(self):
+        self.add_orders(3)
+        OrderItem.objects.update(product_name='')
+        migration = importlib.import_module('store.migrations.0003_orderitem_product_name')
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            migration.backfill_product_names(apps, mock.Mock(connection=connection))
+        self.assertEqual(
+            sorted(set(OrderItem.objects.values_list('product_name', flat=True))),
+            ['P0', 'P1', 'P2', 'P3'],
+        )
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        tenant_registry.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        self.desc_match = Product.objects.create(
+            tenant=self.shop, name='Mug', description='A mug for your coffee', price='8.00', stock=3, category='kitchen')
+        self.name_match = Product.objects.create(
+            tenant=self.shop, name='Coffee grinder', description='Burr grinder', price='60.00', stock=0, category='kitchen')
+        Product.objects.create(
+            tenant=self.shop, name='Coffee beans', description='Dark roast', price='12.00', stock=10, category='food')
+        Product.objects.create(
+            tenant=self.shop, name='Tea', description='Green tea', price='5.00', stock=4, category='food')
+        Product.objects.create(
+            tenant=self.other, name='Coffee table', description='Oak', price='300.00', stock=1, category='furniture')
+
+    def search(self, query, tenant=None):
+        tenant = tenant or self.shop
+        response = self.client.get(f'/api/products/search/?tenant={tenant.id}&{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_ranks_name_matches_above_description_matches(self):
+        names = [p['name'] for p in self.search('q=coffee')['results']]
+        self.assertEqual(len(names), 3)
+        self.assertEqual(names[-1], 'Mug')
+        self.assertNotIn('Coffee table', names)
+
+    def test_filters_and_facets(self):
+        data = self.search('q=coffee&category=kitchen&max_price=50')
+        self.assertEqual([p['name'] for p in data['results']], ['Mug'])
+        # The category facet ignores the category filter and vice versa for price
+        self.assertEqual(data['facets']['category'], [{'value': 'food', 'count': 1}, {'value': 'kitchen', 'count': 1}])
+        price = {bucket['min']: bucket['count'] for bucket in data['facets']['price']}
+        self.assertEqual(price[0], 1)
+        self.assertEqual(price[50], 1)
+        self.assertEqual(sum(price.values()), 2)
+
+        in_stock = self.search('q=coffee&in_stock=true')
+        self.assertNotIn('Coffee grinder', [p['name'] for p in in_stock['results']])
+
+    def test_marketplace_scope_and_paging(self):
+        data = self.search('q=coffee&scope=marketplace&page_size=2')
+        self.assertEqual(len(data['results']), 2)
+        rest = self.client.get(data['next']).json()
+        self.assertEqual(len(rest['results']), 2)
+        self.assertIsNone(rest['next'])
+        self.assertIn('Coffee table', [p['name'] for p in data['results'] + rest['results']])
+
+    def test_index_follows_product_changes(self):
+        Product.objects.filter(id=self.desc_match.id).update(description='Plain mug')
+        self.desc_match.refresh_from_db()
+        self.desc_match.name = 'Espresso cup'
+        self.desc_match.save()
+        self.assertEqual(len(self.search('q=coffee')['results']), 2)
+        self.assertEqual([p['name'] for p in self.search('q=espresso')['results']], ['Espresso cup'])
+        self.name_match.delete()
+        self.assertEqual([p['name'] for p in self.search('q=grinder')['results']], [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('q=' + '%22coffee%22 OR NEAR(*')['results'], [])
+        self.assertEqual(len(self.search('q=coffee%20-')['results']), 3)
+
+    def test_invalid_filters(self):
+        response = self.client.get('/api/products/search/?min_price=cheap&in_stock=maybe')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'min_price', 'in_stock'})
+
+
+class CatalogResponseCacheTests(TestCase):
+    def setUp(self):
+        tenant_registry.clear()
+        response_cache.get_cache().clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        self.mug = Product.objects.create(tenant=self.shop, name='Mug', price='8.00', stock=5)
+        self.lamp = Product.objects.create(tenant=self.other, name='Lamp', price='40.00', stock=2)
+        tenant_registry.preload()
+
+    def get(self, path, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path, headers=headers)
+        return response, len(ctx.captured_queries)
+
+    def test_repeat_reads_skip_the_database(self):
+        path = f'/api/products/?tenant={self.shop.id}&page_size=10'
+        first, _ = self.get(path)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        # Query order doesn't matter
+        second, queries = self.get(f'/api/products/?page_size=10&tenant={self.shop.id}')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(queries, 0)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertIn('X-Tenant-ID', second['Vary'])
+
+        not_modified, queries = self.get(path, If_None_Match=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], first['ETag'])
+        self.assertEqual(queries, 0)
+
+        stats = response_cache.get_stats()
+        self.assertGreater(stats['hit_ratio'], 0)
+
+    def test_same_query_from_two_tenants_is_cached_apart(self):
+        cases = {
+            '/api/products/?scope=marketplace': [(200, 'MISS')] * 3,
+            # Not the other store's product: a 404, never served from the shop's entry
+            f'/api/products/{self.mug.id}/?scope=marketplace': [(200, 'MISS'), (404, None), (200, 'MISS')],
+        }
+        for path, expected in cases.items():
+            with self.subTest(path):
+                responses = [
+                    self.get(path, X_Tenant_ID=str(self.shop.id))[0],
+                    self.get(path, X_Tenant_ID=str(self.other.id))[0],
+                    self.get(path)[0],
+                ]
+                self.assertEqual([(r.status_code, r.get('X-Cache')) for r in responses], expected)
+                self.assertNotEqual(responses[0].content, responses[1].content)
+        names = lambda response: {p['name'] for p in response.json()['results']}
+        self.assertEqual(names(self.get('/api/products/?scope=marketplace', X_Tenant_ID=str(self.other.id))[0]), {'Lamp'})
+        # Search does read it: one marketplace-wide entry
+        search = '/api/products/search/?scope=marketplace'
+        self.assertEqual(self.get(search, X_Tenant_ID=str(self.shop.id))[0]['X-Cache'], 'MISS')
+        response, _ = self.get(search, X_Tenant_ID=str(self.other.id))
+        self.assertEqual((response['X-Cache'], names(response)), ('HIT', {'Mug', 'Lamp'}))
+
+    def test_writes_expire_only_affected_tenants(self):
+        shop_path = f'/api/products/?tenant={self.shop.id}'
+        other_path = f'/api/products/?tenant={self.other.id}'
+        marketplace = '/api/products/'
+        etags = {path: self.get(path)[0]['ETag'] for path in (shop_path, other_path, marketplace)}
+
+        self.lamp.price = '45.00'
+        self.lamp.save()
+        self.assertEqual(self.get(shop_path)[0]['X-Cache'], 'HIT')
+        response, _ = self.get(other_path, If_None_Match=etags[other_path])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['price'], '45.00')
+        self.assertNotEqual(self.get(marketplace)[0]['ETag'], etags[marketplace])
+
+        self.mug.delete()
+        self.assertEqual(self.get(shop_path)[0].json()['results'], [])
+
+    def test_checkout_expires_stock(self):
+        path = f'/api/products/{self.mug.id}/'
+        self.assertEqual(self.get(path)[0].json()['stock'], 5)
+        customer = make_user('customer')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {create_token(customer)}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/orders/', {
+                'items': [{'product_id': self.mug.id, 'quantity': 2}],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get(path)[0].json()['stock'], 3)
+
+    def test_tenant_list_and_uncached_requests(self):
+        self.get('/api/tenants/')
+        Tenant.objects.filter(pk=self.other.pk).first().save()
+        self.assertEqual(self.get('/api/tenants/')[0]['X-Cache'], 'MISS')
+        self.assertEqual(self.get('/api/tenants/')[0]['X-Cache'], 'HIT')
+
+        self.assertFalse(self.get('/api/products/999/')[0].has_header('ETag'))
+        browsable = RequestFactory().get('/api/products/', HTTP_ACCEPT='text/html')
+        self.assertIsNone(response_cache.request_scope(browsable, None))
+        with override_settings(RESPONSE_CACHE_ENABLED=False):
+            self.assertFalse(self.get('/api/products/')[0].has_header('ETag'))
+
+    async def test_async_stack(self):
+        from django.test import AsyncClient
+        client = AsyncClient()
+        path = f'/api/products/?tenant={self.shop.id}'
+        first = await client.get(path)
+        second = await client.get(path, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second.status_code, 304)
+
+
+@override_settings(
+    RESPONSE_CACHE_ENABLED=False,
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    MEDIA_URL='/media/',
+)
+class FastListSerializationTests(TestCase):
+    def setUp(self):
+        tenant_registry.clear()
+        self.shop = Tenant.objects.create(name='Caf\u00e9 \u2028 "Shop"', logo='tenant_logos/a b.png')
+        Tenant.objects.create(name='Plain')
+        names = ['Mug', 'Caf\u00e9 \u2028\u2029 mug', 'Tab\there "quoted" \\ back\x01slash', '\U0001f600 emoji', '']
+        prices = ['0.10', '12345678.90', '5', '19.99', '0']
+        for i, (name, price) in enumerate(zip(names, prices)):
+            Product.objects.create(
+                tenant=self.shop, name=name, price=price, stock=i, category='c' * i,
+                description='</script>\n' * i, image='products/p%d.jpg' % i if i % 2 else '',
+            )
+
+    def fetch(self, path, **flags):
+        with override_settings(**flags):
+            return self.client.get(path)
+
+    def test_output_is_byte_identical(self):
+        paths = [
+            '/api/products/', f'/api/products/?tenant={self.shop.id}&page_size=2',
+            '/api/tenants/', '/api/products/?cursor=bogus',
+        ]
+        for path in paths:
+            expected = self.fetch(path, FAST_LIST_SERIALIZATION=False, ASYNC_CATALOG_VIEWS=False)
+            for flags in (
+                {'ASYNC_CATALOG_VIEWS': False, 'FAST_JSON_ENCODER': False},
+                {'ASYNC_CATALOG_VIEWS': False, 'FAST_JSON_ENCODER': True},
+                {'ASYNC_CATALOG_VIEWS': True, 'FAST_JSON_ENCODER': True},
+            ):
+                with self.subTest(path=path, **flags):
+                    response = self.fetch(path, FAST_LIST_SERIALIZATION=True, **flags)
+                    self.assertEqual(response.status_code, expected.status_code)
+                    self.assertEqual(response['Content-Type'], expected['Content-Type'])
+                    self.assertEqual(response.content, expected.content)
+        first_page = self.fetch('/api/products/', ASYNC_CATALOG_VIEWS=False).content
+        self.assertIn(b'"http://testserver/media/products/p1.jpg"', first_page)
+        self.assertIn(b'\\u2028', first_page)
+
+    @override_settings(TIME_ZONE='UTC')
+    def test_utc_timestamps(self):
+        data = self.fetch('/api/products/?page_size=1', ASYNC_CATALOG_VIEWS=False).json()
+        self.assertTrue(data['results'][0]['created_at'].endswith('Z'))
+        expected = self.fetch('/api/products/?page_size=1', FAST_LIST_SERIALIZATION=False).content
+        self.assertEqual(self.fetch('/api/products/?page_size=1', ASYNC_CATALOG_VIEWS=False).content, expected)
+
+    def test_list_reads_values_not_instances(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.fetch('/api/products/?page_size=3', ASYNC_CATALOG_VIEWS=False)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_unsupported_serializers_fall_back(self):
+        from .serializers import OrderSerializer
+        self.assertIsNone(fast_serializers.get_plan(OrderSerializer))
+        self.assertEqual(fast_serializers.get_plan(ProductSerializer).columns[0], 'id')
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        tenant_registry.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.mug = Product.objects.create(
+            tenant=self.shop, name='Mug', description='Long text ' * 100, price='8.00', stock=5)
+        Product.objects.create(tenant=self.shop, name='Tea', price='3.50', stock=1)
+
+    def fetch(self, path, **flags):
+        with override_settings(**flags), CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path)
+        return response, [q['sql'] for q in ctx.captured_queries]
+
+    def test_card_preset_trims_output_and_select(self):
+        for path in ('/api/products/?fields=card', f'/api/products/{self.mug.id}/?fields=card'):
+            outputs = set()
+            for flags in (
+                {'ASYNC_CATALOG_VIEWS': False, 'FAST_LIST_SERIALIZATION': False},
+                {'ASYNC_CATALOG_VIEWS': False, 'FAST_LIST_SERIALIZATION': True},
+                {'ASYNC_CATALOG_VIEWS': True, 'FAST_LIST_SERIALIZATION': False},
+                {'ASYNC_CATALOG_VIEWS': True, 'FAST_LIST_SERIALIZATION': True},
+            ):
+                with self.subTest(path=path, **flags):
+                    response, queries = self.fetch(path, **flags)
+                    self.assertEqual(response.status_code, 200)
+                    data = response.json()
+                    product = data['results'][0] if 'results' in data else data
+                    self.assertEqual(list(product), ['id', 'image_variants', 'name', 'price', 'stock', 'image', 'tenant'])
+                    product_selects = [sql for sql in queries if 'FROM "store_product"' in sql]
+                    self.assertEqual(len(product_selects), 1)
+                    self.assertNotIn('"description"', product_selects[0])
+                    outputs.add(response.content)
+            self.assertEqual(len(outputs), 1)
+
+    def test_fields_and_exclude(self):
+        data = self.client.get('/api/products/?fields=name,card&exclude=image,image_variants,tenant').json()
+        self.assertEqual(list(data['results'][0]), ['id', 'name', 'price', 'stock'])
+        data = self.client.get('/api/products/?exclude=description').json()
+        self.assertNotIn('description', data['results'][0])
+        self.assertIn('category', data['results'][0])
+        data = self.client.get('/api/products/search/?q=mug&fields=name').json()
+        self.assertEqual(data['results'], [{'name': 'Mug'}])
+        data = self.client.get('/api/tenants/?fields=card').json()
+        self.assertEqual(list(data[0]), ['id', 'logo_variants', 'name', 'logo'])
+
+    def test_unknown_fields_are_rejected(self):
+        for async_views in (False, True):
+            with override_settings(ASYNC_CATALOG_VIEWS=async_views):
+                response = self.client.get('/api/products/?fields=name,password&exclude=nope')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {
+                    'fields': ['Unknown field: password'], 'exclude': ['Unknown field: nope'],
+                })
+                response = self.client.get(f'/api/products/{self.mug.id}/?exclude=card,detail')
+                self.assertEqual(response.json(), {'fields': ['No fields selected.']})
+        self.assertEqual(self.client.get('/api/tenants/?fields=users').status_code, 400)
+
+    def test_order_card_skips_items(self):
+        customer = make_user('customer')
+        order = Order.objects.create(tenant=self.shop, customer=customer, total_amount='8.00')
+        OrderItem.objects.create(order=order, product=self.mug, quantity=1, price='8.00', product_name='Mug')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {create_token(customer)}')
+        with CaptureQueriesContext(connection) as ctx:
+            data = client.get('/api/orders/?fields=card').json()
+        self.assertEqual(list(data['results'][0]), ['id', 'status', 'total_amount', 'created_at'])
+        queries = [q['sql'] for q in ctx.captured_queries if 'store_storeuser' not in q['sql']]
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"customer_id"', queries[0].split('FROM')[0])
+        self.assertEqual(client.get('/api/orders/?fields=items').json()['results'][0]['items'][0]['product_name'], 'Mug')
+
+
+class RefreshTokenTests(TestCase):
+    def setUp(self):
+        self.shop = Tenant.objects.create(name='Shop')
+        self.user = make_user('owner', role='OWNER', tenant=self.shop)
+        self.user.password = hash_pass('secret')
+        self.user.save()
+
+    def login(self):
+        response = self.client.post('/api/auth/login/', {'username': 'owner', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def refresh(self, token):
+        return self.client.post('/api/auth/refresh/', {'refresh': token}, content_type='application/json')
+
+    def test_rotation_issues_fresh_tokens_without_password_check(self):
+        tokens = self.login()
+        self.assertNotIn(tokens['refresh'], RefreshToken.objects.values_list('token_hash', flat=True))
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.encode') as pbkdf2:
+            response = self.refresh(tokens['refresh'])
+        self.assertFalse(pbkdf2.called)
+        self.assertEqual(response.status_code, 200)
+        rotated = response.json()
+        self.assertNotEqual(rotated['refresh'], tokens['refresh'])
+        self.assertEqual(decode_token(rotated['access'])['tenant_id'], self.shop.id)
+        self.assertEqual(self.refresh(rotated['refresh']).status_code, 200)
+
+    def test_reuse_revokes_the_family(self):
+        other_session = self.login()['refresh']
+        first = self.login()['refresh']
+        second = self.refresh(first).json()['refresh']
+        # The old token shows up again: someone kept a copy
+        self.assertEqual(self.refresh(first).status_code, 401)
+        self.assertEqual(self.refresh(second).status_code, 401)
+        # Other logins are separate families
+        self.assertEqual(self.refresh(other_session).status_code, 200)
+
+    def test_rejects_expired_unknown_and_missing_tokens(self):
+        token = self.login()['refresh']
+        RefreshToken.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertEqual(self.refresh('nope').status_code, 401)
+        self.assertEqual(self.client.post('/api/auth/refresh/', {}).status_code, 401)
+
+    def test_refreshed_claims_follow_the_user_row(self):
+        token = self.login()['refresh']
+        self.user.role = 'STAFF'
+        self.user.save()
+        access = self.refresh(token).json()['access']
+        self.assertEqual(decode_token(access)['role'], 'STAFF')
+
+    def test_rotation_purges_expired_and_revoked_tokens(self):
+        row = lambda raw: RefreshToken.objects.filter(token_hash=authentication._hash_refresh_token(raw))
+        expired = self.login()['refresh']
+        revoked = self.login()['refresh']
+        spent = self.login()['refresh']
+        current = self.refresh(spent).json()['refresh']
+        row(expired).update(expires_at=timezone.now())
+        authentication.revoke_refresh_family(row(revoked).get().family)
+
+        authentication._purged_at = None
+        current = self.refresh(current).json()['refresh']
+        self.assertFalse(row(expired).exists())
+        self.assertFalse(row(revoked).exists())
+        # Used but unexpired tokens are kept to catch reuse
+        self.assertEqual(RefreshToken.objects.count(), 3)
+        self.assertEqual(self.refresh(spent).status_code, 401)
+        self.assertEqual(self.refresh(current).status_code, 401)
+
+        # Not again until the interval has passed
+        token = self.login()['refresh']
+        row(token).update(expires_at=timezone.now())
+        self.refresh(self.login()['refresh'])
+        self.assertTrue(row(token).exists())
+
+
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        self.user = make_user('shopper')
+
+    def login(self):
+        return self.client.post('/api/auth/login/', {'username': 'shopper', 'password': 'secret'})
+
+    def test_process_pool_round_trip(self):
+        pool = hashing.HashPool(workers=1, max_pending=2, retry_after=1)
+        try:
+            encoded = pool.run(hashing._make_password, 'secret')
+            self.assertTrue(encoded.startswith('pbkdf2_sha256$'))
+            self.assertEqual(pool.run(hashing._check_password, 'secret', encoded), (True, None))
+            self.assertEqual(pool.run(hashing._check_password, 'wrong', encoded), (False, None))
+        finally:
+            pool.executor().shutdown()
+        stats = pool.stats()
+        self.assertEqual((stats['completed'], stats['pending']), (3, 0))
+
+    def test_full_queue_answers_429(self):
+        busy = threading.BoundedSemaphore(1)
+        busy.acquire()
+        with mock.patch.object(hashing.hash_pool, 'workers', 1), mock.patch.object(hashing.hash_pool, '_slots', busy):
+            response = self.login()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '1')
+            response = self.client.post('/api/auth/register/', {
+                'username': 'new', 'password': 'pw', 'email': 'new@example.com',
+            })
+            self.assertEqual(response.status_code, 429)
+        self.assertFalse(StoreUser.objects.filter(username='new').exists())
+
+    def test_old_hashes_are_upgraded_on_login(self):
+        weak = hashing.PBKDF2PasswordHasher().encode('secret', 'somesalt', iterations=1000)
+        StoreUser.objects.filter(pk=self.user.pk).update(password=weak)
+        access = create_token(self.user)
+
+        self.assertEqual(self.login().status_code, 200)
+        upgraded = StoreUser.objects.get(pk=self.user.pk).password
+        self.assertEqual(int(upgraded.split('$')[1]), hashing.PBKDF2PasswordHasher.iterations)
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(StoreUser.objects.get(pk=self.user.pk).password, upgraded)
+        # The upgrade doesn't count as a user change, issued tokens stay valid
+        self.assertIsNotNone(get_principal_from_token(access))
+
+        self.assertEqual(self.client.post('/api/auth/login/', {'username': 'shopper', 'password': 'x'}).status_code, 401)
+
+
+class SeedStoreTests(TestCase):
+    def seed(self, prefix, **options):
+        options = {'tenants': 6, 'products': 120, 'customers': 30, 'orders': 200, 'batch_size': 37,
+                   'seed': 7, 'until': datetime.date(2026, 1, 31), **options}
+        call_command('seed_store', prefix=prefix, stdout=io.StringIO(), **options)
+        tenants = Tenant.objects.filter(name__startswith=f'{prefix} shop').order_by('id')
+        products = Product.all_objects.filter(tenant__in=tenants).order_by('id')
+        orders = Order.all_objects.filter(tenant__in=tenants).order_by('id').prefetch_related('items')
+        return tenants, products, orders
+
+    def test_same_seed_same_dataset(self):
+        def shape(tenants, products, orders):
+            index = {tenant.id: i for i, tenant in enumerate(tenants)}
+            product_rows = [(index[p.tenant_id], p.name, p.price, p.stock, p.category, p.created_at) for p in products]
+            order_rows = [
+                (index[o.tenant_id], o.status, o.total_amount, o.created_at,
+                 sorted((item.product_name, item.quantity, item.price) for item in o.items.all()))
+                for o in orders
+            ]
+            return product_rows, order_rows
+
+        first, second = shape(*self.seed('a')), shape(*self.seed('b'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, shape(*self.seed('c', seed=8)))
+
+    def test_skewed_and_consistent(self):
+        tenants, products, orders = self.seed('a')
+        sizes = [products.filter(tenant=tenant).count() for tenant in tenants]
+        self.assertEqual(sum(sizes), 120)
+        self.assertGreater(sizes[0], 5 * sizes[-1])
+        self.assertEqual(orders.count(), 200)
+        self.assertEqual(StoreUser.objects.filter(username__startswith='a_owner_', role='OWNER').count(), 6)
+        customer = StoreUser.objects.get(username='a_customer_0')
+        self.assertTrue(check_password('password', customer.password))
+
+        for order in orders[:20]:
+            items = list(order.items.all())
+            self.assertTrue(items)
+            self.assertEqual(order.total_amount, sum(item.price * item.quantity for item in items))
+            self.assertTrue(all(item.product.tenant_id == order.tenant_id for item in items))
+        first, last = orders.first(), orders.last()
+        self.assertLess(first.created_at, last.created_at)
+        self.assertLessEqual(last.created_at.date(), datetime.date(2026, 1, 31))
+
+        # Hot products: the biggest shop's first product outsells its last one
+        catalog = products.filter(tenant=tenants[0])
+        sold = lambda product: OrderItem.objects.filter(product=product).count()
+        self.assertGreater(sold(catalog.first()), sold(catalog.last()))
+
+        with self.assertRaises(CommandError):
+            call_command('seed_store', prefix='a', stdout=io.StringIO())
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        self.mug = Product.objects.create(tenant=self.shop, name='Mug', price='12.50', stock=100)
+        self.pot = Product.objects.create(tenant=self.shop, name='Teapot', price='30.00', stock=100)
+        self.lamp = Product.objects.create(tenant=self.other, name='Lamp', price='45.99', stock=100)
+        self.owner = make_user('owner', role='OWNER', tenant=self.shop)
+        self.customer = make_user('customer')
+        self.owner_auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.owner)}'}
+        self.customer_auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.customer)}'}
+
+    def place(self, *items):
+        response = self.client.post('/api/orders/', {
+            'items': [{'product_id': p.id, 'quantity': q} for p, q in items],
+        }, content_type='application/json', **self.customer_auth)
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def report(self, **params):
+        return self.client.get('/api/analytics/', params, **self.owner_auth)
+
+    def rollups(self):
+        return (
+            sorted(DailySales.all_objects.values_list('tenant_id', 'day', 'orders', 'units', 'revenue')),
+            sorted(ProductDailySales.all_objects.filter(orders__gt=0).values_list(
+                'tenant_id', 'day', 'product_id', 'orders', 'units', 'revenue',
+            )),
+        )
+
+    def test_orders_update_rollups_incrementally(self):
+        self.place((self.mug, 2), (self.pot, 1), (self.lamp, 1), (self.mug, 1))
+        self.place((self.mug, 1))
+
+        response = self.report()
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['totals'], {
+            'orders': 2, 'units': 5, 'revenue': '80.00', 'average_order_value': '40.00',
+        })
+        self.assertEqual(data['series'], [
+            {'period': str(timezone.localdate()), **data['totals']},
+        ])
+        self.assertEqual([(p['name'], p['orders'], p['units'], p['revenue']) for p in data['top_products']], [
+            ('Mug', 2, 4, '50.00'), ('Teapot', 1, 1, '30.00'),
+        ])
+
+    def test_status_changes_and_deletes(self):
+        order_id = self.place((self.mug, 2))[0]['id']
+        self.place((self.pot, 1))
+
+        response = self.client.patch(f'/api/orders/{order_id}/', {'status': 'CANCELLED'},
+                                     content_type='application/json', **self.owner_auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.report().json()['totals']['revenue'], '30.00')
+        self.assertEqual([p['name'] for p in self.report().json()['top_products']], ['Teapot'])
+        # Changes that keep the order counted don't touch the rollups
+        for status_name in ('PENDING', 'SHIPPED'):
+            order = Order.all_objects.get(pk=order_id)
+            order.status = status_name
+            order.save()
+        self.assertEqual(self.report().json()['totals']['revenue'], '55.00')
+
+        Order.all_objects.get(pk=order_id).delete()
+        self.assertEqual(self.report().json()['totals'], {
+            'orders': 1, 'units': 1, 'revenue': '30.00', 'average_order_value': '30.00',
+        })
+
+    def test_rebuild_matches_incremental(self):
+        self.place((self.mug, 2), (self.lamp, 1))
+        self.place((self.mug, 1), (self.pot, 2))
+        cancelled = self.place((self.pot, 1))[0]['id']
+        Order.all_objects.filter(pk=cancelled).update(status='CANCELLED')  # no signals
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        Order.all_objects.filter(pk=self.place((self.pot, 3))[0]['id']).update(created_at=yesterday)
+
+        call_command('rebuild_sales_rollups', stdout=io.StringIO())
+        rebuilt = self.rollups()
+        self.assertEqual(len(rebuilt[0]), 3)
+        DailySales.all_objects.all().delete()
+        ProductDailySales.all_objects.all().delete()
+        orders = list(Order.all_objects.all())
+        analytics.record(orders, analytics.order_items([order.id for order in orders]))
+        self.assertEqual(self.rollups(), rebuilt)
+
+    def test_ranges_intervals_and_access(self):
+        with self.settings(ANALYTICS_MAX_DAYS=60):
+            self.place((self.mug, 1))
+            today = timezone.localdate()
+            self.assertEqual(self.report(**{'from': today - datetime.timedelta(days=3), 'to': today - datetime.timedelta(days=1)}).json()['totals']['orders'], 0)
+            self.assertEqual(self.report(interval='month').json()['series'][0]['period'], str(today.replace(day=1)))
+            self.assertEqual(self.report(**{'from': today - datetime.timedelta(days=60)}).status_code, 400)
+            self.assertEqual(self.report(**{'from': 'yesterday'}).status_code, 400)
+            self.assertEqual(self.report(interval='hour').status_code, 400)
+
+        self.assertEqual(self.client.get('/api/analytics/', **self.customer_auth).status_code, 403)
+        other_owner = make_user('other', role='OWNER', tenant=self.other)
+        response = self.client.get('/api/analytics/', HTTP_AUTHORIZATION=f'Bearer {create_token(other_owner)}')
+        self.assertEqual(response.json()['totals']['orders'], 0)
+
+        # Answered from the rollups alone, whatever the order history
+        with CaptureQueriesContext(connection) as ctx:
+            self.report()
+        tables = ' '.join(q['sql'] for q in ctx.captured_queries if 'store_storeuser' not in q['sql'])
+        self.assertNotIn('store_order', tables)
+
+
+@override_settings(EXPORT_BATCH_SIZE=2)
+class OrderExportTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        self.mug = Product.objects.create(tenant=self.shop, name='=HYPERLINK("x")', price='12.50', stock=100)
+        self.pot = Product.objects.create(tenant=self.shop, name='Teapot', price='30.00', stock=100)
+        self.lamp = Product.objects.create(tenant=self.other, name='Lamp', price='45.99', stock=100)
+        self.owner = make_user('owner', role='OWNER', tenant=self.shop)
+        self.customer = make_user('-customer')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.owner)}'}
+        customer_auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.customer)}'}
+        for items in ([(self.mug, 2), (self.pot, 1)], [(self.pot, 1)], [(self.lamp, 1)], [(self.mug, 1)], [(self.pot, 3)]):
+            self.client.post('/api/orders/', {
+                'items': [{'product_id': p.id, 'quantity': q} for p, q in items],
+            }, content_type='application/json', **customer_auth)
+        self.orders = list(Order.all_objects.filter(tenant=self.shop).order_by('id'))
+        self.orders[1].status = 'CANCELLED'
+        self.orders[1].save()
+
+    def export(self, **params):
+        return self.client.get('/api/orders/export/', params, **self.auth)
+
+    def body(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_one_row_per_item(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.export()
+            rows = list(csv.reader(io.StringIO(self.body(response).decode())))
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        self.assertEqual(rows[0][:3], ['order_id', 'created_at', 'status'])
+        self.assertEqual([(int(r[0]), r[2], r[7], r[8], r[9]) for r in rows[1:]], [
+            (self.orders[0].id, 'COMPLETED', '\'=HYPERLINK("x")', '2', '12.50'),
+            (self.orders[0].id, 'COMPLETED', 'Teapot', '1', '30.00'),
+            (self.orders[1].id, 'CANCELLED', 'Teapot', '1', '30.00'),
+            (self.orders[2].id, 'COMPLETED', '\'=HYPERLINK("x")', '1', '12.50'),
+            (self.orders[3].id, 'COMPLETED', 'Teapot', '3', '30.00'),
+        ])
+        self.assertEqual(rows[1][4], "'-customer")
+        self.assertEqual(rows[1][5], '55.00')
+        # 4 orders, 2 per batch: one cursor over orders + one items query per batch
+        queries = [q['sql'] for q in ctx.captured_queries if 'store_storeuser"."password' not in q['sql']]
+        self.assertEqual(len([q for q in queries if 'FROM "store_orderitem"' in q]), 2)
+        self.assertEqual(len([q for q in queries if 'FROM "store_order" ' in q]), 1)
+
+    def test_ndjson_filters_and_gzip(self):
+        response = self.export(type='ndjson', status='completed', **{'from': str(timezone.localdate())})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in self.body(response).splitlines()]
+        self.assertEqual([line['id'] for line in lines], [self.orders[i].id for i in (0, 2, 3)])
+        self.assertEqual(lines[0]['items'][1], {'product_id': self.pot.id, 'product_name': 'Teapot', 'quantity': 1, 'price': '30.00'})
+        detail = self.client.get(f'/api/orders/{self.orders[0].id}/', **self.auth).json()
+        self.assertEqual((lines[0]['created_at'], lines[0]['total_amount']), (detail['created_at'], detail['total_amount']))
+
+        tomorrow = str(timezone.localdate() + datetime.timedelta(days=1))
+        self.assertEqual(self.body(self.export(**{'from': tomorrow})).count(b'\n'), 1)  # header only
+
+        plain = self.body(self.export(type='ndjson'))
+        response = self.export(type='ndjson', gzip='true')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.ndjson.gz"'))
+        self.assertEqual(gzip.decompress(self.body(response)), plain)
+
+    def test_access_and_validation(self):
+        self.assertEqual(self.export(type='xlsx').status_code, 400)
+        self.assertEqual(self.export(status='LOST').status_code, 400)
+        self.assertEqual(self.export(to='last week').status_code, 400)
+        customer = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.customer)}'}
+        self.assertEqual(self.client.get('/api/orders/export/', **customer).status_code, 403)
+        self.assertEqual(self.client.get('/api/orders/export/').status_code, 403)
+
+    async def test_streams_under_asgi(self):
+        response = await self.async_client.get(
+            '/api/orders/export/', {'type': 'ndjson'}, headers={'Authorization': self.auth['HTTP_AUTHORIZATION']},
+        )
+        self.assertTrue(response.streaming)
+        self.assertFalse(hasattr(response.streaming_content, '__iter__'))
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 4)
+
+
+@override_settings(IMPORT_BATCH_SIZE=3)
+class ProductImportTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        self.owner = make_user('owner', role='OWNER', tenant=self.shop)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.owner)}'}
+        self.mug = Product.objects.create(tenant=self.shop, sku='MUG-1', name='Mug', price='12.50', stock=5,
+                                          description='Keep me')
+        Product.objects.create(tenant=self.other, sku='POT-1', name='Not yours', price='1.00')
+
+    def upload(self, body, content_type='text/csv', **params):
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(f'/api/products/import/?{query}', body, content_type=content_type, **self.auth)
+
+    def products(self):
+        return {
+            p.sku: (p.name, str(p.price), p.stock, p.description)
+            for p in Product.all_objects.filter(tenant=self.shop).order_by('sku')
+        }
+
+    def test_csv_upserts_by_sku_and_reports_bad_rows(self):
+        body = (
+            '﻿sku,name,price,stock\n'
+            'MUG-1,Mug XL,14.00,7\n'
+            'POT-1,Teapot,30.00,2\n'
+            'BAD-1,,abc,-1\n'
+            '\n'
+            'LAMP-1,"Lamp, brass",45.99,1\n'
+            'POT-1,Teapot again,31.00,2\n'
+            'KETTLE,Kettle,20.001,3\n'
+            'SHORT,Short\n'
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.upload(body)
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report['created'], report['updated'], report['failed']), (2, 1, 4))
+        self.assertEqual([(e['row'], e['sku']) for e in report['errors']], [
+            (4, 'BAD-1'), (7, 'POT-1'), (8, 'KETTLE'), (9, None),
+        ])
+        self.assertEqual(report['errors'][0]['errors'], {
+            'name': ['This field may not be blank.'],
+            'price': ['A valid number is required.'],
+            'stock': ['Ensure this value is between 0 and 2147483647.'],
+        })
+        self.assertEqual(report['errors'][1]['errors'], {'sku': ['Duplicate sku, already on row 3.']})
+        self.assertEqual(self.products(), {
+            'LAMP-1': ('Lamp, brass', '45.99', 1, ''),
+            'MUG-1': ('Mug XL', '14.00', 7, 'Keep me'),  # description not in the upload, kept
+            'POT-1': ('Teapot', '30.00', 2, ''),
+        })
+        self.assertEqual(Product.all_objects.get(tenant=self.other, sku='POT-1').name, 'Not yours')
+        # One existence check and one upsert per batch of 3 valid rows
+        upserts = [q for q in ctx.captured_queries if 'ON CONFLICT' in q['sql']]
+        self.assertEqual(len(upserts), 1)
+
+    def test_ndjson_partial_updates_and_dry_run(self):
+        body = '\n'.join([
+            json.dumps({'sku': 'MUG-1', 'stock': 50}),
+            json.dumps({'sku': 'NEW-1', 'name': 'New', 'price': 9.5}),
+            json.dumps({'sku': 'NEW-2', 'stock': 1}),
+            json.dumps(['not', 'an', 'object']),
+            json.dumps({'sku': 'NEW-3', 'name': 'X', 'price': '1', 'colour': 'red'}),
+            '{oops',
+        ])
+        preview = self.upload(body, 'application/x-ndjson', dry_run='true').json()
+        self.assertEqual(self.products()['MUG-1'][2], 5)
+        self.assertFalse(Product.all_objects.filter(sku='NEW-1').exists())
+
+        report = self.upload(body, 'application/x-ndjson').json()
+        self.assertEqual({k: report[k] for k in ('created', 'updated', 'failed')}, {'created': 1, 'updated': 1, 'failed': 4})
+        self.assertEqual(preview['errors'], report['errors'])
+        self.assertEqual(report['errors'][0], {'row': 3, 'sku': 'NEW-2', 'errors': {
+            'name': ['Required for a new sku.'], 'price': ['Required for a new sku.'],
+        }})
+        self.assertEqual(self.products()['MUG-1'], ('Mug', '12.50', 50, 'Keep me'))
+        self.assertEqual(self.products()['NEW-1'], ('New', '9.50', 0, ''))
+
+        # New products are searchable and visible in the cached catalog right away
+        response = self.client.get(f'/api/products/search/?q=new&tenant={self.shop.id}')
+        self.assertEqual([p['sku'] for p in response.json()['results']], ['NEW-1'])
+
+    def test_multipart_and_access(self):
+        upload = SimpleUploadedFile('catalog.csv', b'sku,name,price\nCUP-1,Cup,3.00\n', content_type='text/csv')
+        response = self.client.post('/api/products/import/', {'file': upload}, **self.auth)
+        self.assertEqual(response.json()['created'], 1)
+
+        self.assertEqual(self.upload('name,price\nCup,1\n').status_code, 400)
+        self.assertEqual(self.upload('sku\nX\n', type='xlsx').status_code, 400)
+        customer = make_user('customer')
+        response = self.client.post('/api/products/import/', 'sku\nX\n', content_type='text/csv',
+                                    HTTP_AUTHORIZATION=f'Bearer {create_token(customer)}')
+        self.assertEqual(response.status_code, 403)
+
+    def test_sku_unique_per_store_through_the_api(self):
+        response = self.client.post('/api/products/', {'name': 'Mug 2', 'price': '1.00', 'sku': 'MUG-1'},
+                                    content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sku', response.json())
+        response = self.client.post('/api/products/', {'name': 'Pot', 'price': '1.00', 'sku': 'POT-1'},
+                                    content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 201)
+        for _ in range(2):
+            response = self.client.post('/api/products/', {'name': 'No sku', 'price': '1.00', 'sku': ''},
+                                        content_type='application/json', **self.auth)
+            self.assertEqual(response.status_code, 201)
+            self.assertIsNone(response.json()['sku'])
+        response = self.client.patch(f'/api/products/{self.mug.id}/', {'sku': 'MUG-1', 'stock': 1},
+                                     content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+
+
+def image_file(name, size, mode='RGB', fmt='JPEG', **save):
+    buffer = io.BytesIO()
+    from PIL import Image
+    Image.new(mode, size, (200, 30, 30, 128)[:len(mode)]).save(buffer, fmt, **save)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False, MEDIA_URL='/media/', IMAGE_FORMATS=['webp', 'avif'])
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        tenant_registry.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        storages = override_settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': media}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        storages.enable()
+        self.addCleanup(storages.disable)
+        # Inline: pool threads wouldn't see the test transaction
+        patcher = mock.patch.object(images.variant_pool, 'workers', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shop = Tenant.objects.create(name='Shop')
+
+    def create(self, upload, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(tenant=self.shop, name='Mug', price='8.00', image=upload, **fields)
+
+    def test_upload_gets_variants_through_the_api(self):
+        # Stored sideways; EXIF orientation 6 turns it upright
+        from PIL import Image
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        product = self.create(image_file('mug.jpg', (3000, 1500), exif=exif))
+        product.refresh_from_db()
+        variants = product.image_variants
+        self.assertEqual(variants['source'], product.image.name)
+        self.assertEqual([(variants[v]['width'], variants[v]['height']) for v in images.VARIANTS],
+                         [(600, 1200), (240, 480), (80, 160)])
+        storage = product.image.storage
+        with storage.open(variants['card']['webp']) as f:
+            self.assertEqual(Image.open(f).format, 'WEBP')
+        self.assertEqual(set(variants['thumbnail']), {'width', 'height'} | set(images.formats()))
+
+        details = self.client.get(f'/api/products/{product.id}/').json()['image_variants']
+        self.assertEqual(details['card']['webp'],
+                         f'http://testserver/media/variants/{product.image.name}/card.webp')
+        for flags in ({'FAST_LIST_SERIALIZATION': False}, {'FAST_LIST_SERIALIZATION': True}):
+            with override_settings(ASYNC_CATALOG_VIEWS=False, **flags):
+                listed = self.client.get('/api/products/?fields=card').json()['results'][0]
+            self.assertEqual(listed['image_variants'], details)
+
+    def test_replacement_and_small_images(self):
+        product = self.create(image_file('logo.png', (100, 40), mode='RGBA', fmt='PNG'))
+        product.refresh_from_db()
+        old = images.variant_files(product.image_variants)
+        self.assertEqual(product.image_variants['detail']['width'], 100)  # never upscaled
+        self.assertTrue(all(product.image.storage.exists(path) for path in old))
+
+        product.image = image_file('new.jpg', (800, 800))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['detail']['width'], 800)
+        self.assertFalse(any(product.image.storage.exists(path) for path in old))
+
+        # Saving again with current variants queues nothing
+        with mock.patch.object(images.variant_pool, 'submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        submit.assert_not_called()
+
+    def test_unreadable_image_and_backfill(self):
+        broken = self.create(SimpleUploadedFile('broken.jpg', b'not an image'))
+        broken.refresh_from_db()
+        self.assertIn('error', broken.image_variants)
+        self.assertIsNone(self.client.get(f'/api/products/{broken.id}/').json()['image_variants'])
+
+        # Written around save(), e.g. before this pipeline existed
+        product = self.create(image_file('old.jpg', (600, 600)))
+        Product.objects.filter(pk=product.pk).update(image_variants=None)
+        logo = product.image.storage.save('tenant_logos/logo.png', image_file('logo.png', (300, 300), fmt='PNG'))
+        Tenant.objects.filter(pk=self.shop.pk).update(logo=logo)
+
+        def backfill(*args):
+            out = io.StringIO()
+            call_command('backfill_image_variants', '--workers', '0', *args, stdout=out)
+            return out.getvalue()
+
+        out = backfill()
+        self.assertIn('product: 1 generated, 0 failed', out)
+        self.assertIn('tenant: 1 generated', out)
+        self.shop.refresh_from_db()
+        self.assertEqual(self.shop.logo_variants['thumbnail']['width'], 160)
+        self.assertIn('product: 0 generated, 0 failed', backfill())
+        self.assertIn('product: 1 generated, 1 failed', backfill('--force', '--model', 'product'))
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False, MEDIA_URL='/media/', UPLOAD_SIGNER='store.uploads.LocalUploadSigner')
+class DirectUploadTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        tenant_registry.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        storages = override_settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': media}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        storages.enable()
+        self.addCleanup(storages.disable)
+        patcher = mock.patch.object(images.variant_pool, 'workers', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shop = Tenant.objects.create(name='Shop')
+        self.owner = make_user('owner', role='OWNER', tenant=self.shop)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.owner)}'}
+        self.mug = Product.objects.create(tenant=self.shop, name='Mug', price='8.00')
+        self.jpeg = image_file('mug.jpg', (900, 600)).read()
+
+    def start(self, body, path=None):
+        md5 = base64.b64encode(hashlib.md5(body).digest()).decode()
+        return self.client.post(path or f'/api/products/{self.mug.id}/image-upload/',
+                                {'content_type': 'image/jpeg', 'size': len(body), 'md5': md5},
+                                content_type='application/json', **self.auth)
+
+    def put(self, target, body, **headers):
+        headers = {**target['headers'], **headers}
+        return self.client.put(target['url'], body, content_type=headers.pop('Content-Type'), headers=headers)
+
+    def finalize(self, token, path=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(path or f'/api/products/{self.mug.id}/image-upload/finalize/', {'token': token},
+                                    content_type='application/json', **self.auth)
+
+    def test_upload_put_finalize(self):
+        target = self.start(self.jpeg).json()
+        self.assertEqual(target['method'], 'PUT')
+        self.assertTrue(target['key'].startswith('products/') and target['key'].endswith('.jpg'))
+        self.assertEqual(self.put(target, self.jpeg).status_code, 201)
+
+        response = self.finalize(target['token'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['image'], f"http://testserver/media/{target['key']}")
+        self.mug.refresh_from_db()
+        self.assertEqual(self.mug.image.name, target['key'])
+        self.assertEqual(self.mug.image_variants['detail']['width'], 900)
+
+    def test_integrity_checks(self):
+        target = self.start(self.jpeg).json()
+        # The target only takes the promised bytes with the signed headers
+        self.assertEqual(self.put(target, self.jpeg[:-1]).status_code, 400)
+        self.assertEqual(self.put(target, self.jpeg[:-1] + b'x').status_code, 400)
+        self.assertEqual(self.put(target, self.jpeg, **{'Content-Type': 'image/png'}).status_code, 400)
+        self.assertEqual(self.finalize(target['token']).status_code, 400)  # nothing uploaded
+
+        # Whatever ends up under the key is checked again on finalize
+        storage = self.mug.image.storage
+        storage.save(target['key'], io.BytesIO(b'x' * len(self.jpeg)))
+        response = self.finalize(target['token'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('MD5', response.json()['file'][0])
+        self.assertFalse(storage.exists(target['key']))
+
+        text = b'not a jpeg at all'
+        target = self.start(text).json()
+        self.assertEqual(self.put(target, text).status_code, 201)
+        self.assertEqual(self.finalize(target['token']).json(), {'file': ['Not a valid image/jpeg image.']})
+        self.mug.refresh_from_db()
+        self.assertFalse(self.mug.image)
+
+    def test_tokens_and_access(self):
+        target = self.start(self.jpeg).json()
+        self.put(target, self.jpeg)
+        other = Product.objects.create(tenant=self.shop, name='Pot', price='1.00')
+        response = self.finalize(target['token'], f'/api/products/{other.id}/image-upload/finalize/')
+        self.assertEqual(response.json(), {'token': ['This upload belongs to something else.']})
+        self.assertEqual(self.finalize(target['token'] + 'x').json(), {'token': ['Invalid upload token.']})
+        with override_settings(UPLOAD_FINALIZE_TTL=-1):
+            self.assertIn('expired', self.finalize(target['token']).json()['token'][0])
+
+        self.assertEqual(self.start(b'x' * 11).status_code, 201)
+        with override_settings(UPLOAD_MAX_BYTES=10):
+            self.assertEqual(self.start(b'x' * 11).status_code, 400)
+        customer = make_user('customer', tenant=self.shop)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(customer)}'}
+        self.assertEqual(self.start(self.jpeg).status_code, 403)
+
+        # Logos: the store's own owner or staff only
+        rival = make_user('rival', role='OWNER', tenant=Tenant.objects.create(name='Rival'))
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(rival)}'}
+        self.assertEqual(self.start(self.jpeg, f'/api/tenants/{self.shop.id}/logo-upload/').status_code, 403)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.owner)}'}
+        target = self.start(self.jpeg, f'/api/tenants/{self.shop.id}/logo-upload/').json()
+        self.put(target, self.jpeg)
+        response = self.finalize(target['token'], f'/api/tenants/{self.shop.id}/logo-upload/finalize/')
+        self.assertEqual(response.json()['logo'], f"http://testserver/media/{target['key']}")
+        self.shop.refresh_from_db()
+        self.assertEqual(self.shop.logo_variants['thumbnail']['width'], 160)
+
+        with override_settings(UPLOAD_SIGNER='store.uploads.GCSUploadSigner'):
+            self.assertEqual(self.put(target, self.jpeg).status_code, 404)
+
+    def test_signers_must_implement_target_and_stat(self):
+        class NoStat(uploads.UploadSigner):
+            def target(self, request, key, token, content_type, size, md5, expires_at):
+                return {}
+
+        with self.assertRaises(TypeError):
+            NoStat(storage=None)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.other = Tenant.objects.create(name='Other')
+        self.mug = Product.objects.create(tenant=self.shop, name='Mug', price='12.50', stock=5)
+        self.lamp = Product.objects.create(tenant=self.other, name='Lamp', price='45.99', stock=1)
+        self.customer = make_user('customer')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.customer)}'}
+
+    def place(self, *items, key=None, queued=False, auth=None):
+        headers = {}
+        if key:
+            headers['HTTP_IDEMPOTENCY_KEY'] = key
+        if queued:
+            headers['HTTP_PREFER'] = 'respond-async'
+        return self.client.post('/api/orders/', {
+            'items': [{'product_id': p.id, 'quantity': q} for p, q in items],
+        }, content_type='application/json', **(auth or self.auth), **headers)
+
+    def work(self):
+        call_command('process_checkouts', '--once', stdout=io.StringIO())
+
+    def test_queued_checkout_is_placed_by_the_worker(self):
+        response = self.place((self.mug, 2), (self.lamp, 1), queued=True)
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual(job['status'], 'QUEUED')
+        self.assertEqual(response['Location'], job['url'])
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(self.client.get(job['url'], **self.auth).json()['orders'], [])
+
+        self.work()
+        job = self.client.get(job['url'], **self.auth).json()
+        self.assertEqual(job['status'], 'DONE')
+        self.assertEqual(sorted(order['total_amount'] for order in job['orders']), ['25.00', '45.99'])
+        self.assertEqual({order['status'] for order in job['orders']}, {'PENDING'})
+        self.assertEqual(dict(Product.all_objects.values_list('name', 'stock')), {'Mug': 3, 'Lamp': 0})
+        self.assertEqual(str(DailySales.all_objects.get(tenant=self.shop).revenue), '25.00')
+
+        # Someone else's checkout
+        other = {'HTTP_AUTHORIZATION': f'Bearer {create_token(make_user("other"))}'}
+        self.assertEqual(self.client.get(job['url'], **other).status_code, 404)
+
+    def test_orders_cannot_be_moved_into_a_checkout(self):
+        job = self.place((self.mug, 1), key='cart-1').json()
+        checkout_id = Order.objects.get(customer=self.customer).checkout_id
+        owner = make_user('owner', role='OWNER', tenant=self.other)
+        foreign = Order.objects.create(tenant=self.other, customer=make_user('buyer'), total_amount='45.99')
+
+        response = self.client.patch(
+            f'/api/orders/{foreign.id}/', {'checkout': str(checkout_id)}, content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {create_token(owner)}',
+        )
+        self.assertEqual(response.status_code, 200)
+        foreign.refresh_from_db()
+        self.assertIsNone(foreign.checkout_id)
+
+        # Even if one got there, the checkout lists only its customer's orders
+        Order.all_objects.filter(pk=foreign.pk).update(checkout_id=checkout_id)
+        orders = self.client.get(f'/api/checkouts/{checkout_id}/', **self.auth).json()['orders']
+        self.assertEqual([order['id'] for order in orders], [job[0]['id']])
+
+    def test_worker_rejects_one_cart_and_places_the_rest(self):
+        self.place((self.lamp, 1), queued=True)
+        rejected = self.place((self.lamp, 1), queued=True).json()
+        placed = self.place((self.mug, 1), queued=True).json()
+        self.work()
+        rejected = self.client.get(rejected['url'], **self.auth).json()
+        self.assertEqual((rejected['status'], rejected['error']), ('REJECTED', 'Not enough stock for Lamp'))
+        self.assertEqual(self.client.get(placed['url'], **self.auth).json()['status'], 'DONE')
+        self.assertEqual(Order.objects.count(), 2)
+
+        with mock.patch('store.checkout.place_orders', side_effect=RuntimeError('boom')), \
+                override_settings(CHECKOUT_MAX_ATTEMPTS=2):
+            job = self.place((self.mug, 1), queued=True).json()
+            checkout.process_batch(10)
+            self.assertEqual(self.client.get(job['url'], **self.auth).json()['status'], 'QUEUED')
+            checkout.process_batch(10)
+        job = self.client.get(job['url'], **self.auth).json()
+        self.assertEqual((job['status'], job['error']), ('FAILED', 'RuntimeError: boom'))
+
+    def test_idempotency_key_replays_the_first_response(self):
+        first = self.place((self.mug, 1), key='k1')
+        again = self.place((self.mug, 1), key='k1')
+        self.assertEqual(again.status_code, 201)
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(Product.all_objects.get(pk=self.mug.pk).stock, 4)
+
+        self.assertEqual(self.place((self.mug, 2), key='k1').status_code, 422)
+        other = {'HTTP_AUTHORIZATION': f'Bearer {create_token(make_user("other"))}'}
+        self.assertEqual(self.place((self.mug, 1), key='k1', auth=other).status_code, 201)
+
+        # A failed cart isn't remembered, the retry is tried again
+        self.assertEqual(self.place((self.lamp, 2), key='k2').status_code, 400)
+        self.assertFalse(Checkout.objects.filter(idempotency_key='k2').exists())
+
+        queued = self.place((self.mug, 1), key='k3', queued=True).json()
+        self.assertEqual(self.place((self.mug, 1), key='k3', queued=True).json()['id'], queued['id'])
+        self.assertEqual(self.place((self.mug, 1), key='k3').status_code, 202)  # still queued
+        self.work()
+        self.assertEqual(self.place((self.mug, 1), key='k3').status_code, 201)
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 2)
+
+        self.assertEqual(checkout.purge(1), 0)
+        Checkout.objects.update(created_at=timezone.now() - datetime.timedelta(hours=2))
+        self.assertEqual(checkout.purge(1), 3)
+        self.assertEqual(Order.objects.filter(checkout__isnull=True).count(), 3)
+
+
+@override_settings(RESERVATION_BACKEND='local', RESERVATION_SYNC_INTERVAL=0, RESERVATION_TTL=600)
+class ReservationTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.engine = reservations.get_engine()
+        self.engine.client.flushall()
+        self.shop = Tenant.objects.create(name='Shop')
+        self.hot = Product.objects.create(tenant=self.shop, name='Hot', price='10.00', stock=3)
+        self.mug = Product.objects.create(tenant=self.shop, name='Mug', price='5.00', stock=1)
+        self.owner = make_user('owner', role='OWNER', tenant=self.shop)
+        self.customer = make_user('customer')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {create_token(self.customer)}'}
+        response = self.client.post(f'/api/products/{self.hot.id}/reserve-stock/',
+                                    HTTP_AUTHORIZATION=f'Bearer {create_token(self.owner)}')
+        self.assertEqual(response.json(), {'product_id': self.hot.id, 'available': 3, 'held': 0})
+
+    def hold(self, product, quantity, auth=None):
+        return self.client.post('/api/reservations/', {'product_id': product.id, 'quantity': quantity},
+                                content_type='application/json', **(auth or self.auth))
+
+    def place(self, *items, holds=(), auth=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/orders/', {
+                'items': [{'product_id': p.id, 'quantity': q} for p, q in items], 'holds': list(holds),
+            }, content_type='application/json', **(auth or self.auth))
+
+    def counters(self):
+        return self.engine.counters([self.hot.id])[self.hot.id]
+
+    def test_holds_are_checked_out_and_applied_to_stock(self):
+        first = self.hold(self.hot, 2)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json()['quantity'], 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.hold(self.hot, 2).status_code, 409)
+        self.assertEqual(self.counters(), (1, 2))
+        self.assertEqual(self.hold(self.mug, 1).status_code, 400)  # not enrolled
+
+        # Uses the hold, takes a fresh one for the third unit; the mug goes through the row
+        with CaptureQueriesContext(connection) as queries:
+            response = self.place((self.hot, 3), (self.mug, 1), holds=[first.json()['id']])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.counters(), (0, 0))
+        # Only the mug's row is updated
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "store_product"')]), 1)
+        self.assertEqual(dict(Product.all_objects.values_list('name', 'stock')), {'Hot': 3, 'Mug': 0})
+        self.assertEqual(self.client.get(f"/api/reservations/{first.json()['id']}/", **self.auth).status_code, 404)
+        self.assertEqual(self.place((self.hot, 1)).json(), {'error': 'Not enough stock for Hot'})
+
+        self.assertEqual(reservations.sync(self.engine)['flushed'], 3)
+        self.assertEqual(Product.all_objects.get(pk=self.hot.pk).stock, 0)
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_queued_checkout_uses_its_holds(self):
+        held = self.hold(self.hot, 2).json()
+        response = self.client.post('/api/orders/', {
+            'items': [{'product_id': self.hot.id, 'quantity': 2}], 'holds': [held['id']],
+        }, content_type='application/json', HTTP_PREFER='respond-async', **self.auth)
+        self.assertEqual(response.status_code, 202)
+        # Still the customer's while queued
+        self.assertEqual(self.hold(self.hot, 2).status_code, 409)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('process_checkouts', '--once', stdout=io.StringIO())
+        self.assertEqual(Checkout.objects.get().status, 'DONE')
+        self.assertEqual(self.counters(), (1, 0))
+        self.assertEqual(list(OrderItem.objects.values_list('quantity', 'stock_pending')), [(2, True)])
+
+    def test_expired_and_released_holds_return_their_units(self):
+        kept = self.hold(self.hot, 1).json()
+        other = {'HTTP_AUTHORIZATION': f'Bearer {create_token(make_user("other"))}'}
+        self.assertEqual(self.client.delete(f"/api/reservations/{kept['id']}/", **other).status_code, 404)
+        self.assertEqual(self.client.delete(f"/api/reservations/{kept['id']}/", **self.auth).status_code, 204)
+        self.assertEqual(self.counters(), (3, 0))
+
+        with override_settings(RESERVATION_TTL=-1):
+            expired = self.hold(self.hot, 2).json()
+        self.assertEqual(self.counters(), (1, 2))
+        self.assertEqual(self.engine.reap(), 1)
+        self.assertEqual(self.counters(), (3, 0))
+        # Gone for good: checking out with it takes fresh stock instead
+        self.assertEqual(self.place((self.hot, 1), holds=[expired['id']]).status_code, 201)
+        self.assertEqual(self.counters(), (2, 0))
+
+    def test_failed_checkout_hands_the_units_back(self):
+        held = self.hold(self.hot, 2).json()
+        # The mug sells out between the early check and the UPDATE
+        with mock.patch('store.checkout.deduct_stock', return_value=0):
+            response = self.place((self.hot, 2), (self.mug, 1), holds=[held['id']])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.counters(), (3, 0))
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_reconcile_follows_the_stock_column(self):
+        self.hold(self.hot, 1)
+        Product.all_objects.filter(pk=self.hot.pk).update(stock=10)  # restocked through an import
+        self.assertEqual(reservations.reconcile(self.engine), {self.hot.id: 7})
+        self.assertEqual(self.counters(), (9, 1))
+
+        # A checkout that died between claiming and committing: its claim is
+        # dropped once stale, and reconcile puts the units back
+        claims = self.engine.acquire(self.customer.id, {self.hot.id: 4})
+        self.assertEqual(self.counters(), (5, 5))
+        self.assertEqual(self.engine.reap(now=time.time() + 601), 2)  # with the cart hold
+        self.assertEqual(self.counters(), (6, 0))
+        self.assertEqual(reservations.reconcile(self.engine), {self.hot.id: 4})
+        self.assertEqual(self.counters(), (10, 0))
+        self.engine.settle(claims)  # too late, already dropped
+        self.assertEqual(self.counters(), (10, 0))
+
+        self.assertEqual(self.client.delete(f'/api/products/{self.hot.id}/reserve-stock/',
+                                            HTTP_AUTHORIZATION=f'Bearer {create_token(self.owner)}').status_code, 204)
+        self.assertEqual(self.hold(self.hot, 1).status_code, 400)
+        self.assertEqual(self.place((self.hot, 2)).status_code, 201)
+        self.assertEqual(Product.all_objects.get(pk=self.hot.pk).stock, 8)
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN of the hot tenant-scoped queries, on a seeded database: none may
+    read a whole table. PostgreSQL is told to avoid sequential scans, so a
+    small test table still shows whether an index could serve the query.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', prefix='plan', tenants=4, products=200, customers=40, orders=400,
+                     seed=3, stdout=io.StringIO())
+        cls.tenant = Tenant.objects.filter(name__startswith='plan shop').order_by('id').first()
+        cls.product = Product.all_objects.filter(tenant=cls.tenant).exclude(category='').first()
+        cls.order = Order.all_objects.filter(tenant=cls.tenant).first()
+
+    def plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Small tables would be read sequentially whatever the indexes
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def full_scans(self, plan):
+        """Tables read in full. SQLite's "SCAN t USING INDEX i" walks an index in order, that's fine."""
+        if connection.vendor == 'postgresql':
+            return re.findall(r'Seq Scan on (\w+)', plan)
+        return re.findall(r'\bSCAN (\w+)\b(?! USING)', plan)
+
+    def hot_queries(self):
+        """{name: (queryset, the index it should use or None)}"""
+        order, product = self.order, self.product
+        with tenant_context(self.tenant):
+            products = Product.objects.all()
+            return {
+                'product list': (products.order_by('-created_at', '-id')[:51], 'product_tenant_created_idx'),
+                'product list, next page': (
+                    products.filter(created_at__lte=product.created_at)
+                    .exclude(created_at=product.created_at, id__gte=product.id).order_by('-created_at', '-id')[:51],
+                    'product_tenant_created_idx',
+                ),
+                'category': (
+                    search.apply_filters(products, {'category': [product.category]}).order_by('-created_at', '-id')[:51],
+                    'product_tenant_category_idx',
+                ),
+                'category facets': (
+                    products.order_by().values('category').annotate(count=Count('id')).order_by('-count', 'category'),
+                    'product_tenant_category_idx',
+                ),
+                'store orders': (Order.objects.order_by('-created_at', '-id')[:51], 'order_tenant_created_idx'),
+                'customer orders': (
+                    Order.all_objects.filter(customer_id=order.customer_id).order_by('-created_at', '-id')[:51],
+                    'order_customer_created_idx',
+                ),
+                'order items': (OrderItem.objects.filter(order_id__in=[order.id]), None),
+                'order export': (
+                    Order.all_objects.filter(tenant_id=self.tenant.id, created_at__gte=order.created_at,
+                                             status__in=['PAID']).order_by('created_at', 'id'),
+                    'order_tenant_created_idx',
+                ),
+                'admin status filter': (
+                    Order.all_objects.filter(status='PAID').order_by('-created_at')[:100], 'order_status_created_idx',
+                ),
+                'sales by day': (
+                    DailySales.all_objects.filter(tenant_id=self.tenant.id, day__gte=datetime.date(2026, 1, 1)), None,
+                ),
+                'top products': (
+                    ProductDailySales.all_objects.filter(tenant_id=self.tenant.id, day__gte=datetime.date(2026, 1, 1)),
+                    None,
+                ),
+                'checkout queue': (
+                    Checkout.objects.filter(status='QUEUED').order_by('created_at')[:50], 'checkout_queued_idx',
+                ),
+                'reserved stock': (
+                    OrderItem.objects.filter(stock_pending=True, product_id__in=[product.id]),
+                    'orderitem_stock_pending_idx',
+                ),
+            }
+
+    def test_hot_queries_use_indexes(self):
+        for name, (queryset, index) in self.hot_queries().items():
+            with self.subTest(name):
+                plan = self.plan(queryset)
+                self.assertEqual(self.full_scans(plan), [], plan)
+                if index:
+                    self.assertIn(index, plan)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'copies of the SQLite test database stand in for the replicas')
+@override_settings(DATABASE_REPLICAS=['replica_a', 'replica_b'], REPLICA_CHECK_INTERVAL=60, REPLICA_MAX_LAG=5,
+                   RESPONSE_CACHE_ENABLED=False)
+class ReadReplicaTests(TransactionTestCase):
+    def setUp(self):
+        principal_cache.clear()
+        cache.clear()
+        patcher = mock.patch.object(replicas, 'pool', replicas.ReplicaPool())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Configured per test, after the test case has set up its databases
+        patcher = mock.patch.object(type(self), 'databases', self.databases | {'replica_a', 'replica_b'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.addCleanup(self.drop_replicas)
+
+        self.shop = Tenant.objects.create(name='Shop')
+        self.owner = make_user('owner', role='OWNER', tenant=self.shop)
+        self.customer = make_user('customer')
+        self.product = Product.objects.create(tenant=self.shop, name='Mug', price='5.00', stock=10)
+        Order.objects.create(tenant=self.shop, customer=self.customer, total_amount='5.00')
+        replicas.beat(timezone.now())
+        # Writing the product pinned the catalog
+        cache.clear()
+
+    def replicate(self, alias):
+        """Point `alias` at a copy of the primary as it is now."""
+        path = f'{self.directory}/{alias}.sqlite3'
+        source, target = sqlite3.connect(connection.settings_dict['NAME']), sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        self.drop_replicas(alias)
+        connections.settings[alias] = {**connection.settings_dict, 'NAME': path}
+
+    def drop_replicas(self, *aliases):
+        for alias in aliases or ('replica_a', 'replica_b'):
+            if alias in connections.settings:
+                connections[alias].close()
+                del connections[alias]
+                del connections.settings[alias]
+
+    def rename(self, name):
+        Product.all_objects.filter(pk=self.product.pk).update(name=name)
+
+    def product_name(self, client=None):
+        response = (client or self.client).get(f'/api/products/{self.product.pk}/', HTTP_X_TENANT_ID=str(self.shop.pk))
+        return response.json()['name']
+
+    def history(self, user):
+        response = self.client.get('/api/orders/', HTTP_AUTHORIZATION=f'Bearer {create_token(user)}')
+        return len(response.json()['results'])
+
+    def test_reads_go_to_the_replicas_in_turn(self):
+        self.rename('A')
+        self.replicate('replica_a')
+        self.rename('B')
+        self.replicate('replica_b')
+        self.rename('Primary')
+        Order.objects.create(tenant=self.shop, customer=self.customer, total_amount='5.00')
+
+        for async_views in (True, False):
+            with self.subTest(async_views=async_views), override_settings(ASYNC_CATALOG_VIEWS=async_views):
+                self.assertEqual(sorted(self.product_name() for _ in range(4)), ['A', 'A', 'B', 'B'])
+        # The second order isn't on the replicas yet
+        self.assertEqual(self.history(self.customer), 1)
+
+    def test_rows_read_from_a_replica_are_saved_to_the_primary(self):
+        self.replicate('replica_a')
+        with replicas.reading('replica_a'):
+            product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product._state.db, 'replica_a')
+        product.name = 'Saved'
+        product.save()
+        self.assertEqual(Product.all_objects.get(pk=self.product.pk).name, 'Saved')
+        self.assertEqual(Product.all_objects.using('replica_a').get(pk=self.product.pk).name, 'Mug')
+
+    def test_writers_read_their_own_writes(self):
+        self.replicate('replica_a')
+        self.replicate('replica_b')
+        other = make_user('other')
+
+        response = self.client.post(
+            '/api/orders/', {'items': [{'product_id': self.product.pk, 'quantity': 1}]},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {create_token(self.customer)}',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.history(self.customer), 2)
+        self.assertEqual(self.history(other), 0)
+
+        response = self.client.patch(
+            f'/api/products/{self.product.pk}/', {'name': 'Renamed'}, content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {create_token(self.owner)}',
+        )
+        self.assertEqual(response.status_code, 200)
+        # A catalog write pins the catalog for every client
+        self.assertEqual(self.product_name(), 'Renamed')
+        self.assertEqual(replicas.pool.stats()['pinned'], 2)
+
+        # Pins expired: back on the replicas, which haven't caught up
+        cache.clear()
+        self.assertEqual(self.history(self.customer), 1)
+        self.assertEqual(self.product_name(), 'Mug')
+
+    def test_lagging_and_unreachable_replicas_are_dropped(self):
+        self.replicate('replica_a')
+        self.replicate('replica_b')
+        self.rename('Primary')
+        ReplicaHeartbeat.objects.using('replica_b').update(written_at=timezone.now() - datetime.timedelta(minutes=1))
+
+        self.assertEqual([self.product_name() for _ in range(3)], ['Mug'] * 3)
+        stats = replicas.pool.stats()['replicas']
+        self.assertEqual((stats['replica_a']['lag'], stats['replica_a']['reads']), (0, 3))
+        self.assertGreater(stats['replica_b']['lag'], 55)
+
+        self.drop_replicas('replica_a')
+        connections.settings['replica_a'] = {**connection.settings_dict, 'NAME': f'{self.directory}/gone/a.sqlite3'}
+        replicas.pool.checked_at = None
+        self.assertEqual(self.product_name(), 'Primary')
+        stats = replicas.pool.stats()
+        self.assertIsNone(stats['replicas']['replica_a']['lag'])
+        self.assertIn('unable to open', stats['replicas']['replica_a']['error'])
+        self.assertEqual(stats['fallbacks'], 1)
+
+        # Caught up again
+        self.replicate('replica_b')
+        replicas.pool.checked_at = None
+        self.assertEqual(self.product_name(), 'Primary')
+        self.assertEqual(replicas.pool.stats()['replicas']['replica_b']['lag'], 0)
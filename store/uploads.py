@@ -0,0 +1,225 @@
+import io
+import abc
+import uuid
+import base64
+import hashlib
+import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image
+from rest_framework.exceptions import ValidationError, NotFound
+
+from .models import Product, Tenant
+
+# Direct uploads: the API hands out a short-lived signed PUT target and the
+# client sends the bytes straight to storage, so no worker is held for the
+# transfer. A finalize call then checks the stored object and attaches it.
+#
+#   POST .../image-upload/ {content_type, size, md5}  -> {method, url, headers, key, token, expires_at}
+#   PUT <url> with exactly `headers` and the bytes
+#   POST .../image-upload/finalize/ {token}           -> the updated object
+#
+# The token is a signed record (django.core.signing) of the object key, its
+# owner and the promised type, size and base64 MD5, so no upload state is
+# stored. Storage rejects bytes not matching the signed Content-MD5, and
+# finalize checks size, MD5 and that the first bytes are an image of the
+# declared type before setting the field; store.images takes it from there.
+
+CONTENT_TYPES = {
+    'image/jpeg': ('JPEG', 'jpg'),
+    'image/png': ('PNG', 'png'),
+    'image/webp': ('WEBP', 'webp'),
+    'image/gif': ('GIF', 'gif'),
+    'image/avif': ('AVIF', 'avif'),
+}
+# Enough for Pillow to read the header, large EXIF blocks included
+HEAD_BYTES = 256 * 1024
+SALT = 'store.uploads'
+# model -> the file field uploads are attached to
+TARGETS = {Product: 'image', Tenant: 'logo'}
+MODELS = {model._meta.label_lower: model for model in TARGETS}
+
+
+class UploadSigner(abc.ABC):
+    """
+    Issues upload targets for a storage and inspects what was uploaded.
+    UPLOAD_SIGNER names the class to use for the file fields' storage.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    @abc.abstractmethod
+    def target(self, request, key, token, content_type, size, md5, expires_at):
+        """{'method', 'url', 'headers'} the client must PUT the bytes to."""
+
+    @abc.abstractmethod
+    def stat(self, key):
+        """{'size', 'md5'} (MD5 base64 encoded) of the stored object, None if there's none."""
+
+    def head(self, key, length):
+        with self.storage.open(key, 'rb') as f:
+            return f.read(length)
+
+    def delete(self, key):
+        self.storage.delete(key)
+
+
+class LocalUploadSigner(UploadSigner):
+    """
+    Stand-in for development and tests: the target is this API's own
+    PUT /api/uploads/<token>/, which checks the body like a signed storage URL
+    would and saves it to the storage. The bytes do go through Django.
+    """
+
+    def target(self, request, key, token, content_type, size, md5, expires_at):
+        return {
+            'method': 'PUT',
+            'url': request.build_absolute_uri(reverse('upload-target', args=[token])),
+            'headers': {'Content-Type': content_type, 'Content-MD5': md5},
+        }
+
+    def stat(self, key):
+        if not self.storage.exists(key):
+            return None
+        digest = hashlib.md5()
+        with self.storage.open(key, 'rb') as f:
+            for chunk in f.chunks():
+                digest.update(chunk)
+        return {'size': self.storage.size(key), 'md5': base64.b64encode(digest.digest()).decode()}
+
+
+class GCSUploadSigner(UploadSigner):
+    """V4 signed PUT URLs for the django-storages GoogleCloudStorage bucket."""
+
+    def __init__(self, storage):
+        super().__init__(storage)
+        # Otherwise storage.url() returns plain public URLs
+        if storage.default_acl == 'publicRead' or not storage.querystring_auth:
+            raise ImproperlyConfigured('Direct uploads need signed URLs: GS_QUERYSTRING_AUTH on, no publicRead ACL.')
+
+    def target(self, request, key, token, content_type, size, md5, expires_at):
+        # Signed with the object key, type, MD5 and exact length; GCS refuses anything else
+        length = f'{size},{size}'
+        url = self.storage.url(key, parameters={
+            'method': 'PUT',
+            'expiration': expires_at,
+            'content_type': content_type,
+            'content_md5': md5,
+            'headers': {'x-goog-content-length-range': length},
+        })
+        return {
+            'method': 'PUT',
+            'url': url,
+            'headers': {'Content-Type': content_type, 'Content-MD5': md5, 'x-goog-content-length-range': length},
+        }
+
+    def blob_name(self, key):
+        from storages.utils import clean_name, safe_join
+        return safe_join(self.storage.location, clean_name(key))
+
+    def stat(self, key):
+        # Metadata only, the object isn't downloaded
+        blob = self.storage.bucket.get_blob(self.blob_name(key))
+        return None if blob is None else {'size': blob.size, 'md5': blob.md5_hash}
+
+    def head(self, key, length):
+        return self.storage.bucket.blob(self.blob_name(key)).download_as_bytes(start=0, end=length - 1)
+
+
+def storage_for(model):
+    return model._meta.get_field(TARGETS[model]).storage
+
+
+def get_signer(model):
+    return import_string(settings.UPLOAD_SIGNER)(storage_for(model))
+
+
+def claim_for(instance):
+    return [instance._meta.label_lower, instance.pk]
+
+
+def start_upload(request, instance, content_type, size, md5):
+    """The signed target and finalize token for a new upload to `instance`'s file field."""
+    model_field = instance._meta.get_field(TARGETS[type(instance)])
+    # Under upload_to like a multipart upload, never an existing object
+    key = model_field.generate_filename(instance, f'{uuid.uuid4().hex}.{CONTENT_TYPES[content_type][1]}')
+    expires_at = timezone.now() + datetime.timedelta(seconds=settings.UPLOAD_URL_TTL)
+    token = signing.dumps({
+        'for': claim_for(instance), 'key': key, 'content_type': content_type, 'size': size, 'md5': md5,
+    }, salt=SALT, compress=True)
+    target = get_signer(type(instance)).target(request, key, token, content_type, size, md5, expires_at)
+    return {**target, 'key': key, 'token': token, 'expires_at': expires_at}
+
+
+def load_token(token, max_age):
+    try:
+        return signing.loads(token, salt=SALT, max_age=max_age)
+    except signing.SignatureExpired:
+        raise ValidationError({'token': ['This upload has expired, start a new one.']})
+    except signing.BadSignature:
+        raise ValidationError({'token': ['Invalid upload token.']})
+
+
+def identify(head):
+    """Pillow's format name for the first bytes of an image, None if they aren't one."""
+    try:
+        # Only the header is parsed; oversized dimensions raise DecompressionBombError
+        with Image.open(io.BytesIO(head)) as image:
+            return image.format
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def finalize_upload(instance, token):
+    """Check the uploaded object promised by `token` and attach it to `instance`."""
+    claim = load_token(token, settings.UPLOAD_FINALIZE_TTL)
+    if claim['for'] != claim_for(instance):
+        raise ValidationError({'token': ['This upload belongs to something else.']})
+    signer = get_signer(type(instance))
+    key = claim['key']
+    stat = signer.stat(key)
+    if stat is None:
+        raise ValidationError({'token': ['Nothing has been uploaded for this token yet.']})
+
+    if stat['size'] != claim['size']:
+        problem = f"Uploaded {stat['size']} bytes, expected {claim['size']}."
+    elif stat['md5'] != claim['md5']:
+        problem = 'The uploaded bytes do not match the MD5 checksum.'
+    else:
+        expected = CONTENT_TYPES[claim['content_type']][0]
+        problem = None if identify(signer.head(key, HEAD_BYTES)) == expected else f"Not a valid {claim['content_type']} image."
+    if problem:
+        signer.delete(key)
+        raise ValidationError({'file': [problem]})
+
+    field = TARGETS[type(instance)]
+    setattr(instance, field, key)
+    instance.save(update_fields=[field])
+    return instance
+
+
+def receive(request, token):
+    """Body of a PUT to a LocalUploadSigner target, checked as GCS checks a signed PUT."""
+    if not issubclass(import_string(settings.UPLOAD_SIGNER), LocalUploadSigner):
+        raise NotFound()
+    claim = load_token(token, settings.UPLOAD_URL_TTL)
+    if request.content_type != claim['content_type'] or request.headers.get('Content-MD5') != claim['md5']:
+        raise ValidationError({'detail': ['Content-Type and Content-MD5 must be the signed ones.']})
+    # At most UPLOAD_MAX_BYTES, checked when the upload was started
+    body = request.read(claim['size'] + 1)
+    if len(body) != claim['size']:
+        raise ValidationError({'detail': [f"Expected {claim['size']} bytes."]})
+    if base64.b64encode(hashlib.md5(body).digest()).decode() != claim['md5']:
+        raise ValidationError({'detail': ['The bytes do not match Content-MD5.']})
+
+    storage = storage_for(MODELS[claim['for'][0]])
+    if storage.exists(claim['key']):
+        storage.delete(claim['key'])
+    storage.save(claim['key'], ContentFile(body))
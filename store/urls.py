@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import LoginView, RegisterView, ProductViewSet, OrderViewSet, TenantViewSet, UserViewSet
+from .async_views import catalog_view, product_list, product_detail
+from .views import LoginView, RefreshView, RegisterView, MetricsView, AnalyticsView, CheckoutView, ReservationListView, ReservationView, UploadTargetView, ProductViewSet, OrderViewSet, TenantViewSet, UserViewSet
 
 router = DefaultRouter()
 router.register(r'products', ProductViewSet, basename='product')
@@ -9,8 +10,19 @@ router.register(r'tenants', TenantViewSet, basename='tenant')
 router.register(r'users', UserViewSet, basename='user')
 
 urlpatterns = [
+    # Async read path for the catalog, writes are delegated to ProductViewSet
+    path('products/', catalog_view(product_list, ProductViewSet.as_view({'get': 'list', 'post': 'create'})), name='product-list'),
+    path('products/<int:pk>/', catalog_view(product_detail, ProductViewSet.as_view({
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+    })), name='product-detail'),
     path('', include(router.urls)),
     path('auth/register/', RegisterView.as_view(), name='auth_register'),
     path('auth/login/', LoginView.as_view(), name='auth_login'),
-    # No refresh endpoint for now, or implement manually if needed
+    path('auth/refresh/', RefreshView.as_view(), name='auth_refresh'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('checkouts/<uuid:pk>/', CheckoutView.as_view(), name='checkout-detail'),
+    path('reservations/', ReservationListView.as_view(), name='reservation-list'),
+    path('reservations/<str:hold_id>/', ReservationView.as_view(), name='reservation-detail'),
+    path('uploads/<str:token>/', UploadTargetView.as_view(), name='upload-target'),
 ]
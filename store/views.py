@@ -2,16 +2,28 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.permissions import IsAdminUser
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from rest_framework.utils.urls import replace_query_param
 from django.db import transaction
+from django.db.models import prefetch_related_objects
 
 from .serializers import (
     RegisterSerializer, ProductSerializer, OrderSerializer, 
-    PlaceOrderSerializer, TenantSerializer, UserSerializer
+    PlaceOrderSerializer, TenantSerializer, UserSerializer, DirectUploadSerializer, FinalizeUploadSerializer,
+    CheckoutSerializer, ReservationSerializer
 )
-from .models import Product, Order, OrderItem, Tenant, StoreUser
+from .models import Product, Order, Tenant, StoreUser, Checkout
 from .permissions import IsStoreOwner, IsOwnerOrStaff, IsCustomer, IsCustomAuthenticated
-from .authentication import verify_pass, create_token
+from .authentication import (
+    verify_pass, create_token, create_refresh_token, rotate_refresh_token, InvalidRefreshToken
+)
+from .pagination import KeysetPagination
+from .tenant_utils import get_current_tenant
+from .fast_serializers import FastListMixin
+from .fieldsets import SparseFieldsMixin
+from . import analytics, checkout, exports, imports, metrics, reservations, search, uploads
 
 class LoginView(APIView):
     permission_classes = [] 
@@ -28,12 +40,27 @@ class LoginView(APIView):
         except StoreUser.DoesNotExist:
              return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
              
-        if verify_pass(password, user.password):
+        def upgrade_hash(new_hash):
+            # update(), not save(): nothing else changed, cached principals stay valid
+            StoreUser.objects.filter(pk=user.pk).update(password=new_hash)
+
+        if verify_pass(password, user.password, setter=upgrade_hash):
             token = create_token(user)
-            return Response({'access': token}, status=status.HTTP_200_OK)
+            return Response({'access': token, 'refresh': create_refresh_token(user)}, status=status.HTTP_200_OK)
         else:
             return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
+class RefreshView(APIView):
+    # Rotates the refresh token; no password check, so it's cheap to call
+    permission_classes = []
+
+    def post(self, request):
+        try:
+            access, refresh = rotate_refresh_token(request.data.get('refresh'))
+        except InvalidRefreshToken:
+            return Response({"error": "Invalid refresh token"}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response({'access': access, 'refresh': refresh}, status=status.HTTP_200_OK)
+
 class RegisterView(APIView):
     permission_classes = []
 
@@ -44,7 +71,94 @@ class RegisterView(APIView):
             return Response({"message": "User created successfully", "username": user.username}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class TenantViewSet(viewsets.ModelViewSet):
+class MetricsView(APIView):
+    # Process-local counters (caches etc). Django admin staff only.
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.collect())
+
+class AnalyticsView(APIView):
+    """
+    Sales of the caller's store from the rollups (store.analytics).
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD (default the last 30 days)
+    &interval=day|week|month&top=10
+    """
+    permission_classes = [IsCustomAuthenticated, IsOwnerOrStaff]
+
+    def get(self, request):
+        tenant_id = request.custom_user.tenant_id
+        if not tenant_id:
+            return Response({"error": "No store linked to this account"}, status=status.HTTP_403_FORBIDDEN)
+        first, last, interval, top = analytics.parse_query(request.query_params)
+        return Response(analytics.report(tenant_id, first, last, interval, top))
+
+class UploadTargetView(APIView):
+    # Where LocalUploadSigner sends direct uploads; the signed token is the credential
+    permission_classes = []
+
+    def put(self, request, token):
+        uploads.receive(request, token)
+        return Response(status=status.HTTP_201_CREATED)
+
+def start_direct_upload(request, instance):
+    serializer = DirectUploadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return Response(uploads.start_upload(request, instance, **serializer.validated_data), status=status.HTTP_201_CREATED)
+
+def finalize_direct_upload(request, instance):
+    serializer = FinalizeUploadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return uploads.finalize_upload(instance, serializer.validated_data['token'])
+
+class CheckoutView(APIView):
+    # Status of the caller's checkout, with its orders once placed
+    permission_classes = [IsCustomAuthenticated]
+
+    def get(self, request, pk):
+        job = get_object_or_404(Checkout, pk=pk, customer_id=request.custom_user.id)
+        response = Response(CheckoutSerializer(job, context={'request': request}).data)
+        if job.status == 'QUEUED':
+            response['Retry-After'] = str(settings.CHECKOUT_RETRY_AFTER)
+        return response
+
+class ReservationListView(APIView):
+    # Hold stock of an enrolled product for the caller's cart, 409 when sold
+    # out. Its id goes in `holds` at checkout; it lapses after RESERVATION_TTL.
+    permission_classes = [IsCustomAuthenticated]
+
+    def post(self, request):
+        serializer = ReservationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product_id, quantity = serializer.validated_data['product_id'], serializer.validated_data['quantity']
+        try:
+            if not reservations.enabled():
+                raise reservations.NotReserved(product_id)
+            # No database query: enrolled products exist
+            hold = reservations.get_engine().hold(request.custom_user.id, product_id, quantity, settings.RESERVATION_TTL)
+        except reservations.NotReserved:
+            if not Product.objects.filter(pk=product_id).exists():
+                return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+            return Response({"error": "This product can't be reserved"}, status=400)
+        if hold is None:
+            return Response({"error": "Not enough stock left"}, status=status.HTTP_409_CONFLICT)
+        return Response(hold, status=status.HTTP_201_CREATED)
+
+class ReservationView(APIView):
+    permission_classes = [IsCustomAuthenticated]
+
+    def get(self, request, hold_id):
+        hold = reservations.get_engine().get(hold_id, request.custom_user.id) if reservations.enabled() else None
+        if hold is None:
+            return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(hold)
+
+    def delete(self, request, hold_id):
+        if not reservations.enabled() or not reservations.get_engine().release(hold_id, request.custom_user.id):
+            return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class TenantViewSet(SparseFieldsMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Tenant.objects.all()
     serializer_class = TenantSerializer
     permission_classes = [IsCustomAuthenticated]
@@ -54,16 +168,45 @@ class TenantViewSet(viewsets.ModelViewSet):
              return [] # Public?
         return [IsCustomAuthenticated()]
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        # The caller's token still carries the old role/tenant claims
+        if getattr(self, 'access_token', None):
+            response.data['access'] = self.access_token
+        return response
+
     def perform_create(self, serializer):
         tenant = serializer.save()
         user = self.request.custom_user
         if user:
+            # custom_user may be a shared cached row or a claims-only principal
+            user = StoreUser.objects.get(pk=user.pk)
             user.tenant = tenant
             user.role = 'OWNER'
             user.save()
+            self.access_token = create_token(user)
+
+    def get_store(self, request):
+        # Only the store's own owner and staff change its logo
+        tenant = self.get_object()
+        user = request.custom_user
+        if user.tenant_id != tenant.pk or user.role not in ('OWNER', 'STAFF'):
+            self.permission_denied(request)
+        return tenant
+
+    @action(detail=True, methods=['post'], url_path='logo-upload')
+    def logo_upload(self, request, pk=None):
+        """Signed target for uploading a logo straight to storage, see store.uploads."""
+        return start_direct_upload(request, self.get_store(request))
 
-class ProductViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post'], url_path='logo-upload/finalize')
+    def finalize_logo_upload(self, request, pk=None):
+        tenant = finalize_direct_upload(request, self.get_store(request))
+        return Response(self.get_serializer(tenant).data)
+
+class ProductViewSet(SparseFieldsMixin, FastListMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
     # Permission handled by get_permissions logic below + IsCustomAuthenticated default if needed
     
     def get_queryset(self):
@@ -78,12 +221,103 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Product.objects.all()
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'search']:
             return []
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'bulk_import',
+                           'image_upload', 'finalize_image_upload', 'reserve_stock']:
             return [IsCustomAuthenticated(), IsOwnerOrStaff()]
         return [IsCustomAuthenticated()]
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked full-text search with facets.
+        ?q=&category=a,b&min_price=&max_price=&in_stock=true&page=&page_size=
+        ?scope=marketplace searches every tenant instead of the current one.
+        """
+        params = request.query_params
+        text = params.get('q', '').strip()
+        filters = search.parse_filters(params)
+
+        if params.get('scope') == 'marketplace':
+            queryset = Product.all_objects.all()
+        else:
+            queryset = Product.objects.all() # TenantManager scoping
+
+        matched = search.match(queryset, text) if text else queryset
+        results = search.apply_filters(matched, filters)
+        if text:
+            results = search.rank(results, text).order_by('-rank', '-created_at', '-id')
+        else:
+            results = results.order_by('-created_at', '-id')
+
+        # Ranked results can't use keyset pagination; offset paging, capped depth
+        page_size = KeysetPagination().get_page_size(request)
+        try:
+            page = min(max(int(params.get('page', 1)), 1), settings.SEARCH_MAX_PAGES)
+        except ValueError:
+            page = 1
+        offset = (page - 1) * page_size
+        rows = list(self.project_queryset(results)[offset:offset + page_size + 1])
+
+        next_link = None
+        if len(rows) > page_size and page < settings.SEARCH_MAX_PAGES:
+            next_link = replace_query_param(request.build_absolute_uri(), 'page', page + 1)
+
+        return Response({
+            'next': next_link,
+            'results': self.get_serializer(rows[:page_size], many=True).data,
+            'facets': search.facets(matched, filters),
+        })
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """
+        Create or update products by sku from a CSV (header row) or NDJSON
+        upload, raw body or multipart `file`. ?type=csv|ndjson overrides the
+        content type, ?dry_run=true only validates. Returns counts and the
+        rows that failed.
+        """
+        # Always the owner's store, as in perform_create
+        user = request.custom_user
+        if not user.tenant:
+            return Response({"error": "No store linked to this account"}, status=status.HTTP_403_FORBIDDEN)
+        return Response(imports.import_products(request, user.tenant))
+
+    @action(detail=True, methods=['post'], url_path='image-upload')
+    def image_upload(self, request, pk=None):
+        """
+        Signed target for uploading the product image straight to storage:
+        {content_type, size, md5} in; PUT the bytes to `url` with `headers`,
+        then POST `token` to image-upload/finalize/. See store.uploads.
+        """
+        return start_direct_upload(request, self.get_object())
+
+    @action(detail=True, methods=['post'], url_path='image-upload/finalize')
+    def finalize_image_upload(self, request, pk=None):
+        product = finalize_direct_upload(request, self.get_object())
+        return Response(self.get_serializer(product).data)
+
+    @action(detail=True, methods=['post', 'delete'], url_path='reserve-stock')
+    def reserve_stock(self, request, pk=None):
+        """
+        POST enrolls the product in stock reservations ahead of a flash sale,
+        DELETE takes it out again. See store.reservations.
+        """
+        product = self.get_object()
+        if not reservations.enabled():
+            return Response({"error": "Stock reservations are not enabled"}, status=400)
+        engine = reservations.get_engine()
+        if request.method == 'DELETE':
+            engine.unenroll(product.pk)
+            # Back to the row: it must count what's been sold meanwhile
+            reservations.flush()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        engine.enroll(product.pk)
+        reservations.reconcile(engine, [product.pk])
+        available, held = engine.counters([product.pk])[product.pk]
+        return Response({'product_id': product.pk, 'available': available, 'held': held})
+
     def perform_create(self, serializer):
         # Explicitly set tenant from the authenticated user to ensure it's not missed
         user = getattr(self.request, 'custom_user', None)
@@ -93,94 +327,114 @@ class ProductViewSet(viewsets.ModelViewSet):
             # Fallback to existing logic (middleware context) or fail if no tenant
             serializer.save()
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsCustomAuthenticated]
 
+    def get_permissions(self):
+        if self.action == 'export':
+            return [IsCustomAuthenticated(), IsOwnerOrStaff()]
+        return super().get_permissions()
+
     def get_queryset(self):
         user = getattr(self.request, 'custom_user', None)
         if not user:
             return Order.objects.none()
         
+        # Items come in one extra query; product names are snapshotted on the item
         # If Owner/Staff -> Show Tenant Orders (Managed by TenantManager automatically)
         if user.role in ['OWNER', 'STAFF']:
-            return Order.objects.all()
-            
-        # If Customer -> Show Own Orders
-        return Order.objects.filter(customer=user)
+            queryset = Order.objects.all()
+        else:
+            # If Customer -> Show Own Orders
+            queryset = Order.objects.filter(customer_id=user.id)
+
+        if self.wants_field('items'):
+            queryset = queryset.prefetch_related('items')
+        return queryset
 
     def create(self, request, *args, **kwargs):
+        """
+        Place orders for a cart, one per store. With `Prefer: respond-async`
+        (or CHECKOUT_QUEUE on) the cart is queued instead: 202 with a
+        checkout to poll at /api/checkouts/<id>/. A repeated Idempotency-Key
+        answers with the first request's checkout rather than ordering again.
+        `holds` from /api/reservations/ are the stock reserved for the cart;
+        queued, they are used when the worker gets to it.
+        """
         input_serializer = PlaceOrderSerializer(data=request.data)
         if not input_serializer.is_valid():
             return Response(input_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        items_data = input_serializer.validated_data['items']
         user = request.custom_user
-        
         if not user:
             return Response({"error": "Authentication required"}, status=401)
 
-        product_ids = [item['product_id'] for item in items_data]
-        products = Product.objects.filter(id__in=product_ids).select_related('tenant')
-        
-        if len(products) != len(product_ids):
-             return Response({"error": "One or more products found invalid"}, status=400)
-
-        product_map = {p.id: p for p in products}
-        orders_by_tenant = {}
-
-        for item in items_data:
-            product = product_map.get(item['product_id'])
-            if product.stock < item['quantity']:
-                return Response({"error": f"Not enough stock for {product.name}"}, status=400)
-
-            tenant_id = product.tenant.id
-            if tenant_id not in orders_by_tenant:
-                orders_by_tenant[tenant_id] = []
-            orders_by_tenant[tenant_id].append({
-                'product': product,
-                'quantity': item['quantity']
-            })
-
-        created_orders = []
+        items = [(item['product_id'], item['quantity']) for item in input_serializer.validated_data['items']]
+        key = request.headers.get('Idempotency-Key')
+        if key is not None and not 0 < len(key) <= checkout.IDEMPOTENCY_KEY_MAX_LENGTH:
+            return Response({"error": "Idempotency-Key must be 1 to 255 characters"}, status=400)
+        queued = settings.CHECKOUT_QUEUE or 'respond-async' in request.headers.get('Prefer', '')
+        holds = input_serializer.validated_data['holds']
 
         try:
-            with transaction.atomic():
-                for tenant_id, order_items in orders_by_tenant.items():
-                    # Create Order for this tenant
-                    tenant_obj = order_items[0]['product'].tenant
-                    
-                    # We need to manually set tenant because if the CUSTOMER is buying from Tenant A,
-                    # but the context is NOT locked to Tenant A (since customer has no tenant), 
-                    # TenantAwareModel might not pick it up automatically or might error.
-                    # We should Explicitly set it.
-                    
-                    order = Order.objects.create(
-                        tenant=tenant_obj,
-                        customer=user,
-                        status='COMPLETED', # Auto-complete for now
-                        total_amount=sum(i['product'].price * i['quantity'] for i in order_items)
-                    )
-                    
-                    for item in order_items:
-                        OrderItem.objects.create(
-                            order=order,
-                            product=item['product'],
-                            quantity=item['quantity'],
-                            price=item['product'].price
-                        )
-                        # Deduct stock
-                        p = item['product']
-                        p.stock -= item['quantity']
-                        p.save()
-                        
-                    created_orders.append(order)
-                    
+            job = checkout.find(user.id, key, items) if key is not None else None
+            if job is not None:
+                return self.checkout_response(request, job, queued, replayed=True)
+            if queued:
+                job, created = checkout.create(user.id, items, key, get_current_tenant(), holds=holds)
+                return self.checkout_response(request, job, queued, replayed=not created)
+            job, created_orders = checkout.place_now(user.id, items, key, get_current_tenant(), holds)
+            if created_orders is None:
+                return self.checkout_response(request, job, queued, replayed=True)
+        except checkout.IdempotencyConflict:
+            return Response({"error": "Idempotency-Key was already used for a different cart"}, status=422)
+        except checkout.CheckoutError as e:
+            return Response({"error": str(e)}, status=400)
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
+        prefetch_related_objects(created_orders, 'items')
         return Response(OrderSerializer(created_orders, many=True).data, status=status.HTTP_201_CREATED)
 
+    def checkout_response(self, request, job, queued, replayed=False):
+        """
+        A synchronous request gets the orders (201) or the error (400) once
+        there is an outcome; a queued one, or one whose checkout is still
+        queued, gets the checkout (202).
+        """
+        if not queued and job.status == 'DONE':
+            response = Response(OrderSerializer(checkout.placed_orders(job), many=True).data, status=status.HTTP_201_CREATED)
+        elif not queued and job.status in ('REJECTED', 'FAILED'):
+            response = Response({"error": job.error}, status=400)
+        else:
+            response = Response(CheckoutSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+            response['Location'] = response.data['url']
+            if job.status == 'QUEUED':
+                response['Retry-After'] = str(settings.CHECKOUT_RETRY_AFTER)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        The store's order history as a streamed download, one row per item
+        (CSV) or one order per line (NDJSON).
+        ?type=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&status=PAID,SHIPPED&gzip=true
+        """
+        tenant_id = request.custom_user.tenant_id
+        if not tenant_id:
+            return Response({"error": "No store linked to this account"}, status=status.HTTP_403_FORBIDDEN)
+        kind, filters, gzip = exports.parse_query(request.query_params)
+        return exports.export_response(request, tenant_id, kind, filters, gzip)
+
+    def perform_update(self, serializer):
+        # Status changes move the sales rollups (signals), commit them together
+        with transaction.atomic():
+            serializer.save()
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = StoreUser.objects.all()
     serializer_class = UserSerializer